@@ -12,6 +12,13 @@
 #########################################################################
 
 from ctypes import *
+import threading
+import time
+
+try:
+	import numpy as np		# only needed for the batched (array) getters
+except ImportError:
+	np = None
 
 MAX_PATH = 260
 ARRAY_MAX_PATH = c_char * MAX_PATH
@@ -39,6 +46,77 @@ ERRCODE = {'ABM_ERROR_SDK_ACQUISITION_STOPPED'					: 100,
 
 INITSESS = {}
 
+##########################################################################
+### Return values of the session commands and of GetCurrentSDKMode
+# The commands return 1 on success and -1 on failure (as checked in testPyX24.py); a command
+# given in the wrong state of the session (e.g. StartAcquisition before InitSession) is ignored
+INIT_SESSION_OK = 1
+INIT_SESSION_NO = -1
+ACQ_STARTED_OK = 1
+ACQ_STARTED_NO = -1
+ACQ_PAUSED_OK = 1
+ACQ_PAUSED_NO = -1
+ACQ_RESUMED_OK = 1
+ACQ_RESUMED_NO = -1
+ACQ_STOPPED_OK = 1
+ACQ_STOPPED_NO = -1
+ID_WRONG_SEQUENCY_OF_COMMAND = -2
+
+SDK_WAITING_MODE = -1
+SDK_NORMAL_MODE = 0
+SDK_IMPEDANCE_MODE = 1
+SDK_TECHNICALMON_MODE = 2
+
+# nSessionType values of InitSession
+ABM_SESSION_RAW = 0
+ABM_SESSION_DECON = 1
+ABM_SESSION_BSTATE = 2
+ABM_SESSION_WORKLOAD = 3
+
+##########################################################################
+### Layout of the samples returned by GetRawData, GetFilteredData and GetDeconData
+# Each sample (frame) holds 6 header values followed by nNumberOfChannel channel values
+HEADER_COLUMNS = ['Epoch', 'Offset', 'Hour', 'Min', 'Sec', 'mSec']
+NUM_HEADER_COLUMNS = len(HEADER_COLUMNS)
+
+# timestamp streams of GetTimeStampsStreamData (nType)
+TIMESTAMP_RAW = 0
+TIMESTAMP_PSD = 1
+TIMESTAMP_DECON = 2
+TIMESTAMP_CLASS = 3
+TIMESTAMP_EKG = 4
+TIMESTAMP_TYPES = [TIMESTAMP_RAW, TIMESTAMP_PSD, TIMESTAMP_DECON, TIMESTAMP_CLASS, TIMESTAMP_EKG]
+
+##########################################################################
+### Layout of the epochs returned by GetBrainState and GetPSDData
+# One row per epoch (one second of samples): the 6 header values of the first sample of the
+# epoch followed by the results. Their timestamps are on TIMESTAMP_CLASS and TIMESTAMP_PSD.
+# GetBrainState: the classification probabilities (ABM_SESSION_BSTATE), followed by the
+# workload indices in ABM_SESSION_WORKLOAD sessions
+BSTATE_COLUMNS = ['SleepOnset', 'Distraction', 'LowEngagement', 'HighEngagement']
+WORKLOAD_COLUMNS = ['WorkloadFBDS', 'WorkloadBDS', 'WorkloadAverage']
+# GetPSDData: PSD_BINS values per channel, channel after channel, in 1 Hz bins from 1 Hz up
+PSD_BINS = 128
+
+## ClassColumns(nSessionType)
+#	Returns the names of the values following the header in the epochs of GetBrainState
+def ClassColumns(nSessionType):
+	if nSessionType == ABM_SESSION_WORKLOAD:
+		return BSTATE_COLUMNS + WORKLOAD_COLUMNS
+	return list(BSTATE_COLUMNS)
+
+# channel montage of the X24 headset (nNumberOfChannel = 24)
+X24_CHANNELS = ['F3', 'F1', 'Fz', 'F2', 'F4', 'C3', 'C1', 'Cz', 'C2', 'C4', 'CPz', 'P3',
+				'P1', 'Pz', 'P2', 'P4', 'POz', 'O1', 'Oz', 'O2', 'EKG', 'AUX1', 'AUX2', 'AUX3']
+
+## ChannelNames(nChannel)
+#	Returns the column names of a frame: the 6 header values followed by the channel names
+#	(the X24 montage for 24 channels, 'Ch1'...'ChN' otherwise)
+def ChannelNames(nChannel):
+	if nChannel == len(X24_CHANNELS):
+		return HEADER_COLUMNS + X24_CHANNELS
+	return HEADER_COLUMNS + ['Ch%d' % (i+1) for i in range(nChannel)]
+
 ############################################################################
 ### Custom Exceptions for communicating with ABM device
 class NoDevice(Exception):
@@ -50,9 +128,83 @@ class NoDevice(Exception):
 class Wronglen(Exception):
 	def __init__(self,value):
 		self.value = value
-	def _str__(self):
+	def __str__(self):
 		return repr(self.value)
 	
+#############################################################################
+### Conversion of SDK buffers to numpy arrays
+
+## FrameArray(pData,nCount,nChannel,copy=True,out=None)
+#	Description:
+#		Wraps a float* returned by GetRawData/GetFilteredData/GetDeconData as a
+#		(nCount, nChannel+6) float32 array.
+#	Input Arguments:
+#		pData, nCount: pointer and number of samples returned by the SDK
+#		nChannel: number of channels (DEVICE_INFO.nNumberOfChannel)
+#		copy: True - the buffer is copied with a single memmove (into out if given)
+#			  False - the array is a view on SDK memory, only valid until the next call to the SDK
+#		out: preallocated C-contiguous float32 array with at least nCount rows and nChannel+6 columns
+#	Output Arguments:
+#		numpy array of shape (nCount, nChannel+6)
+def FrameArray(pData,nCount,nChannel,copy=True,out=None):
+	if np is None:
+		raise ImportError('numpy is required for the array getters')
+	nCol = nChannel + NUM_HEADER_COLUMNS
+	if nCount <= 0 or not pData:
+		if out is not None:
+			return out[:0]
+		return np.empty((0,nCol),dtype=np.float32)
+	if not copy:
+		return np.ctypeslib.as_array(pData,shape=(nCount,nCol))
+	if out is None:
+		out = np.empty((nCount,nCol),dtype=np.float32)
+	else:
+		if out.dtype != np.float32 or not out.flags.c_contiguous:
+			raise ValueError('out must be a C-contiguous float32 array')
+		if out.shape[0] < nCount or out.shape[1] != nCol:
+			raise ValueError('out must have at least %d rows and %d columns' % (nCount,nCol))
+		out = out[:nCount]
+	memmove(out.ctypes.data,pData,nCount*nCol*sizeof(c_float))
+	return out
+
+## DecodeTimeStamps(pChar,nCount)
+#	Description:
+#		Decodes nCount 4-byte big-endian timestamps from the byte array returned by
+#		GetTimeStampsStreamData in one pass.
+#	Output Arguments:
+#		uint32 numpy array of nCount timestamps in milliseconds
+def DecodeTimeStamps(pChar,nCount):
+	if np is None:
+		raise ImportError('numpy is required for the array getters')
+	if nCount <= 0 or not pChar:
+		return np.empty(0,dtype=np.uint32)
+	return np.ctypeslib.as_array(pChar,shape=(4*nCount,)).view('>u4').astype(np.uint32)
+
+## TimeStampUnwrapper
+#	Description:
+#		Turns successive batches of 32-bit millisecond timestamps into monotonic int64
+#		milliseconds by counting the rollovers of the 32-bit counter (every ~49.7 days).
+#		A jump of more than half the counter range is taken as a rollover.
+class TimeStampUnwrapper(object):
+	def __init__(self):
+		self.last = None		# last raw timestamp seen
+		self.offset = 0			# 2**32 * number of rollovers so far
+
+	def unwrap(self,timestamps):
+		ts = np.asarray(timestamps,dtype=np.int64)
+		if len(ts) == 0:
+			return ts
+		prev = np.empty(len(ts),dtype=np.int64)
+		prev[0] = ts[0] if self.last is None else self.last
+		prev[1:] = ts[:-1]
+		step = ts - prev
+		# forward rollover, or a late sample from before the previous rollover
+		rollovers = np.cumsum((step < -2**31).astype(np.int64) - (step > 2**31)) * 2**32
+		out = ts + rollovers + self.offset
+		self.offset += int(rollovers[-1])
+		self.last = int(ts[-1])
+		return out
+
 #############################################################################
 ### Custom structures
 
@@ -67,12 +219,97 @@ class DEVICE_INFO(Structure):
 			  ("nDeviceHandle",c_int),
 			  ("chDeviceID",ARRAY_MAX_PATH)]
 
+##############################################################################
+### Loading and binding the SDK
+
+# Return and argument types of the SDK functions used by ABMHandler
+SDK_PROTOTYPES = {'GetDeviceInfo'				: (POINTER(DEVICE_INFO), None),
+				  'SetDestinationFile'			: (c_int, [c_char_p]),
+				  'InitSession'					: (c_int, [c_int, c_int, c_int, c_bool]),
+				  'StartAcquisition'			: (c_int, []),
+				  'PauseAcquisition'			: (c_int, []),
+				  'ResumeAcquisition'			: (c_int, []),
+				  'StopAcquisition'				: (c_int, []),
+				  'GetRawData'					: (POINTER(c_float), [POINTER(c_int)]),
+				  'GetFilteredData'				: (POINTER(c_float), [POINTER(c_int)]),
+				  'GetDeconData'				: (POINTER(c_float), [POINTER(c_int)]),
+				  'GetBrainState'				: (POINTER(c_float), [POINTER(c_int)]),
+				  'GetPSDData'					: (POINTER(c_float), [POINTER(c_int)]),
+				  'GetTimeStampsStreamData'		: (POINTER(c_ubyte), [c_int]),
+				  'GetCurrentSDKMode'			: (c_int, []),
+				  'GetThirdPartyData'			: (POINTER(c_ubyte), [POINTER(c_int)])}
+
+## Library loaders
+#	Callables returning the object that exposes the SDK functions, passed to ABMHandler(loader=...)
+#	WinDLLLoader('ABM_Athena') - the SDK DLL on Windows (stdcall, like windll.ABM_Athena)
+#	CDLLLoader(path) - a shared library with the same exports, e.g. a stub on Linux
+class WinDLLLoader(object):
+	def __init__(self,name='ABM_Athena'):
+		self.name = name
+	def __call__(self):
+		return WinDLL(self.name)
+
+class CDLLLoader(object):
+	def __init__(self,path):
+		self.path = path
+	def __call__(self):
+		return CDLL(self.path)
+
+## ABMBinding
+#	Description:
+#		Looks up every function of SDK_PROTOTYPES in the library once and sets its
+#		restype/argtypes, so the calls on the acquisition path do neither. The bound
+#		functions are attributes of the binding (binding.GetRawData); functions the library
+#		does not export are set to None.
+#	Input Arguments:
+#		abmDLL: library returned by a loader (or a stand-in such as PyABMSim.FakeABMDLL)
+#		prototypes: {name: (restype, argtypes)}, defaults to SDK_PROTOTYPES
+class ABMBinding(object):
+	def __init__(self,abmDLL,prototypes=SDK_PROTOTYPES):
+		self.abmDLL = abmDLL
+		self.missing = []
+		for (name,(restype,argtypes)) in prototypes.items():
+			try:
+				func = getattr(abmDLL,name)
+			except AttributeError:
+				self.missing.append(name)
+				setattr(self,name,None)
+				continue
+			func.restype = restype
+			func.argtypes = argtypes
+			setattr(self,name,func)
+
 ##############################################################################
 ### Class for communicating the ABM SDK
 # This Class defines functions for calling the DLL defined functions
 class ABMHandler:
-	def __init__(self):
-		self.abmDLL = windll.ABM_Athena		# Connect to main ABM DLL, use 'windll' instead of 'cdll'
+	# abmDLL: object exposing the SDK functions, defaults to ABM_Athena.dll.
+	#	Pass a stand-in (e.g. PyABMSim.FakeABMDLL) to run without the DLLs.
+	# loader: callable returning abmDLL (see WinDLLLoader, CDLLLoader, PyABMSim.SimLoader), used when abmDLL is None
+	# The SDK functions are bound once here (see ABMBinding). The getters reuse one c_int each
+	# for nCount/nBytes, so read its value before calling the same getter again.
+	def __init__(self,abmDLL=None,loader=None):
+		if abmDLL is None:
+			if loader is None:
+				loader = WinDLLLoader('ABM_Athena')		# Connect to main ABM DLL, use 'windll' instead of 'cdll'
+			abmDLL = loader()
+		self.abmDLL = abmDLL
+		self.sdk = ABMBinding(abmDLL)
+		self._nRawCount = c_int()
+		self._nFilteredCount = c_int()
+		self._nDeconCount = c_int()
+		self._nClassCount = c_int()
+		self._nPSDCount = c_int()
+		self._nTPBytes = c_int()
+		self._pRawCount = byref(self._nRawCount)
+		self._pFilteredCount = byref(self._nFilteredCount)
+		self._pDeconCount = byref(self._nDeconCount)
+		self._pClassCount = byref(self._nClassCount)
+		self._pPSDCount = byref(self._nPSDCount)
+		self._pTPBytes = byref(self._nTPBytes)
+		self.nChannel = None				# set by GetDeviceInfo, used to shape the array getters
+		self.sessionType = None				# set by InitSession, used to shape GetBrainStateArray
+		self.tsUnwrappers = dict((nType,TimeStampUnwrapper()) for nType in TIMESTAMP_TYPES)
 
 	## GetDeviceInfo(self):
 	# Checks whether ABM device is properly connected to ABM receiver. 
@@ -94,12 +331,10 @@ class ABMHandler:
 	#			char chDeviceID[MAX_PATH]; //Reserved
 	#		}
 	def GetDeviceInfo(self):
-		getDevInfo = self.abmDLL.GetDeviceInfo
-		getDevInfo.argtypes = None
-		getDevInfo.restype = POINTER(DEVICE_INFO)
- 		info = getDevInfo(None)
+		info = self.sdk.GetDeviceInfo(None)
 		if info.contents.nNumberOfChannel == -1:
 			raise NoDevice(info.contents.nNumberOfChannel)
+		self.nChannel = info.contents.nNumberOfChannel
 		return info.contents
 
 	## SetDestinationFile(self):
@@ -115,7 +350,7 @@ class ABMHandler:
 	#		FALSE //Failed
 	def SetDestinationFile(self,path):
 		c_path = c_char_p(path)
-		return self.abmDLL.SetDestinationFile(c_path)
+		return self.sdk.SetDestinationFile(c_path)
 
 	## InitSession(self):
 	#	Description:
@@ -150,9 +385,10 @@ class ABMHandler:
 	#			//failed
 	def InitSession(self,nDeviceType,nSessionType,nSelectedDeviceHandle,PlayEBS):
 		bPlayEBS = c_bool(PlayEBS)
-		InitSess = self.abmDLL.InitSession
-		InitSess.argtypes = [c_int,c_int,c_int,c_bool]
-		return InitSess(nDeviceType,nSessionType,nSelectedDeviceHandle,bPlayEBS)
+		result = self.sdk.InitSession(nDeviceType,nSessionType,nSelectedDeviceHandle,bPlayEBS)
+		if result == INIT_SESSION_OK:
+			self.sessionType = nSessionType
+		return result
 
 	## StartAcquisition
 	#	Description:
@@ -172,7 +408,7 @@ class ABMHandler:
 	#		else
 	#			//failed
 	def StartAcquisition(self):
-		return self.abmDLL.StartAcquisition()
+		return self.sdk.StartAcquisition()
 
 	## PauseAcquisition
 	#	Description:
@@ -192,7 +428,7 @@ class ABMHandler:
 	#		else
 	#			//failed
 	def PauseAcquisition(self):
-		return self.abmDLL.PauseAcquisition()
+		return self.sdk.PauseAcquisition()
 
 	## ResumeAcquisition
 	#	Description:
@@ -212,7 +448,7 @@ class ABMHandler:
 	#		else
 	#			//failed
 	def ResumeAcquisition(self):
-		return self.abmDLL.ResumeAcquisition()
+		return self.sdk.ResumeAcquisition()
 
 	## StopAcquisition
 	#	Description:
@@ -232,7 +468,7 @@ class ABMHandler:
 	#		else
 	#			//failed
 	def StopAcquisition(self):
-		return self.abmDLL.StopAcquisition()
+		return self.sdk.StopAcquisition()
 
 	## GetRawData
 	#	Description:
@@ -250,11 +486,8 @@ class ABMHandler:
 	#		float *pData;
 	#		pData = GetRawData(nCount);	
 	def GetRawData(self):
-		nCount = c_int()
-		getData = self.abmDLL.GetRawData
-		getData.restype = POINTER(c_float)
-		pData = getData(byref(nCount))
-		return (pData,nCount)
+		pData = self.sdk.GetRawData(self._pRawCount)
+		return (pData,self._nRawCount)
 
 	## GetFilteredData
 	#	Description:
@@ -272,11 +505,8 @@ class ABMHandler:
 	#		float *pData;
 	#		pData = GetRawData(nCount);
 	def GetFilteredData(self):
-		nCount = c_int()
-		getData = self.abmDLL.GetFilteredData
-		getData.restype = POINTER(c_float)
-		pData = getData(byref(nCount))
-		return (pData,nCount)
+		pData = self.sdk.GetFilteredData(self._pFilteredCount)
+		return (pData,self._nFilteredCount)
 
 	## GetDeconData
 	#	Description:
@@ -294,11 +524,47 @@ class ABMHandler:
 	#		float *pData;
 	#		pData = GetDeconData(nCount);
 	def GetDeconData(self):
-		nCount = c_int()
-		getData = self.abmDLL.GetDeconData
-		getData.restype = POINTER(c_float)
-		pData = getData(byref(nCount))
-		return (pData,nCount)
+		pData = self.sdk.GetDeconData(self._pDeconCount)
+		return (pData,self._nDeconCount)
+
+	## GetBrainState
+	#	Description:
+	#		Gets the Brain State classification (ABM_SESSION_BSTATE) and B-Alert Workload
+	#		(ABM_SESSION_WORKLOAD) results of the epochs completed since the previous call.
+	#	Format:
+	#		float* GetBrainState ( int& nCount )
+	#	Input Arguments:
+	#		1. Type: Address to int
+	#		nCount: updated with the number of epochs returned in the output argument
+	#	Output Arguments:
+	#		1. Type: float*
+	#		Pointer to array of float values, (6+nValues)*nCount: per epoch the 6 header values followed by the nValues of ClassColumns(nSessionType). The timestamps of the epochs are returned by GetTimeStampsStreamData(TIMESTAMP_CLASS).
+	#	PseudoCode:
+	#		int nCount;
+	#		float *pData;
+	#		pData = GetBrainState(nCount);
+	def GetBrainState(self):
+		pData = self.sdk.GetBrainState(self._pClassCount)
+		return (pData,self._nClassCount)
+
+	## GetPSDData
+	#	Description:
+	#		Gets the power spectral density of the raw data of the epochs completed since the previous call.
+	#	Format:
+	#		float* GetPSDData ( int& nCount )
+	#	Input Arguments:
+	#		1. Type: Address to int
+	#		nCount: updated with the number of epochs returned in the output argument
+	#	Output Arguments:
+	#		1. Type: float*
+	#		Pointer to array of float values, (6+nChannel*PSD_BINS)*nCount: per epoch the 6 header values followed by PSD_BINS 1 Hz bins of each channel. The timestamps of the epochs are returned by GetTimeStampsStreamData(TIMESTAMP_PSD).
+	#	PseudoCode:
+	#		int nCount;
+	#		float *pData;
+	#		pData = GetPSDData(nCount);
+	def GetPSDData(self):
+		pData = self.sdk.GetPSDData(self._pPSDCount)
+		return (pData,self._nPSDCount)
 
 	## GetTimeStampsStreamData
 	#	Description:
@@ -320,11 +586,24 @@ class ABMHandler:
 	#		int nType;
 	#		unsigned char *pucTSData;
 	#		pucTSData = GetTimeStampsStreamData(nType);
-	def GetTimeStampsStreamData(self,nType):
-		getTime = self.abmDLL.GetTimeStampsStreamData
-		getTime.restype = POINTER(c_ubyte)
-		pChar = getTime(nType)
-		return pChar
+	#	Decoded mode:
+	#		The SDK does not report how many timestamps are pending; pass nCount (the number of
+	#		samples returned by the matching data getter, e.g. GetRawData for TIMESTAMP_RAW) to
+	#		get them decoded as a uint32 numpy array instead of a pointer. With unwrap=True the
+	#		timestamps are returned as monotonic int64 milliseconds, counter rollovers being
+	#		tracked separately for each of the five streams.
+	#		(rData,nCount) = ABMengine.GetRawData()
+	#		timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,nCount.value)
+	def GetTimeStampsStreamData(self,nType,nCount=None,unwrap=False):
+		if nCount is None:
+			return self.sdk.GetTimeStampsStreamData(nType)
+		if nType not in self.tsUnwrappers:
+			raise ValueError('Unknown timestamp stream type: %r' % (nType,))
+		pChar = self.sdk.GetTimeStampsStreamData(nType)
+		timeStamps = DecodeTimeStamps(pChar,nCount)
+		if unwrap:
+			return self.tsUnwrappers[nType].unwrap(timeStamps)
+		return timeStamps
 
 	## GetCurrentSDKMode
 	#	Description:
@@ -344,7 +623,7 @@ class ABMHandler:
 	#		int nMode;
 	#		nMode = GetCurrentSDKMode();
 	def GetCurrentSDKMode(self):
-		return self.abmDLL.GetCurrentSDKMode()
+		return self.sdk.GetCurrentSDKMode()
 
 	## GetThirdPartyData
 	#	Description:
@@ -370,9 +649,279 @@ class ABMHandler:
 	#		unsigned char *pucTPData;
 	#		pucTPData = GetThirdPartyData(nSize);
 	def GetThirdPartyData(self):
-		nBytes = c_int()
-		getTpy = self.abmDLL.GetThirdPartyData
-		getTpy.restype = POINTER(c_ubyte)
-		pChar = getTpy(byref(nBytes))
-		return (pChar,nBytes)
+		pChar = self.sdk.GetThirdPartyData(self._pTPBytes)
+		return (pChar,self._nTPBytes)
+
+	## GetRawDataArray, GetFilteredDataArray, GetDeconDataArray
+	#	Description:
+	#		Batched versions of GetRawData, GetFilteredData and GetDeconData. The samples are
+	#		returned as one (nCount, nChannel+6) float32 array instead of a pointer that has to be
+	#		indexed one float at a time. The layout is taken from GetDeviceInfo().nNumberOfChannel
+	#		(GetDeviceInfo is called on first use if it has not been called yet).
+	#	Input Arguments:
+	#		copy, out: see FrameArray. With copy=False the array points into SDK memory and is
+	#			overwritten by the next call to the same getter.
+	#	Output Arguments:
+	#		numpy array of shape (nCount, nChannel+6), columns HEADER_COLUMNS + channels
+	#	PseudoCode:
+	#		data = ABMengine.GetRawDataArray()
+	#		eeg = data[:,NUM_HEADER_COLUMNS:]
+	def GetRawDataArray(self,copy=True,out=None):
+		(pData,nCount) = self.GetRawData()
+		return FrameArray(pData,nCount.value,self._NumChannels(),copy,out)
+
+	def GetFilteredDataArray(self,copy=True,out=None):
+		(pData,nCount) = self.GetFilteredData()
+		return FrameArray(pData,nCount.value,self._NumChannels(),copy,out)
+
+	def GetDeconDataArray(self,copy=True,out=None):
+		(pData,nCount) = self.GetDeconData()
+		return FrameArray(pData,nCount.value,self._NumChannels(),copy,out)
+
+	## GetBrainStateArray, GetPSDDataArray
+	#	Description:
+	#		Batched versions of GetBrainState and GetPSDData: the epochs as one (nCount, 6+nValues)
+	#		float32 array, nValues being len(ClassColumns(nSessionType)) or nChannel*PSD_BINS.
+	#		copy and out as for GetRawDataArray. nSessionType defaults to the session type given
+	#		to InitSession of this handler; when the session was initialized some other way
+	#		(e.g. directly through self.sdk), it has to be passed, otherwise ValueError is raised.
+	#	PseudoCode:
+	#		epochs = ABMengine.GetBrainStateArray()
+	#		timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_CLASS,len(epochs))
+	def GetBrainStateArray(self,copy=True,out=None,nSessionType=None):
+		if nSessionType is None:
+			nSessionType = self.sessionType
+		if nSessionType is None:
+			raise ValueError('Unknown session type: call InitSession on this handler or pass nSessionType')
+		(pData,nCount) = self.GetBrainState()
+		return FrameArray(pData,nCount.value,len(ClassColumns(nSessionType)),copy,out)
+
+	def GetPSDDataArray(self,copy=True,out=None):
+		(pData,nCount) = self.GetPSDData()
+		return FrameArray(pData,nCount.value,self._NumChannels() * PSD_BINS,copy,out)
+
+	## GetThirdPartyDataArray(copy=True)
+	#	Description:
+	#		GetThirdPartyData as a uint8 array of the nBytes bytes returned, to be given to
+	#		PyABMESU.ESUPacketParser. With copy=False the array points into SDK memory.
+	def GetThirdPartyDataArray(self,copy=True):
+		if np is None:
+			raise ImportError('numpy is required for the array getters')
+		(pChar,nBytes) = self.GetThirdPartyData()
+		if nBytes.value <= 0 or not pChar:
+			return np.empty(0,dtype=np.uint8)
+		data = np.ctypeslib.as_array(pChar,shape=(nBytes.value,))
+		if copy:
+			return data.copy()
+		return data
+
+	def _NumChannels(self):
+		if self.nChannel is None:
+			self.GetDeviceInfo()
+		return self.nChannel
+
+
+##############################################################################
+### Ring buffer shared between the acquisition thread and its consumers
+
+## FrameRing
+#	Description:
+#		Preallocated single-producer/single-consumer ring buffer of float32 frames and their
+#		uint32 timestamps. The producer (ABMStreamer's poller thread) only moves 'head', the
+#		consumer only moves 'tail', so neither side takes a lock. When the consumer falls more
+#		than 'capacity' frames behind, the oldest frames are overwritten and counted in 'overruns'.
+#	Input Arguments:
+#		capacity: number of frames kept
+#		nCol: number of values per frame (nChannel+6)
+class FrameRing(object):
+	def __init__(self,capacity,nCol):
+		self.capacity = capacity
+		self.nCol = nCol
+		self.frames = np.zeros((capacity,nCol),dtype=np.float32)
+		self.timestamps = np.zeros(capacity,dtype=np.uint32)
+		self.head = 0			# frames written so far (published)
+		self.reserved = 0		# frames written so far, including a write in progress
+		self.tail = 0			# frames read so far
+		self.overruns = 0		# frames overwritten before the consumer read them
+		self._event = threading.Event()
+
+	def __len__(self):
+		return min(self.head - self.tail,self.capacity)
+
+	## write(frames,timestamps) - producer side
+	def write(self,frames,timestamps):
+		n = len(frames)
+		if n == 0:
+			return
+		head = self.head
+		if n > self.capacity:		# only the newest frames fit
+			head += n - self.capacity
+			frames = frames[-self.capacity:]
+			timestamps = timestamps[-self.capacity:]
+			n = self.capacity
+		self.reserved = head + n	# announce the slots about to be overwritten
+		i = head % self.capacity
+		first = min(n,self.capacity - i)
+		self.frames[i:i+first] = frames[:first]
+		self.timestamps[i:i+first] = timestamps[:first]
+		if first < n:
+			self.frames[:n-first] = frames[first:]
+			self.timestamps[:n-first] = timestamps[first:]
+		self.head = head + n		# publish
+		self._event.set()
+
+	# copy frames [start, start+n) out of the ring, returns (frames, timestamps, first valid row)
+	def _Copy(self,start,n):
+		frames = np.empty((n,self.nCol),dtype=np.float32)
+		timestamps = np.empty(n,dtype=np.uint32)
+		i = start % self.capacity
+		first = min(n,self.capacity - i)
+		frames[:first] = self.frames[i:i+first]
+		timestamps[:first] = self.timestamps[i:i+first]
+		if first < n:
+			frames[first:] = self.frames[:n-first]
+			timestamps[first:] = self.timestamps[:n-first]
+		# rows the producer started overwriting while we were copying are not valid
+		lost = min(max(self.reserved - self.capacity - start,0),n)
+		return (frames,timestamps,lost)
+
+	## read(n=None,timeout=0) - consumer side
+	#	Returns up to n (default: all) unread frames and their timestamps, oldest first.
+	#	If fewer than n frames are available, waits at most 'timeout' seconds for more.
+	def read(self,n=None,timeout=0):
+		if n is not None and timeout and self.head - self.tail < n:
+			deadline = time.time() + timeout
+			while self.head - self.tail < n:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self._event.clear()
+				if self.head - self.tail < n:
+					self._event.wait(remaining)
+		head = self.head
+		tail = self.tail
+		if head - tail > self.capacity:
+			self.overruns += head - tail - self.capacity
+			tail = head - self.capacity
+		count = head - tail
+		if n is not None:
+			count = min(count,n)
+		(frames,timestamps,lost) = self._Copy(tail,count)
+		self.overruns += lost
+		self.tail = tail + count
+		return (frames[lost:],timestamps[lost:])
+
+	## latest(n) - consumer side
+	#	Returns a copy of the n newest frames and timestamps without consuming them.
+	def latest(self,n):
+		head = self.head
+		n = min(n,head,self.capacity)
+		(frames,timestamps,lost) = self._Copy(head - n,n)
+		return (frames[lost:],timestamps[lost:])
+
+##############################################################################
+### Background acquisition
+
+## ABMStreamer
+#	Description:
+#		Polls GetRawData and GetTimeStampsStreamData on a dedicated thread and stores the
+#		samples in a FrameRing, so slow consumers (disk writes, analysis) on other threads do
+#		not delay the polling. The poll interval adapts so that each poll returns about
+#		'targetLatency' seconds of samples.
+#	Input Arguments:
+#		ABMengine: ABMHandler with an initialized session (acquisition started by the caller)
+#		sampleRate: sampling rate of the device in Hz
+#		bufferSeconds: length of the ring buffer
+#		targetLatency, minInterval, maxInterval: poll interval control, in seconds
+#		epochStreams: objects with a poll() method (e.g. PyABMClassification.BrainStateStream)
+#			polled on the same thread every epochInterval seconds, so the SDK is only called
+#			from one thread
+#	PseudoCode:
+#		streamer = ABMStreamer(ABMengine)
+#		streamer.start()
+#		(frames,timestamps) = streamer.read(256,timeout=1.5)
+#		streamer.stop()
+class ABMStreamer(object):
+	def __init__(self,ABMengine,sampleRate=256,bufferSeconds=30,targetLatency=0.05,
+				 minInterval=0.002,maxInterval=0.5,epochStreams=(),epochInterval=0.25):
+		self.ABMengine = ABMengine
+		self.sampleRate = sampleRate
+		self.nCol = ABMengine._NumChannels() + NUM_HEADER_COLUMNS
+		self.ring = FrameRing(int(bufferSeconds * sampleRate),self.nCol)
+		self.targetLatency = targetLatency
+		self.minInterval = minInterval
+		self.maxInterval = maxInterval
+		self.interval = targetLatency
+		self.epochStreams = list(epochStreams)
+		self.epochInterval = epochInterval
+		self.polls = 0				# number of GetRawData calls
+		self.emptyPolls = 0			# polls that returned no samples
+		self.samples = 0			# samples received from the SDK
+		self.maxBatch = 0			# largest number of samples returned by one poll
+		self.error = None			# exception that stopped the poller, if any
+		self._stop = threading.Event()
+		self._thread = None
+
+	@property
+	def overruns(self):
+		return self.ring.overruns
+
+	def start(self):
+		if self._thread is not None and self._thread.is_alive():
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._Run,name='ABMStreamer')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self,timeout=None):
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(timeout)
+
+	def running(self):
+		return self._thread is not None and self._thread.is_alive()
+
+	## poll() - get the samples pending in the SDK and push them into the ring, returns their number
+	def poll(self):
+		frames = self.ABMengine.GetRawDataArray(copy=False)
+		n = len(frames)
+		self.polls += 1
+		if n == 0:
+			self.emptyPolls += 1
+			return 0
+		timestamps = self.ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,n)
+		self.ring.write(frames,timestamps)
+		self.samples += n
+		self.maxBatch = max(self.maxBatch,n)
+		return n
+
+	def _Run(self):
+		target = max(1.0,self.targetLatency * self.sampleRate)
+		nextEpochs = time.time()
+		try:
+			while not self._stop.is_set():
+				n = self.poll()
+				if self.epochStreams and time.time() >= nextEpochs:
+					for stream in self.epochStreams:
+						stream.poll()
+					nextEpochs = time.time() + self.epochInterval
+				# aim for 'target' samples per poll
+				if n == 0:
+					interval = self.interval * 2
+				else:
+					interval = 0.5 * self.interval + 0.5 * self.interval * target / n
+				self.interval = min(max(interval,self.minInterval),self.maxInterval)
+				self._stop.wait(self.interval)
+		except Exception as e:
+			self.error = e
+
+	## read(n=None,timeout=0)
+	#	Returns up to n unread (frames, timestamps), waiting at most 'timeout' seconds for n frames
+	def read(self,n=None,timeout=0):
+		return self.ring.read(n,timeout)
 
+	## latest(seconds)
+	#	Returns the newest 'seconds' of (frames, timestamps) without consuming them
+	def latest(self,seconds):
+		return self.ring.latest(int(round(seconds * self.sampleRate)))
@@ -0,0 +1,180 @@
+#########################################################################
+#	PyABMAlign.py
+#	Online alignment of the EEG samples (GetRawData + TIMESTAMP_RAW) with the
+#	event markers of the MC-ESU (GetThirdPartyData, see PyABMESU.py)
+#
+#	Usage:
+#		aligner = EventAligner(nCh+6)
+#		loop:
+#			frames = ABMengine.GetRawDataArray()
+#			aligner.push_samples(frames,ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames)))
+#			aligner.push_events(parser.feed(ABMengine.GetThirdPartyDataArray()))
+#			(events,epochs) = aligner.epochs(1,-0.2,0.8)
+#########################################################################
+
+import numpy as np
+
+from PyABM import TimeStampUnwrapper
+
+# aligned (and pending) events
+#	time: unwrapped event timestamp in milliseconds
+#	type: packet type of the marker
+#	sample: position of the nearest sample (counted from the first sample pushed)
+#	position: fractional sample position of the event, interpolated between the two samples around it
+#	lag: event time minus the time of the nearest sample, in milliseconds
+EVENT_DTYPE = np.dtype([('time', np.int64),
+						('type', np.int32),
+						('sample', np.int64),
+						('position', np.float64),
+						('lag', np.float64)])
+
+## EventAligner
+#	Description:
+#		Merge-join of the sample and marker streams on their timestamps. Samples are kept in a
+#		preallocated ring of 'bufferSeconds' whose contents are stored twice in a row, so that
+#		any stretch of samples still in the buffer is one contiguous slice and epochs can be
+#		returned as views without copying. Markers wait until a sample at or after their time
+#		has arrived, then are attached to the nearest sample.
+#		Timestamps given as uint32 (as returned by the SDK) are unwrapped, markers following the
+#		rollovers of the sample timestamps; int64 timestamps are taken as already unwrapped.
+#		Samples and markers must use the same clock (ESU time).
+#	Input Arguments:
+#		nCol: values per frame (nChannel+6)
+#		sampleRate: sampling rate in Hz
+#		bufferSeconds: how much of the sample stream is kept
+#		maxEvents: number of aligned events kept
+#		maxPending: number of markers kept waiting for their samples, the ones furthest
+#			ahead are dropped beyond it (default: maxEvents)
+class EventAligner(object):
+	def __init__(self,nCol,sampleRate=256,bufferSeconds=60,maxEvents=4096,maxPending=None):
+		self.nCol = nCol
+		self.sampleRate = float(sampleRate)
+		self.capacity = int(bufferSeconds * sampleRate)
+		self.maxEvents = maxEvents
+		self.maxPending = maxEvents if maxPending is None else maxPending
+		self.frames = np.zeros((2 * self.capacity,nCol),dtype=np.float32)
+		self.times = np.zeros(2 * self.capacity,dtype=np.int64)
+		self.head = 0				# samples pushed so far
+		self.events = np.zeros(0,dtype=EVENT_DTYPE)
+		self.pending = np.zeros(0,dtype=EVENT_DTYPE)
+		self.dropped = 0			# events older than the samples in the buffer, or over maxPending
+		self._sampleUnwrapper = TimeStampUnwrapper()
+
+	# position of the oldest sample still in the buffer
+	def _Oldest(self):
+		return max(0,self.head - self.capacity)
+
+	## window(start,stop)
+	#	Returns (frames, times) of samples [start, stop) as views, or None if they are not in the buffer
+	def window(self,start,stop):
+		if start < self._Oldest() or stop > self.head or stop < start:
+			return None
+		i = start % self.capacity
+		return (self.frames[i:i+stop-start],self.times[i:i+stop-start])
+
+	## push_samples(frames,timestamps)
+	def push_samples(self,frames,timestamps):
+		n = len(frames)
+		if n == 0:
+			return
+		timestamps = np.asarray(timestamps)
+		if timestamps.dtype != np.int64:
+			timestamps = self._sampleUnwrapper.unwrap(timestamps)
+		if n > self.capacity:
+			self.head += n - self.capacity
+			frames = frames[-self.capacity:]
+			timestamps = timestamps[-self.capacity:]
+			n = self.capacity
+		i = self.head % self.capacity
+		first = min(n,self.capacity - i)
+		for offset in (0,self.capacity):
+			self.frames[offset+i:offset+i+first] = frames[:first]
+			self.times[offset+i:offset+i+first] = timestamps[:first]
+		# the part that wraps around goes to the start of both copies
+		rest = n - first
+		if rest:
+			for offset in (0,self.capacity):
+				self.frames[offset:offset+rest] = frames[first:]
+				self.times[offset:offset+rest] = timestamps[first:]
+		self.head += n
+		self._Align()
+
+	## push_events(timestamps,types=None)
+	#	Adds markers, given as timestamps and types or as a PyABMESU.ESUBatch
+	def push_events(self,timestamps,types=None):
+		if hasattr(timestamps,'packets'):		# ESUBatch
+			types = timestamps.packets['type']
+			timestamps = timestamps.packets['timestamp']
+		timestamps = np.asarray(timestamps)
+		if len(timestamps) == 0:
+			return
+		if timestamps.dtype != np.int64:
+			# the rollover count is taken from the sample stream: each marker is placed in the
+			# 2**32 ms period that brings it closest to the newest sample
+			timestamps = timestamps.astype(np.int64)
+			if self.head:
+				reference = self.times[(self.head - 1) % self.capacity]
+				timestamps += np.round((reference - timestamps) / 2.0**32).astype(np.int64) * 2**32
+		new = np.zeros(len(timestamps),dtype=EVENT_DTYPE)
+		new['time'] = timestamps
+		new['type'] = 0 if types is None else types
+		new['sample'] = -1
+		# markers come mostly in order: only the new ones are sorted, then merged into the queue
+		new = new[np.argsort(new['time'],kind='mergesort')]
+		pending = np.insert(self.pending,np.searchsorted(self.pending['time'],new['time'],'right'),new)
+		if len(pending) > self.maxPending:
+			self.dropped += len(pending) - self.maxPending
+			pending = pending[:self.maxPending]
+		self.pending = pending
+		self._Align()
+
+	# attach the pending events that are covered by the samples received so far
+	def _Align(self):
+		if self.head == 0 or len(self.pending) == 0:
+			return
+		oldest = self._Oldest()
+		(frames,times) = self.window(oldest,self.head)
+		k = np.searchsorted(self.pending['time'],times[-1],'right')
+		if k == 0:
+			return
+		events = self.pending[:k]
+		self.pending = self.pending[k:]
+		# half a sample period of slack before the oldest sample
+		tooOld = events['time'] < times[0] - 500.0 / self.sampleRate
+		self.dropped += int(tooOld.sum())
+		events = events[~tooOld]
+		if len(events) == 0:
+			return
+		t = events['time']
+		after = np.clip(np.searchsorted(times,t,'left'),0,len(times) - 1)	# first sample at or after t
+		before = np.maximum(after - 1,0)
+		tBefore = times[before]
+		tAfter = times[after]
+		nearest = np.where(np.abs(t - tBefore) <= np.abs(tAfter - t),before,after)
+		span = (tAfter - tBefore).astype(np.float64)
+		frac = np.where(span > 0,(t - tBefore) / np.where(span > 0,span,1.0),0.0)
+		events['sample'] = oldest + nearest
+		events['position'] = oldest + before + np.clip(frac,0.0,1.0) * (after - before)
+		events['lag'] = (t - times[nearest]).astype(np.float64)
+		self.events = np.concatenate([self.events,events])[-self.maxEvents:]
+
+	## epochs(event_type,tmin,tmax)
+	#	Description:
+	#		Returns the samples from tmin to tmax seconds around each aligned event of
+	#		event_type (None: all events) whose epoch is entirely in the buffer.
+	#	Output Arguments:
+	#		(events, epochs): the EVENT_DTYPE records and a list of (nSamples, nCol) views on
+	#		the sample buffer, valid until they are overwritten ('bufferSeconds' later)
+	def epochs(self,event_type,tmin,tmax):
+		s0 = int(round(tmin * self.sampleRate))
+		s1 = int(round(tmax * self.sampleRate))
+		events = self.events
+		if event_type is not None:
+			events = events[events['type'] == event_type]
+		start = events['sample'] + s0
+		ok = (start >= self._Oldest()) & (start + (s1 - s0) <= self.head)
+		events = events[ok]
+		epochs = []
+		for i in (start[ok] % self.capacity).tolist():
+			epochs.append(self.frames[i:i+s1-s0])
+		return (events,epochs)
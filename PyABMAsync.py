@@ -0,0 +1,299 @@
+#########################################################################
+#	PyABMAsync.py
+#	asyncio interface to the ABM SDK (Python 3.5+)
+#
+#	The SDK functions are blocking ctypes calls. AsyncABMHandler runs all of
+#	them on one dedicated thread, so they never block the event loop and are
+#	never made concurrently, and hands the results back as awaitables.
+#	Batches of samples are streamed by async iterators that stop polling the
+#	SDK while the consumer falls behind (the samples then wait in the SDK's
+#	own buffer) or, for live displays, drop the oldest batches instead.
+#
+#	Usage:
+#		sdk = AsyncABMHandler()					# or AsyncABMHandler(loader=SimLoader(...))
+#		info = await sdk.GetDeviceInfo()
+#		await sdk.InitSession(3,0,-1,0)
+#		await sdk.StartAcquisition()
+#		stream = sdk.stream(interval=0.05)
+#		async for (frames,timestamps) in stream.raw():
+#			...
+#		stream.close()
+#		await sdk.StopAcquisition()
+#		await sdk.aclose()
+#########################################################################
+
+import asyncio
+import collections
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PyABM import ABMHandler, TIMESTAMP_CLASS, TIMESTAMP_DECON, TIMESTAMP_PSD, TIMESTAMP_RAW
+
+## AsyncABMHandler
+#	Description:
+#		Awaitable versions of the ABMHandler methods. Every call is queued to a single
+#		worker thread and the SDK is only touched from that thread; once an
+#		ABMHandler is given to an AsyncABMHandler it should not be used directly any more.
+#		Getters return copies (GetRawDataArray etc.), since the SDK buffers are only valid
+#		until the next call, which may already be running when the coroutine resumes.
+#	Input Arguments:
+#		ABMengine: an ABMHandler, created with the remaining keyword arguments
+#			(abmDLL, loader) when None
+class AsyncABMHandler(object):
+	def __init__(self,ABMengine=None,**options):
+		if ABMengine is None:
+			ABMengine = ABMHandler(**options)
+		self.engine = ABMengine
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.calls = 0				# SDK calls made through this handler
+
+	## call(func,*args)
+	#	Runs func(*args) on the SDK thread and returns its result
+	async def call(self,func,*args):
+		self.calls += 1
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self.executor,functools.partial(func,*args))
+
+	## close() - waits for the queued SDK calls to finish, blocking the calling thread
+	def close(self):
+		self.executor.shutdown(wait=True)
+
+	## aclose() - close() from a coroutine: the SDK calls still running are waited for on
+	#	another thread, so the event loop is not blocked by them
+	async def aclose(self):
+		loop = asyncio.get_event_loop()
+		await loop.run_in_executor(None,self.close)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self,*exc):
+		await self.aclose()
+
+	async def GetDeviceInfo(self):
+		return await self.call(self.engine.GetDeviceInfo)
+
+	async def SetDestinationFile(self,path):
+		return await self.call(self.engine.SetDestinationFile,path)
+
+	async def InitSession(self,nDeviceType,nSessionType,nSelectedDeviceHandle,PlayEBS):
+		return await self.call(self.engine.InitSession,nDeviceType,nSessionType,nSelectedDeviceHandle,PlayEBS)
+
+	async def StartAcquisition(self):
+		return await self.call(self.engine.StartAcquisition)
+
+	async def PauseAcquisition(self):
+		return await self.call(self.engine.PauseAcquisition)
+
+	async def ResumeAcquisition(self):
+		return await self.call(self.engine.ResumeAcquisition)
+
+	async def StopAcquisition(self):
+		return await self.call(self.engine.StopAcquisition)
+
+	async def GetCurrentSDKMode(self):
+		return await self.call(self.engine.GetCurrentSDKMode)
+
+	async def GetRawDataArray(self):
+		return await self.call(self.engine.GetRawDataArray)
+
+	async def GetFilteredDataArray(self):
+		return await self.call(self.engine.GetFilteredDataArray)
+
+	async def GetDeconDataArray(self):
+		return await self.call(self.engine.GetDeconDataArray)
+
+	async def GetBrainStateArray(self,nSessionType=None):
+		return await self.call(self.engine.GetBrainStateArray,True,None,nSessionType)
+
+	async def GetPSDDataArray(self):
+		return await self.call(self.engine.GetPSDDataArray)
+
+	async def GetThirdPartyDataArray(self):
+		return await self.call(self.engine.GetThirdPartyDataArray)
+
+	## ReadRaw(unwrap=False)
+	#	Returns (frames, timestamps): GetRawDataArray and the matching TIMESTAMP_RAW timestamps,
+	#	taken in one job on the SDK thread so no other getter call comes in between
+	async def ReadRaw(self,unwrap=False):
+		return await self.call(self._Read,self.engine.GetRawDataArray,TIMESTAMP_RAW,unwrap)
+
+	async def ReadDecon(self,unwrap=False):
+		return await self.call(self._Read,self.engine.GetDeconDataArray,TIMESTAMP_DECON,unwrap)
+
+	## ReadBrainState(unwrap=False), ReadPSD(unwrap=False)
+	#	(epochs, timestamps) of GetBrainStateArray/TIMESTAMP_CLASS and GetPSDDataArray/TIMESTAMP_PSD,
+	#	to be given to PyABMClassification.BrainStateStream/PSDStream.process
+	async def ReadBrainState(self,unwrap=False):
+		return await self.call(self._Read,self.engine.GetBrainStateArray,TIMESTAMP_CLASS,unwrap)
+
+	async def ReadPSD(self,unwrap=False):
+		return await self.call(self._Read,self.engine.GetPSDDataArray,TIMESTAMP_PSD,unwrap)
+
+	def _Read(self,getter,nType,unwrap):
+		frames = getter()
+		timestamps = self.engine.GetTimeStampsStreamData(nType,len(frames),unwrap=unwrap)
+		return (frames,timestamps)
+
+	## stream(interval=0.05,maxBatches=64,dropOldest=False,unwrap=False)
+	#	Returns an AsyncStream polling the SDK through this handler
+	def stream(self,interval=0.05,maxBatches=64,dropOldest=False,unwrap=False):
+		return AsyncStream(self,interval,maxBatches,dropOldest,unwrap)
+
+## AsyncStream
+#	Description:
+#		Factory of the batch iterators of one acquisition. Each iterator runs its own polling
+#		task, started by the first 'async for' step:
+#			raw()			- (frames, timestamps) from GetRawData/TIMESTAMP_RAW
+#			decon()			- (frames, timestamps) from GetDeconData/TIMESTAMP_DECON
+#			brain_state()	- (epochs, timestamps) from GetBrainState/TIMESTAMP_CLASS
+#			psd()			- (epochs, timestamps) from GetPSDData/TIMESTAMP_PSD
+#			third_party()	- uint8 arrays of MC-ESU bytes (see PyABMESU.ESUPacketParser)
+#		Empty polls are not passed on.
+#	Input Arguments:
+#		handler: AsyncABMHandler
+#		interval: seconds between polls
+#		maxBatches: batches queued for the consumer
+#		dropOldest: False - polling waits while the queue is full (backpressure);
+#			True - the oldest queued batch is dropped to make room (counted in 'dropped')
+#		unwrap: return the timestamps as monotonic int64 (see ABMHandler.GetTimeStampsStreamData)
+class AsyncStream(object):
+	def __init__(self,handler,interval=0.05,maxBatches=64,dropOldest=False,unwrap=False):
+		self.handler = handler
+		self.interval = interval
+		self.maxBatches = maxBatches
+		self.dropOldest = dropOldest
+		self.unwrap = unwrap
+		self.iterators = []
+
+	def raw(self):
+		return self._Iterator(functools.partial(self.handler.ReadRaw,self.unwrap))
+
+	def decon(self):
+		return self._Iterator(functools.partial(self.handler.ReadDecon,self.unwrap))
+
+	def brain_state(self):
+		return self._Iterator(functools.partial(self.handler.ReadBrainState,self.unwrap))
+
+	def psd(self):
+		return self._Iterator(functools.partial(self.handler.ReadPSD,self.unwrap))
+
+	def third_party(self):
+		return self._Iterator(self.handler.GetThirdPartyDataArray)
+
+	def _Iterator(self,read):
+		iterator = BatchIterator(read,self.interval,self.maxBatches,self.dropOldest)
+		self.iterators.append(iterator)
+		return iterator
+
+	## close() - stops the polling of all iterators; they end once their queued batches are consumed
+	def close(self):
+		for iterator in self.iterators:
+			iterator.close()
+
+# marks the end of an iterator in its queue
+_END = object()
+
+## BatchIterator
+#	Async iterator over the non-empty results of read(), a coroutine function polled every
+#	interval seconds by a task feeding a bounded queue (see AsyncStream)
+class BatchIterator(object):
+	def __init__(self,read,interval,maxBatches,dropOldest):
+		self.read = read
+		self.interval = interval
+		self.dropOldest = dropOldest
+		self.queue = asyncio.Queue(maxBatches)
+		self.polls = 0				# reads done
+		self.batches = 0			# batches queued
+		self.dropped = 0			# batches dropped (dropOldest)
+		self.closed = False
+		self._task = None
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		if self._task is None and not self.closed:
+			self._task = asyncio.ensure_future(self._Poll())
+		if self.closed and self.queue.empty():
+			raise StopAsyncIteration
+		item = await self.queue.get()
+		if item is _END:
+			raise StopAsyncIteration
+		if isinstance(item,BaseException):
+			self.closed = True
+			raise item
+		return item
+
+	async def _Poll(self):
+		try:
+			while True:
+				batch = await self.read()
+				self.polls += 1
+				if len(batch[0] if isinstance(batch,tuple) else batch):
+					await self._Put(batch)
+				await asyncio.sleep(self.interval)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			await self._Put(e)
+
+	async def _Put(self,item):
+		if self.dropOldest and self.queue.full():
+			self.queue.get_nowait()
+			self.dropped += 1
+		await self.queue.put(item)
+		self.batches += 1
+
+	## close() - stops polling; the batches already queued are still returned
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		if self._task is not None:
+			self._task.cancel()
+		# wake up a consumer waiting on an empty queue
+		if self.queue.empty():
+			self.queue.put_nowait(_END)
+
+## LoopLagMonitor
+#	Description:
+#		Measures the responsiveness of the event loop: a task sleeps interval seconds over and
+#		over and records how late it wakes up. Blocking calls made on the loop show up as lag.
+#	Input Arguments:
+#		interval: seconds between measurements
+#		maxSamples: lags kept
+#	Usage:
+#		monitor = LoopLagMonitor()
+#		monitor.start()
+#		...
+#		monitor.stop()
+#		print(monitor.percentile(99))
+class LoopLagMonitor(object):
+	def __init__(self,interval=0.001,maxSamples=100000):
+		self.interval = interval
+		self.lags = collections.deque(maxlen=maxSamples)		# seconds
+		self._task = None
+
+	def start(self):
+		self._task = asyncio.ensure_future(self._Run())
+
+	def stop(self):
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
+
+	async def _Run(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			t = loop.time()
+			await asyncio.sleep(self.interval)
+			self.lags.append(max(0.0,loop.time() - t - self.interval))
+
+	## percentile(q) - q-th percentile of the lags in seconds
+	def percentile(self,q):
+		if not self.lags:
+			return 0.0
+		return float(np.percentile(np.fromiter(self.lags,dtype=np.float64),q))
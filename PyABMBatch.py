@@ -0,0 +1,316 @@
+#########################################################################
+#	PyABMBatch.py
+#	Offline reprocessing of recorded sessions: each session is replayed as
+#	fast as its backend delivers it, run through a chain of pipeline stages
+#	and the results are written to an output directory
+#
+#	Sessions are spread over a pool of worker processes. Every session is
+#	replayed by a backend loaded in its worker (see the loaders in PyABM.py),
+#	so sessions never share SDK state: recordings of PyABMRecord are replayed
+#	by the simulated SDK of PyABMSim, EBS files by the ABM SDK itself with
+#	bPlayEBS. The stages are created in the worker too, by a picklable
+#	factory.
+#
+#	Output, per session:
+#		<session>.results.npz	- the results published by the stages, one array per field
+#								  ('<Type>.<field>', '<Type>.<field>.<key>' for dicts)
+#		<session>.processed.abr	- frames leaving the last stage (writeFrames=True)
+#	and batch.json, the summary of every session (samples, times, errors).
+#
+#	Usage:
+#		report = ReprocessDirectory('sessions','results',BatchConfig(stages=DefaultStages(lineFrequency=50)))
+#		for summary in report['sessions']:
+#			print(summary['session'],summary['error'] or summary['results'])
+#########################################################################
+
+from __future__ import print_function
+
+import collections
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+
+from PyABM import ABMHandler, ABM_SESSION_RAW, NUM_HEADER_COLUMNS, TIMESTAMP_RAW, WinDLLLoader
+from PyABMContinuity import ContinuityChecker
+from PyABMFilters import BandpassSOS, FilterBank, NotchSOS
+from PyABMPipeline import Pipeline
+from PyABMQuality import QualityMonitor
+from PyABMSpectral import WelchPSD
+from PyABMStatus import CheckResult
+
+RESULTS_SUFFIX = '.results.npz'
+PROCESSED_SUFFIX = '.processed.abr'
+BATCH_SUMMARY = 'batch.json'
+
+#########################################################################
+### Configuration
+
+## ReplayLoader
+#	Description:
+#		Chooses the backend replaying a session: called with the path of the session, returns
+#		(loader, playEBS). EBS files ('ebsExtension') are played by the SDK loaded by 'sdk'
+#		with bPlayEBS; any other file is taken for a PyABMRecord recording and replayed by
+#		SimABMDLL with speed=None, i.e. as fast as it is read.
+#	Input Arguments:
+#		nCountPerCall: samples handed out per getter call of a replayed recording
+#		sdk: loader of the SDK playing EBS files, default WinDLLLoader('ABM_Athena')
+#		ebsExtension: extension of the EBS files
+class ReplayLoader(object):
+	def __init__(self,nCountPerCall=4096,sdk=None,ebsExtension='.ebs'):
+		self.nCountPerCall = nCountPerCall
+		self.sdk = sdk
+		self.ebsExtension = ebsExtension.lower()
+
+	def __call__(self,path):
+		if path.lower().endswith(self.ebsExtension):
+			return (self.sdk if self.sdk is not None else WinDLLLoader('ABM_Athena'),True)
+		from PyABMSim import SimLoader
+		return (SimLoader(replay=path,speed=None,nCountPerCall=self.nCountPerCall),False)
+
+## DefaultStages
+#	Description:
+#		Stage factory of BatchConfig: called with (nChannel, sampleRate) in the worker, returns
+#		the stages of one session. The default chain checks the continuity of the samples,
+#		computes the artifact statistics of the raw signals (QualityMonitor), filters them
+#		(mains notch and band-pass) and computes the PSD of the filtered signals (WelchPSD).
+#	Input Arguments:
+#		band: (low, high) of the band-pass filter in Hz, None for no band-pass
+#		lineFrequency: mains frequency in Hz (notch and QualityMonitor), None for no notch
+#		quality: include the QualityMonitor
+#		psd: include the WelchPSD
+class DefaultStages(object):
+	def __init__(self,band=(1.0,40.0),lineFrequency=60.0,quality=True,psd=True):
+		self.band = band
+		self.lineFrequency = lineFrequency
+		self.quality = quality
+		self.psd = psd
+
+	def __call__(self,nChannel,sampleRate):
+		stages = [ContinuityChecker(sampleRate)]
+		if self.quality:
+			stages.append(QualityMonitor(nChannel,sampleRate,lineFrequency=self.lineFrequency or 60.0))
+		sos = []
+		if self.lineFrequency:
+			sos.append(NotchSOS(self.lineFrequency,sampleRate))
+		if self.band is not None:
+			sos.append(BandpassSOS(self.band[0],self.band[1],sampleRate))
+		if sos:
+			stages.append(FilterBank(nChannel,np.vstack(sos)))
+		if self.psd:
+			stages.append(WelchPSD(nChannel,sampleRate))
+		return stages
+
+## BatchConfig
+#	Description:
+#		Settings of a batch, sent to the worker processes (must be picklable).
+#	Input Arguments:
+#		stages: factory(nChannel, sampleRate) returning the list of stages of a session
+#			(a module-level function or an object like DefaultStages), default DefaultStages()
+#		loader: callable(path) returning (loader, playEBS) of a session, default ReplayLoader()
+#		deviceType, sessionType: arguments of InitSession
+#		sampleRate: sampling rate in Hz, when the backend does not tell it
+#		writeFrames: write the frames leaving the last stage to <session>.processed.abr
+#		idleSeconds: a replay that hands out no sample for that long is over (EBS playback
+#			has no end-of-file signal; replayed recordings end with their last sample)
+#		pollInterval: seconds between polls while the backend has no sample
+#		isolate: start a new worker process for every session (a fresh SDK each time)
+#		pattern: glob pattern of the sessions in ReprocessDirectory
+class BatchConfig(object):
+	def __init__(self,stages=None,loader=None,deviceType=3,sessionType=ABM_SESSION_RAW,sampleRate=256,
+				 writeFrames=False,idleSeconds=5.0,pollInterval=0.01,isolate=False,pattern='*.abr'):
+		self.stages = stages if stages is not None else DefaultStages()
+		self.loader = loader if loader is not None else ReplayLoader()
+		self.deviceType = deviceType
+		self.sessionType = sessionType
+		self.sampleRate = sampleRate
+		self.writeFrames = writeFrames
+		self.idleSeconds = idleSeconds
+		self.pollInterval = pollInterval
+		self.isolate = isolate
+		self.pattern = pattern
+
+#########################################################################
+### Results
+
+## ResultArrays(results)
+#	Description:
+#		Turns the results published by the stages (namedtuples, in any mix of types) into one
+#		array per field: '<Type>.<field>' holds the field of every result of that type, in
+#		publishing order (arrays are stacked, None becomes NaN), dict fields are split into
+#		'<Type>.<field>.<key>'.
+#	Output Arguments:
+#		OrderedDict {name: array}
+def ResultArrays(results):
+	byType = collections.OrderedDict()
+	for result in results:
+		byType.setdefault(type(result).__name__,[]).append(result)
+	arrays = collections.OrderedDict()
+	for (kind,items) in byType.items():
+		for field in items[0]._fields:
+			values = [getattr(result,field) for result in items]
+			if isinstance(values[0],dict):
+				for key in values[0]:
+					arrays['%s.%s.%s' % (kind,field,key)] = np.asarray([value[key] for value in values])
+			elif any(value is not None for value in values):
+				arrays['%s.%s' % (kind,field)] = np.asarray([np.nan if value is None else value for value in values])
+	return arrays
+
+## LoadResults(path) - {name: array} of a <session>.results.npz
+def LoadResults(path):
+	with np.load(path) as data:
+		return collections.OrderedDict((name,data[name]) for name in data.files)
+
+#########################################################################
+### Worker
+
+# replays one session through its stages, fills in summary
+def _Replay(config,path,outputDir,summary):
+	(loader,playEBS) = config.loader(path)
+	ABMengine = ABMHandler(loader=loader)
+	nChannel = ABMengine.GetDeviceInfo().nNumberOfChannel
+	sampleRate = getattr(ABMengine.abmDLL,'sampleRate',config.sampleRate)
+	stages = config.stages(nChannel,sampleRate)
+	results = []
+	for stage in stages:
+		stage.subscribe(results.append)
+	pipeline = Pipeline(stages)
+	if playEBS:
+		CheckResult('SetDestinationFile',ABMengine.SetDestinationFile(path.encode('mbcs' if os.name == 'nt' else 'utf-8')))
+	CheckResult('InitSession',ABMengine.InitSession(config.deviceType,config.sessionType,-1,playEBS))
+	CheckResult('StartAcquisition',ABMengine.StartAcquisition())
+	recorder = None
+	idleSince = None
+	try:
+		while True:
+			frames = ABMengine.GetRawDataArray()
+			if len(frames) == 0:
+				if getattr(ABMengine.abmDLL,'finished',False):
+					break
+				now = time.time()
+				if idleSince is None:
+					idleSince = now
+				elif now - idleSince >= config.idleSeconds:
+					break
+				time.sleep(config.pollInterval)
+				continue
+			idleSince = None
+			timestamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+			(frames,timestamps) = pipeline.process(frames,timestamps)
+			summary['samples'] += len(frames)
+			if config.writeFrames and len(frames):
+				if recorder is None:
+					from PyABMRecord import ABMRecorder
+					summary['processed'] = os.path.join(outputDir,summary['session'] + PROCESSED_SUFFIX)
+					recorder = ABMRecorder(summary['processed'],frames.shape[1] - NUM_HEADER_COLUMNS,sampleRate)
+				recorder.write(frames,timestamps)
+	finally:
+		if recorder is not None:
+			recorder.close()
+		ABMengine.StopAcquisition()
+	summary['recordedSeconds'] = summary['samples'] / float(sampleRate)
+	counts = collections.Counter(type(result).__name__ for result in results)
+	summary['results'] = dict(counts)
+	summary['output'] = os.path.join(outputDir,summary['session'] + RESULTS_SUFFIX)
+	np.savez(summary['output'],**ResultArrays(results))
+
+# body of a pool task: reprocesses one session, returns its summary (errors included, never raises)
+def _ReprocessSession(job):
+	(config,path,outputDir) = job
+	name = os.path.basename(path)
+	for suffix in (PROCESSED_SUFFIX,os.path.splitext(path)[1]):
+		if suffix and name.endswith(suffix):
+			name = name[:-len(suffix)]
+			break
+	summary = {'session': name, 'path': path, 'worker': os.getpid(), 'samples': 0, 'recordedSeconds': 0.0,
+			   'seconds': None, 'cpuSeconds': None, 'results': {}, 'output': None, 'processed': None, 'error': None}
+	t0 = time.time()
+	cpu0 = sum(os.times()[:2])
+	try:
+		_Replay(config,path,outputDir,summary)
+	except Exception:
+		summary['error'] = traceback.format_exc()
+	summary['seconds'] = time.time() - t0
+	summary['cpuSeconds'] = sum(os.times()[:2]) - cpu0
+	return summary
+
+#########################################################################
+### Batches
+
+## PrintProgress(done,total,summary) - default progress report, one line per session
+def PrintProgress(done,total,summary):
+	if summary['error']:
+		status = 'FAILED: %s' % summary['error'].strip().splitlines()[-1]
+	else:
+		status = '%.0f s of data in %.2f s (%.0fx real time)' % (summary['recordedSeconds'],summary['seconds'],
+			summary['recordedSeconds'] / max(summary['seconds'],1e-9))
+	print('[%d/%d] %s: %s' % (done,total,summary['session'],status))
+
+## ReprocessSessions(paths,outputDir,config=None,processes=None,progress=PrintProgress)
+#	Description:
+#		Reprocesses the sessions in 'paths' on a pool of worker processes and writes their
+#		results to outputDir (created if needed), with the summary of the batch in batch.json.
+#		The largest sessions are started first, so the last ones to finish are short. A
+#		session that fails is reported (its traceback in 'error') and the others carry on.
+#	Input Arguments:
+#		paths: session files
+#		outputDir: directory of the results
+#		config: BatchConfig
+#		processes: worker processes, default one per CPU; 0 runs the sessions in this process
+#		progress: progress(done,total,summary) called as each session finishes, or None
+#	Output Arguments:
+#		{'sessions': [summary] in the order of paths, 'processes', 'seconds', 'samples',
+#		 'failed': number of failed sessions}
+def ReprocessSessions(paths,outputDir,config=None,processes=None,progress=PrintProgress):
+	if config is None:
+		config = BatchConfig()
+	if not os.path.isdir(outputDir):
+		os.makedirs(outputDir)
+	paths = list(paths)
+	jobs = [(config,path,outputDir) for path in sorted(paths,key=os.path.getsize,reverse=True)]
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	processes = min(processes,len(jobs))
+	summaries = {}
+	t0 = time.time()
+
+	def _Done(summary):
+		summaries[summary['path']] = summary
+		if progress is not None:
+			progress(len(summaries),len(jobs),summary)
+
+	if processes <= 0:
+		for job in jobs:
+			_Done(_ReprocessSession(job))
+	else:
+		pool = multiprocessing.Pool(processes,maxtasksperchild=1 if config.isolate else None)
+		try:
+			for summary in pool.imap_unordered(_ReprocessSession,jobs):
+				_Done(summary)
+			pool.close()
+		except BaseException:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+	sessions = [summaries[path] for path in paths]
+	report = {'sessions': sessions, 'processes': processes, 'seconds': time.time() - t0,
+			  'samples': sum(summary['samples'] for summary in sessions),
+			  'failed': sum(1 for summary in sessions if summary['error'])}
+	with open(os.path.join(outputDir,BATCH_SUMMARY),'w') as f:
+		json.dump(report,f,indent=1,sort_keys=True)
+	return report
+
+## ReprocessDirectory(directory,outputDir,config=None,processes=None,progress=PrintProgress)
+#	Reprocesses the sessions of directory matching config.pattern (except the .processed.abr
+#	files written by a previous batch), see ReprocessSessions
+def ReprocessDirectory(directory,outputDir,config=None,processes=None,progress=PrintProgress):
+	if config is None:
+		config = BatchConfig()
+	paths = sorted(path for path in glob.glob(os.path.join(directory,config.pattern))
+				   if not path.endswith(PROCESSED_SUFFIX))
+	return ReprocessSessions(paths,outputDir,config,processes,progress)
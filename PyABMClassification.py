@@ -0,0 +1,127 @@
+#########################################################################
+#	PyABMClassification.py
+#	Per-epoch outputs of the SDK: the Brain State classification and
+#	B-Alert Workload of GetBrainState and the PSD of GetPSDData, paired with
+#	their TIMESTAMP_CLASS/TIMESTAMP_PSD timestamps and published as typed
+#	results, one per epoch
+#
+#	The epochs are fetched with the array getters (one copy per poll) and
+#	decoded for the whole batch at once; subscribers never see the raw
+#	sample stream.
+#
+#	Usage:
+#		ABMengine.InitSession(3,ABM_SESSION_WORKLOAD,-1,False)
+#		brainState = BrainStateStream(ABMengine)
+#		brainState.subscribe(lambda epoch: handle(epoch.state,epoch.workloadAverage))
+#		psd = PSDStream(ABMengine)
+#		streamer = ABMStreamer(ABMengine,epochStreams=[brainState,psd])		# or call poll() in a loop
+#########################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from PyABM import BSTATE_COLUMNS, NUM_HEADER_COLUMNS, PSD_BINS, TIMESTAMP_CLASS, TIMESTAMP_PSD, WORKLOAD_COLUMNS
+from PyABMPipeline import PipelineStage
+from PyABMSpectral import BANDS, PSDEpoch
+
+## BrainStateEpoch
+#	Published by BrainStateStream once per epoch
+#		epoch: epoch number (Epoch header value)
+#		timestamp: TIMESTAMP_CLASS timestamp of the epoch
+#		state: name of the most probable class of BSTATE_COLUMNS
+#		sleepOnset, distraction, lowEngagement, highEngagement: class probabilities
+#		workloadFBDS, workloadBDS, workloadAverage: workload indices (None outside
+#			ABM_SESSION_WORKLOAD sessions)
+BrainStateEpoch = namedtuple('BrainStateEpoch', ['epoch', 'timestamp', 'state', 'sleepOnset', 'distraction',
+												 'lowEngagement', 'highEngagement', 'workloadFBDS', 'workloadBDS',
+												 'workloadAverage'])
+
+## EpochStream
+#	Description:
+#		Base class of the per-epoch streams. poll() gets the epochs pending in the SDK with the
+#		array getter 'getter' and their timestamps of stream 'timestampType', and hands them to
+#		process(epochs,timestamps), which publishes one result per epoch. process() can also be
+#		called directly (e.g. on replayed epochs) and, as a pipeline stage, returns its input.
+#	Input Arguments:
+#		ABMengine: ABMHandler polled by poll(), None if only process() is used
+class EpochStream(PipelineStage):
+	getter = None
+	timestampType = None
+
+	def __init__(self,ABMengine=None):
+		PipelineStage.__init__(self)
+		self.ABMengine = ABMengine
+		self.polls = 0				# getter calls
+		self.epochs = 0				# epochs published
+		self.latest = None			# last result published
+
+	## poll() - publishes the epochs pending in the SDK, returns their number
+	def poll(self):
+		epochs = getattr(self.ABMengine,self.getter)()
+		self.polls += 1
+		if len(epochs) == 0:
+			return 0
+		timestamps = self.ABMengine.GetTimeStampsStreamData(self.timestampType,len(epochs))
+		self.process(epochs,timestamps)
+		return len(epochs)
+
+## BrainStateStream
+#	Description:
+#		Publishes a BrainStateEpoch for each epoch of GetBrainState. The workload indices are
+#		read when the epochs have the WORKLOAD_COLUMNS after the BSTATE_COLUMNS.
+class BrainStateStream(EpochStream):
+	getter = 'GetBrainStateArray'
+	timestampType = TIMESTAMP_CLASS
+
+	def process(self,epochs,timestamps):
+		n = len(epochs)
+		if n == 0:
+			return (epochs,timestamps)
+		values = np.asarray(epochs[:,NUM_HEADER_COLUMNS:],dtype=np.float64)
+		nClass = len(BSTATE_COLUMNS)
+		states = [BSTATE_COLUMNS[i] for i in values[:,:nClass].argmax(axis=1).tolist()]
+		if values.shape[1] >= nClass + len(WORKLOAD_COLUMNS):
+			workload = values[:,nClass:nClass+len(WORKLOAD_COLUMNS)].tolist()
+		else:
+			workload = [(None,None,None)] * n
+		for (epoch,timestamp,state,p,w) in zip(epochs[:,0].astype(np.int64).tolist(),
+											   np.asarray(timestamps).tolist(),states,
+											   values[:,:nClass].tolist(),workload):
+			self.latest = BrainStateEpoch(epoch,timestamp,state,p[0],p[1],p[2],p[3],w[0],w[1],w[2])
+			self.publish(self.latest)
+		self.epochs += n
+		return (epochs,timestamps)
+
+## PSDStream
+#	Description:
+#		Publishes a PyABMSpectral.PSDEpoch for each epoch of GetPSDData, like WelchPSD does for
+#		the PSD it computes: psd is (PSD_BINS, nChannel), over the frequencies in 'freqs', and
+#		bandPower the power in each band of 'bands', for all epochs of a poll in one product.
+#	Input Arguments:
+#		ABMengine: see EpochStream
+#		bands: [(name, (low, high))] band definitions
+class PSDStream(EpochStream):
+	getter = 'GetPSDDataArray'
+	timestampType = TIMESTAMP_PSD
+
+	def __init__(self,ABMengine=None,bands=BANDS):
+		EpochStream.__init__(self,ABMengine)
+		self.freqs = np.arange(1,PSD_BINS + 1,dtype=np.float64)
+		self.bands = list(bands)
+		self.bandMatrix = np.array([(self.freqs >= lo) & (self.freqs < hi) for (name,(lo,hi)) in self.bands],
+								   dtype=np.float64)
+
+	def process(self,epochs,timestamps):
+		n = len(epochs)
+		if n == 0:
+			return (epochs,timestamps)
+		nChannel = (epochs.shape[1] - NUM_HEADER_COLUMNS) // PSD_BINS
+		psd = np.asarray(epochs[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+nChannel*PSD_BINS],dtype=np.float64)
+		psd = psd.reshape(n,nChannel,PSD_BINS).transpose(0,2,1)
+		bandPower = np.matmul(self.bandMatrix,psd)
+		for (i,(epoch,timestamp)) in enumerate(zip(epochs[:,0].astype(np.int64).tolist(),np.asarray(timestamps).tolist())):
+			self.latest = PSDEpoch(epoch,timestamp,psd[i],bandPower[i])
+			self.publish(self.latest)
+		self.epochs += n
+		return (epochs,timestamps)
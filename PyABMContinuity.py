@@ -0,0 +1,202 @@
+#########################################################################
+#	PyABMContinuity.py
+#	Continuity checks of the acquired frames: samples lost between polls,
+#	samples arriving late or twice and timestamps going backwards are
+#	detected batch by batch from the Epoch/Offset header columns and the
+#	timestamp stream, before the SDK reports ABM_ERROR_SDK_TOO_LARGE_MISSED_BLOCK
+#
+#	Usage:
+#		checker = ContinuityChecker(sampleRate=256,fill=True)
+#		checker.subscribe(lambda gap: ...)			# Gap results
+#		pipeline = Pipeline([checker,...])			# the next stages get gap-free, NaN-padded frames
+#		loop:
+#			pipeline.process(frames,timestamps)
+#		print(checker.dropped,checker.late,checker.gaps.intervals())
+#########################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from PyABMPipeline import PipelineStage
+
+## SampleIndex(frames,sampleRate)
+#	Absolute sample index of each frame, Epoch * sampleRate + Offset (int64 array)
+def SampleIndex(frames,sampleRate):
+	header = np.asarray(frames[:,:2],dtype=np.int64)
+	return header[:,0] * int(sampleRate) + header[:,1]
+
+## Gap
+#	Published by ContinuityChecker for each gap found
+#		start: sample index of the first missing sample
+#		length: number of missing samples
+#		timestamp: timestamp of the first sample after the gap
+#		filled: True if the gap was padded with NaN frames
+Gap = namedtuple('Gap', ['start', 'length', 'timestamp', 'filled'])
+
+## GapIndex
+#	Description:
+#		Compact index of missing sample intervals [start, start+length), kept sorted in two
+#		growing int64 arrays. Intervals are added in acquisition order; an interval touching
+#		the previous one is merged into it.
+#	Usage:
+#		gaps.add(1000,12)
+#		gaps.missing(0,5000)		# missing samples in [0, 5000)
+#		gaps.contains(indices)		# boolean array
+class GapIndex(object):
+	def __init__(self,capacity=64):
+		self._starts = np.empty(capacity,dtype=np.int64)
+		self._stops = np.empty(capacity,dtype=np.int64)
+		self.count = 0
+		self.total = 0					# missing samples in all intervals
+
+	def __len__(self):
+		return self.count
+
+	def add(self,start,length):
+		if length <= 0:
+			return
+		if self.count and self._stops[self.count-1] >= start:
+			self._stops[self.count-1] = max(self._stops[self.count-1],start + length)
+			self.total = int((self._stops[:self.count] - self._starts[:self.count]).sum())
+			return
+		if self.count == len(self._starts):
+			self._starts = np.concatenate([self._starts,np.empty_like(self._starts)])
+			self._stops = np.concatenate([self._stops,np.empty_like(self._stops)])
+		self._starts[self.count] = start
+		self._stops[self.count] = start + length
+		self.count += 1
+		self.total += length
+
+	## intervals() - (n, 2) array of [start, stop) sample indices
+	def intervals(self):
+		return np.column_stack([self._starts[:self.count],self._stops[:self.count]])
+
+	## missing(start,stop) - number of missing samples in [start, stop)
+	def missing(self,start,stop):
+		starts = np.clip(self._starts[:self.count],start,stop)
+		stops = np.clip(self._stops[:self.count],start,stop)
+		return int((stops - starts).sum())
+
+	## contains(indices) - True where a sample index falls in a gap
+	def contains(self,indices):
+		indices = np.asarray(indices,dtype=np.int64)
+		i = np.searchsorted(self._starts[:self.count],indices,side='right') - 1
+		inside = i >= 0
+		inside[inside] = indices[inside] < self._stops[:self.count][i[inside]]
+		return inside
+
+## ContinuityChecker
+#	Description:
+#		Pipeline stage checking each batch of frames, in one vectorized pass, against the
+#		samples seen before:
+#		- a sample index (SampleIndex) more than one past the previous one opens a gap; the
+#		  missing samples are counted in 'dropped', the interval is added to 'gaps' and a Gap
+#		  is published
+#		- a sample index at or below the highest one seen so far is a late (or repeated)
+#		  sample, counted in 'late'
+#		- a timestamp below the previous one is counted in 'timestampErrors' (the rollover
+#		  of the 32-bit millisecond counter is not)
+#		With fill=True the frames passed on are continuous: late samples are removed and
+#		every gap of at most maxFillSeconds is padded with frames of NaN channel values
+#		(their Epoch and Offset filled in, Hour/Min/Sec/mSec NaN) and interpolated
+#		timestamps, so buffers downstream stay aligned with the sample clock. Otherwise
+#		the frames are passed on unchanged.
+#	Input Arguments:
+#		sampleRate: sampling rate in Hz
+#		fill: pad the gaps as described above
+#		maxFillSeconds: longest gap padded (longer gaps, e.g. a lost connection, are only recorded)
+class ContinuityChecker(PipelineStage):
+	def __init__(self,sampleRate=256,fill=False,maxFillSeconds=10.0):
+		PipelineStage.__init__(self)
+		self.sampleRate = int(sampleRate)
+		self.fill = fill
+		self.maxFill = int(maxFillSeconds * sampleRate)
+		self.gaps = GapIndex()
+		self.last = None				# highest sample index seen
+		self.lastTimestamp = None		# timestamp of the last sample in order
+		self.samples = 0				# samples received in order
+		self.dropped = 0				# samples missing in gaps
+		self.late = 0					# samples received late or twice
+		self.timestampErrors = 0		# timestamps below the previous one
+		self.filled = 0					# NaN frames inserted
+
+	def process(self,frames,timestamps):
+		n = len(frames)
+		if n == 0:
+			return (frames,timestamps)
+		idx = SampleIndex(frames,self.sampleRate)
+		ts = np.asarray(timestamps,dtype=np.int64)
+		if self.last is None:
+			(self.last,self.lastTimestamp) = (int(idx[0]) - 1,int(ts[0]))
+		steps = np.empty(n,dtype=np.int64)
+		steps[0] = idx[0] - self.last
+		np.subtract(idx[1:],idx[:-1],out=steps[1:])
+		if (steps == 1).all():
+			# the usual case, no gap and nothing late
+			self._CheckTimeStamps(ts)
+			self.samples += n
+			self.last = int(idx[-1])
+			return (frames,timestamps)
+		# highest index seen before each sample
+		previous = np.empty(n,dtype=np.int64)
+		previous[0] = self.last
+		np.maximum.accumulate(idx[:-1],out=previous[1:])
+		np.maximum(previous[1:],self.last,out=previous[1:])
+		inOrder = idx > previous
+		nLate = n - int(np.count_nonzero(inOrder))
+		if nLate:
+			self.late += nLate
+			(idx,ts,previous) = (idx[inOrder],ts[inOrder],previous[inOrder])
+			if self.fill:
+				(frames,timestamps) = (frames[inOrder],timestamps[inOrder])
+			if len(idx) == 0:
+				return (frames,timestamps)
+		self.samples += len(idx)
+		(prevTs,tsSteps) = self._CheckTimeStamps(ts)
+		missing = idx - previous - 1
+		at = np.flatnonzero(missing)
+		fillable = missing <= self.maxFill if self.fill else np.zeros(len(idx),dtype=bool)
+		for i in at.tolist():
+			self.gaps.add(int(previous[i]) + 1,int(missing[i]))
+			self.publish(Gap(int(previous[i]) + 1,int(missing[i]),int(ts[i]),bool(fillable[i])))
+		self.dropped += int(missing[at].sum())
+		self.last = int(idx[-1])
+		if len(at) and fillable[at].any():
+			return self._Fill(frames,timestamps,idx,prevTs,tsSteps,np.where(fillable,missing,0))
+		return (frames,timestamps)
+
+	# counts the timestamps below the previous one; returns the previous timestamps and the
+	# steps to each timestamp (modulo 2**32, so the rollover of the 32-bit counter is no error)
+	def _CheckTimeStamps(self,ts):
+		prevTs = np.empty(len(ts),dtype=np.int64)
+		prevTs[0] = self.lastTimestamp
+		prevTs[1:] = ts[:-1]
+		tsSteps = (ts - prevTs + 2**31) % 2**32 - 2**31
+		self.timestampErrors += int(np.count_nonzero(tsSteps < 0))
+		self.lastTimestamp = int(ts[-1])
+		return (prevTs,tsSteps)
+
+	# frames with padding[i] rows inserted before sample i
+	def _Fill(self,frames,timestamps,idx,prevTs,tsSteps,padding):
+		pos = np.cumsum(padding + 1) - 1				# rows of the samples
+		nOut = int(pos[-1]) + 1
+		out = np.full((nOut,frames.shape[1]),np.nan,dtype=np.float32)
+		out[pos] = frames
+		outTs = np.empty(nOut,dtype=np.asarray(timestamps).dtype)
+		outTs[pos] = timestamps
+		padded = np.ones(nOut,dtype=bool)
+		padded[pos] = False
+		rows = np.flatnonzero(padded)
+		after = np.searchsorted(pos,rows)				# sample following each padding row
+		k = rows - pos[after] + padding[after] + 1		# 1 for the first padding row of a gap
+		fillIdx = idx[after] - padding[after] - 1 + k
+		out[rows,0] = fillIdx // self.sampleRate
+		out[rows,1] = fillIdx % self.sampleRate
+		# timestamps interpolated between the samples around the gap
+		fillTs = prevTs[after] + tsSteps[after] * k // (padding[after] + 1)
+		if outTs.dtype == np.uint32:
+			fillTs &= 0xffffffff
+		outTs[rows] = fillTs
+		self.filled += len(rows)
+		return (out,outTs)
@@ -0,0 +1,327 @@
+#########################################################################
+#	PyABMDecimate.py
+#	Min/max/mean decimation pyramids of the channels, for drawing any range
+#	of live or recorded data at any screen width
+#
+#	Level k of a pyramid holds, for every block of 2**k samples and every
+#	channel, the minimum, maximum and mean of the block. Levels are built
+#	from baseLevel up, each one from pairs of blocks of the level below, and
+#	are updated as frames arrive. A query for width pixels reads the level
+#	whose blocks are just smaller than a pixel, so it touches about 2*width
+#	blocks whatever the length of the range.
+#
+#	File layout of the pyramid stored next to a recording (path + '.pyr'),
+#	little-endian:
+#		Header (PYRAMID_HEADER_SIZE bytes)
+#			magic 'PYABMPYR', format version, baseLevel, nChannel, number of
+#			levels, frames covered, timestamp of the first frame, recordingId of
+#			the recording, followed by the number of blocks of each level (uint64)
+#		Levels, from baseLevel up: float32[3][nBlocks][nChannel] (min, max, mean)
+#
+#	Usage:
+#		pyramid = DecimationPyramid(nCh)					# live, as a pipeline stage
+#		pipeline = Pipeline([pyramid,...])
+#		env = pyramid.query(0,pyramid.nFrames,1920)		# env.minimum, env.maximum: (n<=1920, nCh)
+#
+#		pyramid = RecordingPyramid('session.abr')		# built once, then memory-mapped
+#		env = pyramid.window(t0,t1,1920,channels=['Fz','Cz'])
+#########################################################################
+
+from collections import namedtuple
+import os
+import struct
+
+import numpy as np
+
+from PyABM import ChannelNames, NUM_HEADER_COLUMNS
+from PyABMPipeline import PipelineStage
+
+PYRAMID_MAGIC = b'PYABMPYR'
+PYRAMID_VERSION = 2
+PYRAMID_HEADER_SIZE = 4096
+PYRAMID_HEADER_FORMAT = '<8sHHIIQI16s'	# magic, version, baseLevel, nChannel, nLevels, nFrames, firstTimestamp, recordingId
+
+## Envelope
+#	Result of DecimationPyramid.query and window, one row per pixel that holds data
+#		positions: index of the first frame of each pixel
+#		times: unwrapped millisecond timestamps of these frames (window only, None otherwise)
+#		minimum, maximum, mean: (nPixel, nChannel) float32 values of the frames of each pixel
+Envelope = namedtuple('Envelope', ['positions', 'times', 'minimum', 'maximum', 'mean'])
+
+# one level of a pyramid: min, max and mean of nBlocks blocks, in a growing array
+class _Level(object):
+	def __init__(self,nChannel,stats=None):
+		if stats is None:
+			stats = np.empty((3,16,nChannel),dtype=np.float32)
+			self.count = 0
+		else:
+			self.count = stats.shape[1]
+		self.stats = stats
+
+	def append(self,stats):
+		n = stats.shape[1]
+		if self.count + n > self.stats.shape[1]:
+			# doubling; also turns a memory-mapped level into a writable one
+			grown = np.empty((3,max(2 * self.stats.shape[1],self.count + n),self.stats.shape[2]),dtype=np.float32)
+			grown[:,:self.count] = self.stats[:,:self.count]
+			self.stats = grown
+		self.stats[:,self.count:self.count+n] = stats
+		self.count += n
+
+## DecimationPyramid
+#	Description:
+#		Pipeline stage keeping the min/max/mean pyramid of the channels of the frames it sees.
+#		Each batch is reduced to blocks of 2**baseLevel samples in one pass, and the new blocks
+#		are combined up the levels (a level only changes when the one below completed a pair).
+#		The samples after the last complete block are kept until the next batch.
+#	Input Arguments:
+#		nChannel: number of channels (the 6 header columns of the frames are skipped)
+#		baseLevel: log2 of the smallest block; the pyramid takes about 24/2**baseLevel bytes
+#			per sample and channel
+#		channelNames: names of the channels, for query(channels=...)
+#	Output Arguments (query):
+#		Envelope of at most width rows. Ranges narrower than 2**baseLevel samples per pixel are
+#		served from the blocks of baseLevel (fewer rows than pixels), unless raw samples are
+#		available (see RecordingPyramid).
+class DecimationPyramid(PipelineStage):
+	def __init__(self,nChannel,baseLevel=4,channelNames=None):
+		PipelineStage.__init__(self)
+		self.nChannel = nChannel
+		self.baseLevel = baseLevel
+		if channelNames is None:
+			channelNames = ChannelNames(nChannel)[NUM_HEADER_COLUMNS:]
+		self.channelNames = list(channelNames)
+		self.levels = [_Level(nChannel)]			# levels[i] holds blocks of 2**(baseLevel+i) samples
+		self.nFrames = 0							# frames added
+		self.firstTimestamp = None
+		self.recording = None						# PyABMRecord.ABMRecording the pyramid belongs to
+		self.recordingId = None						# its recordingId, saved with the pyramid
+		self._tail = np.empty((0,nChannel),dtype=np.float32)		# frames after the last base block
+
+	def process(self,frames,timestamps):
+		if len(frames):
+			if self.firstTimestamp is None:
+				self.firstTimestamp = int(timestamps[0])
+			self.append(frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel])
+		return (frames,timestamps)
+
+	## append(values) - adds (n, nChannel) channel values
+	def append(self,values):
+		values = np.asarray(values,dtype=np.float32)
+		if len(self._tail):
+			values = np.concatenate([self._tail,values])
+		size = 1 << self.baseLevel
+		nBlocks = len(values) >> self.baseLevel
+		self.nFrames += len(values) - len(self._tail)
+		self._tail = values[nBlocks*size:].copy()
+		if nBlocks == 0:
+			return
+		blocks = values[:nBlocks*size].reshape(nBlocks,size,self.nChannel)
+		stats = np.empty((3,nBlocks,self.nChannel),dtype=np.float32)
+		np.fmin.reduce(blocks,axis=1,out=stats[0])
+		np.fmax.reduce(blocks,axis=1,out=stats[1])
+		stats[2] = blocks.mean(axis=1,dtype=np.float64)
+		self.levels[0].append(stats)
+		# combine the new pairs of each level into the next one
+		i = 0
+		while True:
+			below = self.levels[i]
+			if i + 1 == len(self.levels):
+				if below.count < 2:
+					break
+				self.levels.append(_Level(self.nChannel))
+			level = self.levels[i+1]
+			start = 2 * level.count
+			nPairs = (below.count - start) // 2
+			if nPairs == 0:
+				break
+			pairs = below.stats[:,start:start+2*nPairs].reshape(3,nPairs,2,self.nChannel)
+			stats = np.empty((3,nPairs,self.nChannel),dtype=np.float32)
+			np.fmin(pairs[0,:,0],pairs[0,:,1],out=stats[0])
+			np.fmax(pairs[1,:,0],pairs[1,:,1],out=stats[1])
+			np.add(pairs[2,:,0],pairs[2,:,1],out=stats[2])
+			stats[2] *= 0.5
+			level.append(stats)
+			i += 1
+
+	## ChannelIndex(channel) - index of a channel given by name or index
+	def ChannelIndex(self,channel):
+		if isinstance(channel,(int,np.integer)):
+			if not -self.nChannel <= channel < self.nChannel:
+				raise IndexError('Channel %d out of range' % channel)
+			return int(channel) % self.nChannel
+		return self.channelNames.index(channel)
+
+	# raw (n, len(cols)) values of frames [start, stop), None if the frames are not available
+	def _Raw(self,start,stop,cols):
+		tailStart = self.nFrames - len(self._tail)
+		if start >= tailStart:
+			return self._tail[start-tailStart:stop-tailStart][:,cols]
+		if self.recording is None:
+			return None
+		return self.recording.frames(start,stop,[NUM_HEADER_COLUMNS + c for c in cols])
+
+	## query(start,stop,width,channels=None)
+	#	Envelope of frames [start, stop) drawn on width pixels, for the channels given by name
+	#	or index (all by default)
+	def query(self,start,stop,width,channels=None):
+		cols = list(range(self.nChannel)) if channels is None else [self.ChannelIndex(c) for c in channels]
+		(start,stop) = (max(0,int(start)),min(int(stop),self.nFrames))
+		n = stop - start
+		if n <= 0 or width <= 0:
+			empty = np.empty((0,len(cols)),dtype=np.float32)
+			return Envelope(np.empty(0,dtype=np.int64),None,empty,empty,empty)
+		perPixel = n // width
+		level = perPixel.bit_length() - 1 if perPixel else 0
+		level = min(level,self.baseLevel + len(self.levels) - 1)
+		items = []
+		if level < self.baseLevel:
+			level = self.baseLevel
+			if self._RawItems(items,start,stop,cols) == stop:
+				level = None
+		if level is not None:
+			self._Items(items,level,start,stop,cols)
+		(positions,sizes,mins,maxs,means) = [np.concatenate(parts) for parts in zip(*items)]
+		# items -> pixels
+		pixels = np.clip((np.maximum(positions,start) - start) * width // n,0,width - 1)
+		first = np.flatnonzero(np.concatenate([[True],pixels[1:] != pixels[:-1]]))
+		weights = np.add.reduceat(sizes,first).astype(np.float64)
+		mean = np.add.reduceat(means * sizes[:,None],first,axis=0) / weights[:,None]
+		return Envelope(np.maximum(positions[first],start),None,np.fmin.reduceat(mins,first,axis=0),
+						np.fmax.reduceat(maxs,first,axis=0),mean.astype(np.float32))
+
+	# appends the raw frames [start, stop) to items as blocks of one sample; returns stop, or
+	# start if the frames are not available
+	def _RawItems(self,items,start,stop,cols):
+		if stop <= start:
+			return start
+		raw = self._Raw(start,stop,cols)
+		if raw is None:
+			return start
+		items.append((np.arange(start,stop,dtype=np.int64),np.ones(stop - start,dtype=np.int64),raw,raw,raw))
+		return stop
+
+	# appends blocks [b0, b1) of level k to items, returns the frame after the last one
+	def _Blocks(self,items,k,b0,b1,cols):
+		stats = self.levels[k - self.baseLevel].stats[:,b0:b1][:,:,cols]
+		size = 1 << k
+		items.append((np.arange(b0,b1,dtype=np.int64) * size,np.full(b1 - b0,size,dtype=np.int64),
+					  stats[0],stats[1],stats[2]))
+		return b1 * size
+
+	# appends the items covering frames [start, stop) exactly: the raw frames up to the first
+	# base block, one block of each level up to a boundary of 'level', the whole blocks of
+	# 'level' and then of each level below, and the raw frames after the last base block.
+	# Where raw frames are not available the base block holding them is used instead.
+	def _Items(self,items,level,start,stop,cols):
+		base = self.baseLevel
+		head = min(stop,-(-start >> base) << base)
+		pos = self._RawItems(items,start,head,cols)
+		if pos < head:
+			pos = self._Blocks(items,base,start >> base,(start >> base) + 1,cols)
+		for k in range(base,level):
+			size = 1 << k
+			if pos % (2 * size) and pos + size <= stop:
+				pos = self._Blocks(items,k,pos >> k,(pos >> k) + 1,cols)
+		for k in range(level,base - 1,-1):
+			(b0,b1) = (pos >> k,min(self.levels[k - base].count,stop >> k))
+			if b1 > b0:
+				pos = self._Blocks(items,k,b0,b1,cols)
+		if pos < stop and self._RawItems(items,pos,stop,cols) < stop:
+			self._Blocks(items,base,pos >> base,(pos >> base) + 1,cols)
+
+	## window(t0,t1,width,channels=None)
+	#	query() over the frames with unwrapped timestamps in [t0, t1) milliseconds of the
+	#	recording, with the times of the rows filled in
+	def window(self,t0,t1,width,channels=None):
+		if self.recording is None:
+			raise ValueError('The pyramid does not belong to a recording')
+		start = self.recording.findTime(t0)
+		stop = max(start,self.recording.findTime(t1))
+		envelope = self.query(start,stop,width,channels)
+		return envelope._replace(times=self.recording.unwrappedTimestampsAt(envelope.positions))
+
+	## save(path) - writes the pyramid (without the frames after its last base block)
+	def save(self,path):
+		levels = [level for level in self.levels if level.count]
+		for level in levels:
+			if isinstance(level.stats,np.memmap):		# possibly mapped from path itself
+				level.stats = np.array(level.stats)
+		head = struct.pack(PYRAMID_HEADER_FORMAT,PYRAMID_MAGIC,PYRAMID_VERSION,self.baseLevel,self.nChannel,
+						   len(levels),self.nFrames,self.firstTimestamp or 0,(self.recordingId or '').encode('ascii'))
+		head += struct.pack('<%dQ' % len(levels),*[level.count for level in levels])
+		if len(head) > PYRAMID_HEADER_SIZE:
+			raise ValueError('Too many levels')
+		with open(path,'wb') as f:
+			f.write(head + b'\0' * (PYRAMID_HEADER_SIZE - len(head)))
+			for level in levels:
+				np.ascontiguousarray(level.stats[:,:level.count]).tofile(f)
+
+## LoadPyramid(path,recording)
+#	Description:
+#		Memory-maps the pyramid saved next to a recording. Returns None if the file is missing,
+#		not a pyramid or does not match the recording (recordingId, channels, first timestamp, length).
+def LoadPyramid(path,recording):
+	try:
+		with open(path,'rb') as f:
+			raw = f.read(PYRAMID_HEADER_SIZE)
+	except IOError:
+		return None
+	size = struct.calcsize(PYRAMID_HEADER_FORMAT)
+	if len(raw) < PYRAMID_HEADER_SIZE or raw[:len(PYRAMID_MAGIC)] != PYRAMID_MAGIC:
+		return None
+	(magic,version,baseLevel,nChannel,nLevels,nFrames,firstTimestamp,recordingId) = struct.unpack(PYRAMID_HEADER_FORMAT,raw[:size])
+	if version != PYRAMID_VERSION or nChannel != recording.nChannel or nFrames > len(recording):
+		return None
+	if recordingId.rstrip(b'\0').decode('ascii','replace') != (recording.recordingId or ''):
+		return None
+	if nFrames and firstTimestamp != int(recording.timestamps(0,1)[0]):
+		return None
+	counts = struct.unpack('<%dQ' % nLevels,raw[size:size+8*nLevels])
+	if any(count != nFrames >> (baseLevel + i) for (i,count) in enumerate(counts)):
+		return None
+	pyramid = DecimationPyramid(nChannel,baseLevel,recording.channelNames[NUM_HEADER_COLUMNS:])
+	offset = PYRAMID_HEADER_SIZE
+	levels = []
+	for count in counts:
+		stats = np.memmap(path,dtype=np.float32,mode='r',offset=offset,shape=(3,count,nChannel))
+		levels.append(_Level(nChannel,stats))
+		offset += stats.nbytes
+	if levels:
+		pyramid.levels = levels
+	pyramid.nFrames = nFrames
+	pyramid.firstTimestamp = firstTimestamp if nFrames else None
+	pyramid.recordingId = recording.recordingId
+	tailStart = (nFrames >> baseLevel) << baseLevel
+	pyramid._tail = recording.frames(tailStart,nFrames,list(range(NUM_HEADER_COLUMNS,recording.nCol)))
+	return pyramid
+
+## RecordingPyramid(recording,baseLevel=4,persist=True,blockFrames=65536)
+#	Description:
+#		Pyramid of a recording (path or PyABMRecord.ABMRecording). The pyramid saved next to
+#		it (path + '.pyr') is memory-mapped; otherwise it is built once, reading blockFrames
+#		frames at a time, and saved. A pyramid saved while the recording was shorter is
+#		extended with the new frames. Ranges finer than 2**baseLevel samples per pixel are
+#		served from the samples of the recording.
+def RecordingPyramid(recording,baseLevel=4,persist=True,blockFrames=65536):
+	if not hasattr(recording,'frames'):
+		from PyABMRecord import ABMRecording
+		recording = ABMRecording(recording)
+	path = recording.path + '.pyr'
+	pyramid = LoadPyramid(path,recording) if persist else None
+	if pyramid is None:
+		pyramid = DecimationPyramid(recording.nChannel,baseLevel,recording.channelNames[NUM_HEADER_COLUMNS:])
+		pyramid.recordingId = recording.recordingId
+	start = pyramid.nFrames
+	channels = list(range(NUM_HEADER_COLUMNS,recording.nCol))
+	for i in range(start,len(recording),blockFrames):
+		if pyramid.firstTimestamp is None:
+			pyramid.firstTimestamp = int(recording.timestamps(0,1)[0])
+		pyramid.append(recording.frames(i,i + blockFrames,channels))
+	if persist and pyramid.nFrames > start:
+		try:
+			pyramid.save(path)
+		except IOError:
+			pass		# read-only location, the pyramid is simply rebuilt next time
+	pyramid.recording = recording
+	return pyramid
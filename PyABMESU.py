@@ -0,0 +1,171 @@
+#########################################################################
+#	PyABMESU.py
+#	Parser for the third party packets returned by GetThirdPartyData, as
+#	acquired with ABM's Multi-Channel External Sync Unit (MC-ESU)
+#
+#	Packet format (see ABMHandler.GetThirdPartyData):
+#		Flag (0x56,0x5A)	- 2 bytes
+#		Message Counter		- 1 byte (reserved)
+#		ESU timestamp		- 4 bytes (high byte first)
+#		Packet Length		- 2 bytes (high byte first)
+#		Packet Type			- 1 byte
+#		Third Party Data	- bytes = Packet Length
+#		Checksum			- 1 byte
+#	The checksum is taken as the sum, modulo 256, of all the packet bytes before it.
+#
+#	Usage:
+#		parser = ESUPacketParser()
+#		batch = parser.feed(ABMengine.GetThirdPartyDataArray())
+#		for i in range(len(batch)):
+#			print batch.packets['timestamp'][i], batch.payload(i)
+#########################################################################
+
+import numpy as np
+
+ESU_FLAG = (0x56, 0x5A)
+ESU_HEADER_SIZE = 10		# flag, counter, timestamp, length, type
+ESU_OVERHEAD = ESU_HEADER_SIZE + 1
+
+# one record per packet; offset/length locate the payload in ESUBatch.data
+ESU_PACKET_DTYPE = np.dtype([('timestamp', np.uint32),
+							 ('counter', np.uint8),
+							 ('type', np.uint8),
+							 ('offset', np.int64),
+							 ('length', np.uint16)])
+
+#########################################################################
+### Encoding (for simulation and benchmarks)
+
+## EncodeESUPackets(timestamps,types,payloads,counters=None)
+#	Returns the bytes of a stream of packets, one per (timestamp, type, payload)
+def EncodeESUPackets(timestamps,types,payloads,counters=None):
+	out = bytearray()
+	for (i,(ts,ptype,payload)) in enumerate(zip(timestamps,types,payloads)):
+		payload = bytearray(payload)
+		counter = (i if counters is None else counters[i]) & 0xff
+		ts = int(ts)
+		packet = bytearray([ESU_FLAG[0],ESU_FLAG[1],counter,
+							(ts >> 24) & 0xff,(ts >> 16) & 0xff,(ts >> 8) & 0xff,ts & 0xff,
+							(len(payload) >> 8) & 0xff,len(payload) & 0xff,int(ptype) & 0xff])
+		packet += payload
+		packet.append(sum(packet) & 0xff)
+		out += packet
+	return bytes(out)
+
+#########################################################################
+### Parsing
+
+## ESUBatch
+#	Packets parsed by one call to ESUPacketParser.feed
+#		packets: structured array of ESU_PACKET_DTYPE
+#		data: uint8 array the payload offsets refer to
+class ESUBatch(object):
+	def __init__(self,packets,data):
+		self.packets = packets
+		self.data = data
+
+	def __len__(self):
+		return len(self.packets)
+
+	## payload(i) - payload of packet i as a uint8 array (a view on data)
+	def payload(self,i):
+		offset = int(self.packets['offset'][i])
+		return self.data[offset:offset+int(self.packets['length'][i])]
+
+## ESUPacketParser
+#	Description:
+#		Incremental parser for the third party byte stream. Bytes of a packet that is not
+#		complete yet are kept and parsed with the next call, so packets may be split across
+#		calls to GetThirdPartyData. Candidate packets are located and checked with array
+#		operations over the whole buffer (flag search, lengths, checksums from a cumulative
+#		sum); only the chaining of accepted packets loops in Python, once per packet.
+#		After corrupted bytes the parser resynchronizes on the next flag that starts a
+#		packet with a valid checksum.
+#	Input Arguments:
+#		maxLength: largest payload accepted, longer declared lengths are treated as corruption
+#		verify: check the checksums
+class ESUPacketParser(object):
+	def __init__(self,maxLength=4096,verify=True):
+		self.maxLength = maxLength
+		self.verify = verify
+		self.packets = 0			# packets parsed
+		self.bytes = 0				# bytes fed
+		self.skipped = 0			# bytes dropped while resynchronizing
+		self.corrupted = 0			# complete candidate packets rejected (bad checksum or length)
+		self._carry = np.zeros(0,dtype=np.uint8)
+
+	def reset(self):
+		self._carry = np.zeros(0,dtype=np.uint8)
+
+	## feed(data)
+	#	Parses the bytes in data (bytes, bytearray or uint8 array) after any carried partial packet
+	#	Returns an ESUBatch with the complete packets found
+	def feed(self,data):
+		data = np.frombuffer(data,dtype=np.uint8) if isinstance(data,(bytes,bytearray)) else np.asarray(data,dtype=np.uint8)
+		self.bytes += len(data)
+		if len(self._carry):
+			buf = np.concatenate([self._carry,data])
+		else:
+			buf = data
+		n = len(buf)
+
+		# candidate packet starts and their declared extent
+		flags = np.flatnonzero((buf[:-1] == ESU_FLAG[0]) & (buf[1:] == ESU_FLAG[1]))
+		starts = flags[flags + ESU_HEADER_SIZE <= n]
+		partial = flags[flags + ESU_HEADER_SIZE > n]		# header not complete yet
+		lengths = (buf[starts+7].astype(np.int64) << 8) | buf[starts+8]
+		ends = starts + ESU_OVERHEAD + lengths
+		complete = ends <= n
+		valid = complete & (lengths <= self.maxLength)
+		if self.verify and len(starts):
+			csum = np.zeros(n + 1,dtype=np.int64)
+			np.cumsum(buf,out=csum[1:])
+			last = np.minimum(ends,n) - 1
+			valid &= ((csum[last] - csum[starts]) & 0xff) == buf[last]
+
+		# chain the valid packets, each one starting at or after the end of the previous one
+		validStarts = starts[valid].tolist()
+		validEnds = ends[valid].tolist()
+		accepted = []
+		pos = 0
+		i = 0
+		while i < len(validStarts):
+			if validStarts[i] >= pos:
+				accepted.append(i)
+				pos = validEnds[i]
+			i += 1
+		accepted = np.array(accepted,dtype=np.int64)
+		pStarts = starts[valid][accepted]
+		pEnds = ends[valid][accepted]
+
+		# keep the bytes from the first packet that may still be completed
+		pending = starts[(~complete) & (lengths <= self.maxLength) & (starts >= pos)]
+		partial = partial[partial >= pos]
+		if len(pending) or len(partial):
+			keep = min(pending[:1].tolist() + partial[:1].tolist())
+		elif n and buf[-1] == ESU_FLAG[0] and n - 1 >= pos:
+			keep = n - 1		# flag split across calls
+		else:
+			keep = n
+		keep = max(keep,pos)
+		self._carry = buf[keep:].copy()
+
+		# bookkeeping of the bytes dropped and of the rejected candidates
+		self.skipped += keep - int((pEnds - pStarts).sum())
+		rejected = starts[(complete | (lengths > self.maxLength)) & ~valid]
+		rejected = rejected[rejected < keep]
+		if len(rejected) and len(pStarts):
+			# flags inside the payload of an accepted packet are not corruption
+			j = np.searchsorted(pStarts,rejected,'right') - 1
+			rejected = rejected[(j < 0) | (rejected >= pEnds[np.maximum(j,0)])]
+		self.corrupted += len(rejected)
+		self.packets += len(pStarts)
+
+		packets = np.empty(len(pStarts),dtype=ESU_PACKET_DTYPE)
+		packets['counter'] = buf[pStarts+2]
+		packets['timestamp'] = (buf[pStarts+3].astype(np.uint32) << 24) | (buf[pStarts+4].astype(np.uint32) << 16) \
+			| (buf[pStarts+5].astype(np.uint32) << 8) | buf[pStarts+6]
+		packets['type'] = buf[pStarts+9]
+		packets['offset'] = pStarts + ESU_HEADER_SIZE
+		packets['length'] = pEnds - pStarts - ESU_OVERHEAD
+		return ESUBatch(packets,buf[:keep])
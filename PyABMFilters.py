@@ -0,0 +1,218 @@
+#########################################################################
+#	PyABMFilters.py
+#	Streaming filters and re-referencing of the EEG channels, applied to the
+#	frames of GetRawData batch after batch without edge artifacts at the
+#	batch boundaries
+#
+#	Filters are cascades of second-order sections (sos, one row
+#	[b0,b1,b2,a0,a1,a2] per section, the layout of scipy.signal). The
+#	design functions below only need numpy; scipy.signal.sosfilt is used to
+#	run the filters when it is installed.
+#
+#	Usage:
+#		sos = np.vstack([NotchSOS(60.0,256),BandpassSOS(1.0,40.0,256)])
+#		pipeline = Pipeline([FilterBank(nCh,sos),CommonAverageReference(nCh)])
+#		loop:
+#			(frames,timestamps) = pipeline.process(frames,timestamps)
+#########################################################################
+
+import numpy as np
+
+try:
+	from scipy.signal import sosfilt		# optional, faster filtering
+except ImportError:
+	sosfilt = None
+
+from PyABM import NUM_HEADER_COLUMNS
+from PyABMPipeline import PipelineStage
+
+#########################################################################
+### Design
+
+## BiquadSOS(kind,frequency,sampleRate,Q=0.7071)
+#	Description:
+#		One second-order section from the Audio EQ Cookbook (R. Bristow-Johnson).
+#	Input Arguments:
+#		kind: 'lowpass', 'highpass', 'bandpass' (0 dB peak) or 'notch'
+#		frequency: cutoff or center frequency in Hz
+#		Q: quality factor
+#	Output Arguments:
+#		(1, 6) sos array
+def BiquadSOS(kind,frequency,sampleRate,Q=0.7071067811865476):
+	w0 = 2 * np.pi * frequency / sampleRate
+	(cosw,alpha) = (np.cos(w0),np.sin(w0) / (2 * Q))
+	if kind == 'lowpass':
+		b = [(1 - cosw) / 2,1 - cosw,(1 - cosw) / 2]
+	elif kind == 'highpass':
+		b = [(1 + cosw) / 2,-(1 + cosw),(1 + cosw) / 2]
+	elif kind == 'bandpass':
+		b = [alpha,0.0,-alpha]
+	elif kind == 'notch':
+		b = [1.0,-2 * cosw,1.0]
+	else:
+		raise ValueError('Unknown biquad type: %r' % (kind,))
+	a = [1 + alpha,-2 * cosw,1 - alpha]
+	return np.array([b + a]) / a[0]
+
+## ButterworthSOS(order,frequency,sampleRate,kind='lowpass')
+#	Description:
+#		Digital Butterworth low-pass or high-pass filter (bilinear transform) as a cascade of
+#		biquads with the Butterworth pole Qs, plus a first-order section for odd orders.
+def ButterworthSOS(order,frequency,sampleRate,kind='lowpass'):
+	sections = []
+	for k in range(order // 2):
+		Q = 1.0 / (2 * np.sin((2 * k + 1) * np.pi / (2 * order)))
+		sections.append(BiquadSOS(kind,frequency,sampleRate,Q))
+	if order % 2:
+		K = np.tan(np.pi * frequency / sampleRate)
+		if kind == 'lowpass':
+			b = [K,K,0.0]
+		else:
+			b = [1.0,-1.0,0.0]
+		sections.append(np.array([b + [1 + K,K - 1,0.0]]) / (1 + K))
+	return np.vstack(sections)
+
+def LowpassSOS(frequency,sampleRate,order=4):
+	return ButterworthSOS(order,frequency,sampleRate,'lowpass')
+
+def HighpassSOS(frequency,sampleRate,order=4):
+	return ButterworthSOS(order,frequency,sampleRate,'highpass')
+
+## BandpassSOS(low,high,sampleRate,order=4) - Butterworth high-pass at low then low-pass at high
+def BandpassSOS(low,high,sampleRate,order=4):
+	return np.vstack([HighpassSOS(low,sampleRate,order),LowpassSOS(high,sampleRate,order)])
+
+## NotchSOS(frequency,sampleRate,Q=30.0,harmonics=1)
+#	Notch at the mains frequency, and at its first harmonics below Nyquist if harmonics > 1
+def NotchSOS(frequency,sampleRate,Q=30.0,harmonics=1):
+	sections = [BiquadSOS('notch',frequency * h,sampleRate,Q)
+				for h in range(1,harmonics + 1) if frequency * h < sampleRate / 2.0]
+	return np.vstack(sections)
+
+## StepState(sos)
+#	Description:
+#		State of each section (n_sections, 2) after a constant input of 1 has been applied
+#		forever (what scipy.signal.sosfilt_zi returns). Multiplied by the first sample, it
+#		starts the filter without the transient of a jump from zero.
+def StepState(sos):
+	sos = np.asarray(sos,dtype=np.float64)
+	zi = np.zeros((len(sos),2))
+	scale = 1.0
+	for (i,(b0,b1,b2,a0,a1,a2)) in enumerate(sos):
+		# transposed direct form II at rest with input 1 and output g (the DC gain)
+		g = (b0 + b1 + b2) / (1.0 + a1 + a2)
+		z1 = b2 - a2 * g
+		z0 = g - b0
+		zi[i] = (scale * z0,scale * z1)
+		scale *= g
+	return zi
+
+#########################################################################
+### Filtering
+
+# numpy version of sosfilt along axis 0 (transposed direct form II), state zi (n_sections, 2, nChannel)
+def _SOSFilter(sos,x,zi):
+	y = x
+	for (s,(b0,b1,b2,a0,a1,a2)) in enumerate(sos):
+		z0 = zi[s,0]
+		z1 = zi[s,1]
+		out = np.empty_like(y)
+		for t in range(len(y)):
+			xt = y[t]
+			yt = b0 * xt + z0
+			z0 = b1 * xt - a1 * yt + z1
+			z1 = b2 * xt - a2 * yt
+			out[t] = yt
+		zi[s,0] = z0
+		zi[s,1] = z1
+		y = out
+	return y
+
+## FilterBank
+#	Description:
+#		Pipeline stage running a cascade of second-order sections over every channel. The
+#		state of each section and channel is kept from one batch to the next, so filtering a
+#		recording batch by batch gives the same result as filtering it in one piece. A batch
+#		is filtered in one call for all channels (scipy.signal.sosfilt when available);
+#		the header columns are passed through unchanged.
+#	Input Arguments:
+#		nChannel: number of channels (the 6 header columns of the frames are skipped)
+#		sos: (n_sections, 6) filter, e.g. np.vstack([NotchSOS(...),BandpassSOS(...)])
+#		initial: 'step' - start as if the first sample had always been there (no transient)
+#				 'zero' - start from rest
+#		useScipy: None - scipy when installed, False - the numpy implementation
+class FilterBank(PipelineStage):
+	def __init__(self,nChannel,sos,initial='step',useScipy=None):
+		PipelineStage.__init__(self)
+		self.nChannel = nChannel
+		self.sos = np.atleast_2d(np.asarray(sos,dtype=np.float64))
+		if self.sos.shape[1] != 6:
+			raise ValueError('sos must have 6 columns')
+		if initial not in ('step','zero'):
+			raise ValueError("initial must be 'step' or 'zero'")
+		self.initial = initial
+		if useScipy is None:
+			useScipy = sosfilt is not None
+		elif useScipy and sosfilt is None:
+			raise ImportError('scipy is required for useScipy=True')
+		self.useScipy = useScipy
+		self.samples = 0
+		self.zi = None
+
+	## reset() - forget the state (e.g. after a gap in the data)
+	def reset(self):
+		self.zi = None
+
+	def process(self,frames,timestamps):
+		if len(frames) == 0:
+			return (frames,timestamps)
+		x = np.asarray(frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel],dtype=np.float64)
+		if self.zi is None:
+			zi = np.zeros((len(self.sos),2,self.nChannel))
+			if self.initial == 'step':
+				zi += StepState(self.sos)[:,:,None] * x[0]
+			self.zi = zi
+		if self.useScipy:
+			(y,self.zi) = sosfilt(self.sos,x,axis=0,zi=self.zi)
+		else:
+			y = _SOSFilter(self.sos,x,self.zi)
+		out = np.array(frames,dtype=np.float32)
+		out[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel] = y
+		self.samples += len(frames)
+		return (out,timestamps)
+
+## Rereference
+#	Description:
+#		Pipeline stage replacing the channels by linear combinations of them, one matrix
+#		product per batch: out = channels . matrix.T. With nOut rows the frames returned
+#		have nOut channels after the header columns.
+#	Input Arguments:
+#		matrix: (nOut, nChannel) re-referencing matrix (e.g. bipolar montage, linked mastoids)
+class Rereference(PipelineStage):
+	def __init__(self,matrix):
+		PipelineStage.__init__(self)
+		self.matrix = np.atleast_2d(np.asarray(matrix,dtype=np.float64))
+		self.nChannel = self.matrix.shape[1]
+		self._transposed = np.ascontiguousarray(self.matrix.T.astype(np.float32))
+
+	def process(self,frames,timestamps):
+		out = np.empty((len(frames),NUM_HEADER_COLUMNS + len(self.matrix)),dtype=np.float32)
+		out[:,:NUM_HEADER_COLUMNS] = frames[:,:NUM_HEADER_COLUMNS]
+		out[:,NUM_HEADER_COLUMNS:] = np.dot(np.asarray(frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel],
+													   dtype=np.float32),self._transposed)
+		return (out,timestamps)
+
+## CommonAverageMatrix(nChannel,exclude=())
+#	Returns the (nChannel, nChannel) matrix subtracting from every channel the average of
+#	the channels not excluded (excluded channels, e.g. EKG/AUX, are passed through unchanged)
+def CommonAverageMatrix(nChannel,exclude=()):
+	included = np.ones(nChannel,dtype=bool)
+	included[list(exclude)] = False
+	matrix = np.eye(nChannel)
+	matrix[np.ix_(included,included)] -= 1.0 / included.sum()
+	return matrix
+
+## CommonAverageReference(nChannel,exclude=()) - Rereference stage with CommonAverageMatrix
+class CommonAverageReference(Rereference):
+	def __init__(self,nChannel,exclude=()):
+		Rereference.__init__(self,CommonAverageMatrix(nChannel,exclude))
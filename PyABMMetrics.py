@@ -0,0 +1,362 @@
+#########################################################################
+#	PyABMMetrics.py
+#	Performance instrumentation of the acquisition loop: latency of the SDK
+#	calls, of the copy/convert steps and of the writers, samples per poll,
+#	SDK backlog, queue depths and bytes written
+#
+#	Nothing is measured unless instrumentation is switched on: the Instrument*
+#	functions wrap the methods of the given objects only when the registry is
+#	enabled, and leave them untouched otherwise, so disabled instrumentation
+#	costs nothing on the acquisition path. The default registry REGISTRY is
+#	enabled by setting the environment variable PYABM_METRICS=1.
+#
+#	Usage:
+#		registry = MetricsRegistry()						# or REGISTRY
+#		InstrumentHandler(ABMengine,registry,sampleRate=256)
+#		InstrumentRecorder(recorder,registry)
+#		server = MetricsServer(registry,('127.0.0.1',9464))	# Prometheus text on /metrics
+#		...
+#		print(registry.snapshot())
+#########################################################################
+
+import bisect
+import os
+import threading
+import timeit
+
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# upper bounds of the latency histogram buckets, in seconds (10 us to 10 s)
+LATENCY_BUCKETS = (1e-5,2.5e-5,5e-5,1e-4,2.5e-4,5e-4,1e-3,2.5e-3,5e-3,1e-2,2.5e-2,5e-2,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+# upper bounds of the samples per poll histogram buckets
+COUNT_BUCKETS = (0,1,2,4,8,16,32,64,128,256,512,1024,2048,4096,8192)
+
+# name of the metric with its labels, as in the Prometheus text format
+def _Key(name,labels):
+	if not labels:
+		return name
+	return '%s{%s}' % (name,','.join('%s="%s"' % item for item in labels))
+
+def _Number(value):
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value)) if isinstance(value,float) else str(value)
+
+#########################################################################
+### Metrics
+# Each metric is meant to be updated from one thread (the one making the calls
+# it measures) and can be read from any thread.
+
+## Counter - value that only goes up (inc), or read from function() when given
+class Counter(object):
+	kind = 'counter'
+
+	def __init__(self,function=None):
+		self.value = 0
+		self.function = function
+
+	def inc(self,amount=1):
+		self.value += amount
+
+	def get(self):
+		if self.function is not None:
+			return self.function()
+		return self.value
+
+## Gauge - value that goes up and down (set), or read from function() when given
+class Gauge(object):
+	kind = 'gauge'
+
+	def __init__(self,function=None):
+		self.value = 0
+		self.function = function
+
+	def set(self,value):
+		self.value = value
+
+	def get(self):
+		if self.function is not None:
+			return self.function()
+		return self.value
+
+## Histogram
+#	Distribution of observed values in fixed buckets (upper bounds, +Inf added), with
+#	their count and sum
+class Histogram(object):
+	kind = 'histogram'
+
+	def __init__(self,buckets=LATENCY_BUCKETS):
+		self.bounds = list(buckets)
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self,value):
+		self.counts[bisect.bisect_left(self.bounds,value)] += 1
+		self.count += 1
+		self.sum += value
+
+	## quantile(q) - upper bound of the bucket holding the q-quantile (0 <= q <= 1)
+	def quantile(self,q):
+		if self.count == 0:
+			return 0.0
+		rank = q * self.count
+		total = 0
+		for (bound,count) in zip(self.bounds + [float('inf')],self.counts):
+			total += count
+			if total >= rank:
+				return bound
+		return float('inf')
+
+	## get() - {count, sum, p50, p90, p99, buckets: [(upper bound, cumulative count)]}
+	def get(self):
+		cumulative = []
+		total = 0
+		for (bound,count) in zip(self.bounds + [float('inf')],self.counts):
+			total += count
+			cumulative.append((bound,total))
+		return {'count': self.count, 'sum': self.sum, 'p50': self.quantile(0.5),
+				'p90': self.quantile(0.9), 'p99': self.quantile(0.99), 'buckets': cumulative}
+
+## MetricsRegistry
+#	Description:
+#		Named metrics with optional labels, created on first use and shared afterwards:
+#			registry.counter('abm_bytes_written_total','Bytes written',writer='raw').inc(n)
+#		A disabled registry (enabled=False) makes the Instrument* functions do nothing.
+#	Input Arguments:
+#		enabled: whether the Instrument* functions instrument anything
+class MetricsRegistry(object):
+	def __init__(self,enabled=True):
+		self.enabled = enabled
+		self.metrics = {}				# {(name, labels): metric}
+		self.help = {}					# {name: (kind, help)}
+		self._lock = threading.Lock()
+
+	def _Get(self,cls,name,help,labels,*args):
+		key = (name,tuple(sorted(labels.items())))
+		metric = self.metrics.get(key)
+		if metric is None:
+			with self._lock:
+				metric = self.metrics.get(key)
+				if metric is None:
+					if self.help.setdefault(name,(cls.kind,help))[0] != cls.kind:
+						raise ValueError('%s is already a %s' % (name,self.help[name][0]))
+					metric = self.metrics[key] = cls(*args)
+		return metric
+
+	## counter(name,help='',function=None,**labels) - with function, the counter reads function() when collected
+	def counter(self,name,help='',function=None,**labels):
+		counter = self._Get(Counter,name,help,labels)
+		if function is not None:
+			counter.function = function
+		return counter
+
+	## gauge(name,help='',function=None,**labels) - as counter()
+	def gauge(self,name,help='',function=None,**labels):
+		gauge = self._Get(Gauge,name,help,labels)
+		if function is not None:
+			gauge.function = function
+		return gauge
+
+	def histogram(self,name,help='',buckets=LATENCY_BUCKETS,**labels):
+		return self._Get(Histogram,name,help,labels,buckets)
+
+	## snapshot() - {'name{labels}': value}, histograms as in Histogram.get()
+	def snapshot(self):
+		with self._lock:
+			items = sorted(self.metrics.items())
+		return dict((_Key(name,labels),metric.get()) for ((name,labels),metric) in items)
+
+	## prometheus() - all metrics in the Prometheus text exposition format
+	def prometheus(self):
+		with self._lock:
+			items = sorted(self.metrics.items())
+		lines = []
+		lastName = None
+		for ((name,labels),metric) in items:
+			if name != lastName:
+				(kind,help) = self.help[name]
+				lines.append('# HELP %s %s' % (name,help))
+				lines.append('# TYPE %s %s' % (name,kind))
+				lastName = name
+			value = metric.get()
+			if metric.kind != 'histogram':
+				lines.append('%s %s' % (_Key(name,labels),_Number(value)))
+				continue
+			for (bound,count) in value['buckets']:
+				lines.append('%s %d' % (_Key(name + '_bucket',labels + (('le',_Number(bound)),)),count))
+			lines.append('%s %s' % (_Key(name + '_sum',labels),_Number(value['sum'])))
+			lines.append('%s %d' % (_Key(name + '_count',labels),value['count']))
+		return '\n'.join(lines) + '\n'
+
+# default registry, enabled with the environment variable PYABM_METRICS=1
+REGISTRY = MetricsRegistry(enabled=os.environ.get('PYABM_METRICS','0') not in ('','0'))
+
+#########################################################################
+### Instrumentation
+
+## Instrumentation
+#	Returned by the Instrument* functions: the methods wrapped, remove() puts the original
+#	ones back
+class Instrumentation(object):
+	def __init__(self):
+		self.wrapped = []				# (object, attribute name, instance attribute replaced or None)
+
+	def wrap(self,obj,name,wrapper):
+		self.wrapped.append((obj,name,vars(obj).get(name)))
+		setattr(obj,name,wrapper)
+
+	def remove(self):
+		for (obj,name,original) in reversed(self.wrapped):
+			if original is None:
+				delattr(obj,name)
+			else:
+				setattr(obj,name,original)
+		self.wrapped = []
+
+# func timed into histogram
+def _Timed(func,histogram):
+	clock = timeit.default_timer
+	observe = histogram.observe
+	def timed(*args,**kwargs):
+		t0 = clock()
+		try:
+			return func(*args,**kwargs)
+		finally:
+			observe(clock() - t0)
+	return timed
+
+## InstrumentHandler(ABMengine,registry=REGISTRY,sampleRate=None)
+#	Description:
+#		Measures an ABMHandler:
+#		- abm_sdk_call_seconds{call}: latency of every SDK function call (ABMBinding)
+#		- abm_getter_seconds{getter}: latency of the array getters, SDK call and copy/convert
+#		- abm_samples_per_poll{getter}: samples returned by each array getter call
+#		- abm_samples_total{getter}: samples received
+#		- abm_sdk_lag_samples{getter} (with sampleRate): samples due at sampleRate since the first
+#		  samples were received minus the samples received; a value that keeps growing
+#		  means the SDK backlog grows, or samples are lost
+#		Does nothing when the registry is disabled.
+#	Output Arguments:
+#		Instrumentation, or None when the registry is disabled
+def InstrumentHandler(ABMengine,registry=REGISTRY,sampleRate=None):
+	if not registry.enabled:
+		return None
+	instrumentation = Instrumentation()
+	sdk = ABMengine.sdk
+	for name in sorted(vars(sdk)):
+		func = getattr(sdk,name)
+		if name[0].isupper() and callable(func):
+			histogram = registry.histogram('abm_sdk_call_seconds','Latency of the SDK function calls',call=name)
+			instrumentation.wrap(sdk,name,_Timed(func,histogram))
+	for name in ('GetRawDataArray','GetFilteredDataArray','GetDeconDataArray'):
+		instrumentation.wrap(ABMengine,name,_Getter(getattr(ABMengine,name),registry,name,sampleRate))
+	name = 'GetThirdPartyDataArray'
+	histogram = registry.histogram('abm_getter_seconds','Latency of the array getters',getter=name)
+	instrumentation.wrap(ABMengine,name,_Timed(getattr(ABMengine,name),histogram))
+	return instrumentation
+
+def _Getter(getter,registry,name,sampleRate):
+	clock = timeit.default_timer
+	latency = registry.histogram('abm_getter_seconds','Latency of the array getters',getter=name).observe
+	perPoll = registry.histogram('abm_samples_per_poll','Samples returned per getter call',COUNT_BUCKETS,getter=name).observe
+	total = registry.counter('abm_samples_total','Samples received',getter=name)
+	lag = registry.gauge('abm_sdk_lag_samples','Samples due at the sampling rate minus samples received',getter=name)
+	start = [None]
+	def getter_(*args,**kwargs):
+		t0 = clock()
+		frames = getter(*args,**kwargs)
+		t1 = clock()
+		latency(t1 - t0)
+		n = len(frames)
+		perPoll(n)
+		total.value += n
+		if sampleRate is not None and n:
+			if start[0] is None:
+				start[0] = t1 - n / float(sampleRate)		# first samples: assume no backlog
+			lag.value = (t1 - start[0]) * sampleRate - total.value
+		return frames
+	return getter_
+
+## InstrumentRecorder(recorder,registry=REGISTRY,name='recorder')
+#	Description:
+#		Measures the writes of a PyABMRecord.ABMRecorder (or any writer with write() and a
+#		bytesWritten attribute): abm_write_seconds{writer} and abm_bytes_written_total{writer}
+def InstrumentRecorder(recorder,registry=REGISTRY,name='recorder'):
+	if not registry.enabled:
+		return None
+	instrumentation = Instrumentation()
+	write = recorder.write
+	latency = registry.histogram('abm_write_seconds','Latency of the writes',writer=name)
+	registry.counter('abm_bytes_written_total','Bytes written',function=lambda: recorder.bytesWritten,writer=name)
+	instrumentation.wrap(recorder,'write',_Timed(write,latency))
+	return instrumentation
+
+## InstrumentStreamer(streamer,registry=REGISTRY,name='raw')
+#	Description:
+#		Queue depth of a PyABM.ABMStreamer, read when the metrics are collected (nothing is
+#		added to the poller thread): abm_queue_depth{queue} frames not read yet,
+#		abm_queue_overruns{queue} frames overwritten, abm_poll_interval_seconds{queue}
+def InstrumentStreamer(streamer,registry=REGISTRY,name='raw'):
+	if not registry.enabled:
+		return None
+	registry.gauge('abm_queue_depth','Frames or batches waiting in a queue',function=lambda: len(streamer.ring),queue=name)
+	registry.gauge('abm_queue_overruns','Frames or batches dropped from a queue',function=lambda: streamer.overruns,queue=name)
+	registry.gauge('abm_poll_interval_seconds','Current poll interval',function=lambda: streamer.interval,queue=name)
+	return Instrumentation()
+
+## InstrumentPublisher(publisher,registry=REGISTRY,name='publisher')
+#	Description:
+#		Queue depths of a PyABMServer.FramePublisher, read when the metrics are collected:
+#		abm_queue_depth{queue} batches waiting for the slowest subscriber,
+#		abm_queue_overruns{queue} batches dropped, abm_subscribers{queue}
+def InstrumentPublisher(publisher,registry=REGISTRY,name='publisher'):
+	if not registry.enabled:
+		return None
+	registry.gauge('abm_queue_depth','Frames or batches waiting in a queue',
+				   function=lambda: max([len(s.queue) for s in list(publisher.subscribers)] or [0]),queue=name)
+	registry.gauge('abm_queue_overruns','Frames or batches dropped from a queue',function=lambda: publisher.dropped,queue=name)
+	registry.gauge('abm_subscribers','Connected subscribers',function=lambda: len(publisher.subscribers),queue=name)
+	return Instrumentation()
+
+#########################################################################
+### HTTP endpoint
+
+## MetricsServer
+#	Description:
+#		Serves registry.prometheus() on GET /metrics from a daemon thread
+#	Input Arguments:
+#		registry: MetricsRegistry
+#		address: (host, port) to listen on; port 0 picks a free port (see .address)
+class MetricsServer(object):
+	def __init__(self,registry=REGISTRY,address=('127.0.0.1',9464)):
+		self.registry = registry
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split('?')[0] != '/metrics':
+					self.send_error(404)
+					return
+				body = registry.prometheus().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type','text/plain; version=0.0.4')
+				self.send_header('Content-Length',str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self,*args):
+				pass
+
+		self.server = HTTPServer(address,Handler)
+		self.address = self.server.server_address
+		self._thread = threading.Thread(target=self.server.serve_forever,name='MetricsServer')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self._thread.join()
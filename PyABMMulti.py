@@ -0,0 +1,344 @@
+#########################################################################
+#	PyABMMulti.py
+#	Acquisition from several B-Alert receivers at once, one worker process
+#	per device
+#
+#	Each worker loads its own SDK binding (see the loaders in PyABM.py),
+#	runs the session of its device and writes the samples into a ring buffer
+#	in shared memory, which the parent reads without any pickling. Every
+#	worker also estimates the offset between its device's timestamps and the
+#	host clock, so samples of different devices can be put on one time axis.
+#
+#	Usage:
+#		manager = AcquisitionManager([DeviceConfig('left',loader=...,deviceHandle=0),
+#									  DeviceConfig('right',loader=...,deviceHandle=1)])
+#		manager.start()
+#		loop:
+#			for (name,(frames,timestamps)) in manager.read_all().items():
+#				hostTime = manager.host_time(name,timestamps)
+#		manager.stop()
+#########################################################################
+
+from ctypes import *
+import collections
+import multiprocessing
+import os
+import time
+import traceback
+try:
+	from queue import Empty
+except ImportError:
+	from Queue import Empty
+
+import numpy as np
+
+from PyABM import (ABMHandler, ABM_SESSION_RAW, ACQ_STARTED_OK, FrameRing, INIT_SESSION_OK,
+				   NUM_HEADER_COLUMNS, TIMESTAMP_RAW, TimeStampUnwrapper)
+
+##########################################################################
+### Shared memory ring buffer
+
+## SharedFrameRing
+#	Description:
+#		FrameRing whose frames, timestamps and producer counters live in shared memory, so a
+#		worker process can write into it and the parent read from it. The consumer side
+#		(tail, overruns, read, latest) stays in the process that reads. Wake-ups of
+#		read(n,timeout) go through a multiprocessing Event. Pass the ring to the worker as
+#		an argument of multiprocessing.Process.
+#	Input Arguments:
+#		capacity: number of frames kept
+#		nCol: number of values per frame (nChannel+6)
+class SharedFrameRing(FrameRing):
+	def __init__(self,capacity,nCol):
+		self.capacity = capacity
+		self.nCol = nCol
+		self._frameBuffer = multiprocessing.RawArray(c_float,capacity * nCol)
+		self._tsBuffer = multiprocessing.RawArray(c_uint32,capacity)
+		self._counters = multiprocessing.RawArray(c_longlong,2)		# head, reserved
+		self._event = multiprocessing.Event()
+		self._Views()
+		self.tail = 0
+		self.overruns = 0
+
+	def _Views(self):
+		self.frames = np.frombuffer(self._frameBuffer,dtype=np.float32).reshape(self.capacity,self.nCol)
+		self.timestamps = np.frombuffer(self._tsBuffer,dtype=np.uint32)
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['frames']
+		del state['timestamps']
+		return state
+
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		self._Views()
+
+	@property
+	def head(self):
+		return self._counters[0]
+
+	@head.setter
+	def head(self,value):
+		self._counters[0] = value
+
+	@property
+	def reserved(self):
+		return self._counters[1]
+
+	@reserved.setter
+	def reserved(self,value):
+		self._counters[1] = value
+
+##########################################################################
+### Clock offset
+
+## ClockOffsetEstimator
+#	Description:
+#		Estimates the offset between a device clock and the host clock from the arrival time
+#		of each batch and the timestamp of its newest sample. The transfer delay only ever
+#		adds to (host time - device time), so the estimate is the lower envelope of that
+#		difference over the last 'window' batches; the spread above it is the delivery jitter.
+#	Input Arguments:
+#		window: number of batches considered
+class ClockOffsetEstimator(object):
+	def __init__(self,window=256):
+		self.differences = collections.deque(maxlen=window)
+		self.offset = None			# host ms - device ms
+		self.jitter = None			# median - minimum of the differences, in ms
+
+	## update(hostTime,deviceTime) - host time in seconds, device timestamp (unwrapped) in ms
+	def update(self,hostTime,deviceTime):
+		self.differences.append(hostTime * 1000.0 - deviceTime)
+		self.offset = min(self.differences)
+		self.jitter = float(np.median(self.differences)) - self.offset
+		return self.offset
+
+##########################################################################
+### Worker processes
+
+## DeviceConfig
+#	Description:
+#		Session settings of one device, sent to its worker process (must be picklable).
+#	Input Arguments:
+#		name: key of the device in the AcquisitionManager
+#		loader: SDK loader (WinDLLLoader, CDLLLoader, PyABMSim.SimLoader...), default ABM_Athena
+#		nChannel: number of channels, sizes the shared ring (checked against GetDeviceInfo)
+#		deviceType, sessionType, deviceHandle, playEBS: arguments of InitSession
+#		sampleRate: sampling rate in Hz
+class DeviceConfig(object):
+	def __init__(self,name,loader=None,nChannel=24,deviceType=3,sessionType=ABM_SESSION_RAW,
+				 deviceHandle=-1,playEBS=False,sampleRate=256):
+		self.name = name
+		self.loader = loader
+		self.nChannel = nChannel
+		self.deviceType = deviceType
+		self.sessionType = sessionType
+		self.deviceHandle = deviceHandle
+		self.playEBS = playEBS
+		self.sampleRate = sampleRate
+
+# worker counters in shared memory, written by the worker only
+class WorkerStats(Structure):
+	_fields_ = [("polls",c_longlong),
+				("samples",c_longlong),
+				("cpuSeconds",c_double),
+				("clockOffset",c_double),		# host ms - device ms (NaN until the first batch)
+				("lastTimestamp",c_longlong),	# unwrapped device timestamp of the newest sample
+				("jitter",c_double),
+				("running",c_int)]
+
+# body of a worker process: runs the session of one device until 'stop' is set
+def _DeviceWorker(config,ring,stats,stop,messages,pollInterval,offsetWindow):
+	try:
+		ABMengine = ABMHandler(loader=config.loader)
+		info = ABMengine.GetDeviceInfo()
+		if info.nNumberOfChannel != config.nChannel:
+			raise ValueError('%d channels configured, the device has %d' % (config.nChannel,info.nNumberOfChannel))
+		init = ABMengine.InitSession(config.deviceType,config.sessionType,config.deviceHandle,config.playEBS)
+		if init != INIT_SESSION_OK:
+			raise RuntimeError('InitSession returned %d' % init)
+		stat = ABMengine.StartAcquisition()
+		if stat != ACQ_STARTED_OK:
+			raise RuntimeError('StartAcquisition returned %d' % stat)
+	except Exception:
+		messages.put((config.name,'error',traceback.format_exc()))
+		return
+	stats.clockOffset = float('nan')
+	stats.running = 1
+	messages.put((config.name,'started',info.chDeviceName.decode('ascii','replace')))
+	estimator = ClockOffsetEstimator(offsetWindow)
+	unwrapper = TimeStampUnwrapper()
+	try:
+		while not stop.is_set():
+			frames = ABMengine.GetRawDataArray(copy=False)
+			hostTime = time.time()
+			stats.polls += 1
+			n = len(frames)
+			if n:
+				timestamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,n)
+				ring.write(frames,timestamps)
+				stats.samples += n
+				newest = int(unwrapper.unwrap(timestamps[-1:])[0])
+				stats.lastTimestamp = newest
+				stats.clockOffset = estimator.update(hostTime,newest)
+				stats.jitter = estimator.jitter
+			if stats.polls % 16 == 0:
+				(user,system) = os.times()[:2]
+				stats.cpuSeconds = user + system
+			stop.wait(pollInterval)
+		ABMengine.StopAcquisition()
+	except Exception:
+		messages.put((config.name,'error',traceback.format_exc()))
+	finally:
+		(user,system) = os.times()[:2]
+		stats.cpuSeconds = user + system
+		stats.running = 0
+
+##########################################################################
+### Manager
+
+## AcquisitionManager
+#	Description:
+#		Runs one worker process per DeviceConfig and gives access to the samples of all
+#		devices. Frames come back through a SharedFrameRing per device; only start-up
+#		messages and errors go through a queue.
+#	Input Arguments:
+#		devices: list of DeviceConfig (names must be unique)
+#		bufferSeconds: length of each ring buffer
+#		pollInterval: seconds between the polls of a worker
+#		offsetWindow: batches used for the clock offset estimate
+class AcquisitionManager(object):
+	def __init__(self,devices,bufferSeconds=30,pollInterval=0.02,offsetWindow=256):
+		self.devices = collections.OrderedDict((config.name,config) for config in devices)
+		if len(self.devices) != len(devices):
+			raise ValueError('Device names must be unique')
+		self.pollInterval = pollInterval
+		self.offsetWindow = offsetWindow
+		self.rings = collections.OrderedDict()
+		self.stats = collections.OrderedDict()
+		for (name,config) in self.devices.items():
+			self.rings[name] = SharedFrameRing(int(bufferSeconds * config.sampleRate),config.nChannel + NUM_HEADER_COLUMNS)
+			self.stats[name] = multiprocessing.RawValue(WorkerStats)
+		self.deviceNames = {}				# name: chDeviceName reported by the device
+		self.errors = {}					# name: traceback of the failure of its worker
+		self._stop = multiprocessing.Event()
+		self._messages = multiprocessing.Queue()
+		self._processes = collections.OrderedDict()
+
+	@property
+	def names(self):
+		return list(self.devices)
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self,*exc):
+		self.stop()
+
+	## start(timeout=30)
+	#	Starts the workers and waits until every device is acquiring. If one fails, all are
+	#	stopped and RuntimeError is raised with the worker's traceback.
+	def start(self,timeout=30):
+		self._stop.clear()
+		for (name,config) in self.devices.items():
+			process = multiprocessing.Process(target=_DeviceWorker,name='ABM-%s' % name,
+				args=(config,self.rings[name],self.stats[name],self._stop,self._messages,
+					  self.pollInterval,self.offsetWindow))
+			process.daemon = True
+			process.start()
+			self._processes[name] = process
+		pending = set(self.devices)
+		deadline = time.time() + timeout
+		while pending and not self.errors:
+			try:
+				(name,kind,detail) = self._messages.get(timeout=max(0.01,deadline - time.time()))
+			except Empty:
+				break
+			self._Message(name,kind,detail)
+			pending.discard(name)
+		if self.errors or pending:
+			self.stop()
+			if self.errors:
+				(name,detail) = sorted(self.errors.items())[0]
+				raise RuntimeError('Device %s failed to start:\n%s' % (name,detail))
+			raise RuntimeError('Devices did not start in time: %s' % ', '.join(sorted(pending)))
+
+	def _Message(self,name,kind,detail):
+		if kind == 'started':
+			self.deviceNames[name] = detail
+		elif kind == 'error':
+			self.errors[name] = detail
+
+	## stop(timeout=10) - stops every worker (each one calls StopAcquisition)
+	def stop(self,timeout=10):
+		self._stop.set()
+		deadline = time.time() + timeout
+		for process in self._processes.values():
+			process.join(max(0,deadline - time.time()))
+			if process.is_alive():
+				process.terminate()
+		self._processes.clear()
+		self.check()
+
+	## check()
+	#	Collects the errors reported by the workers since the last call, returns {name: traceback}
+	def check(self):
+		while True:
+			try:
+				(name,kind,detail) = self._messages.get_nowait()
+			except Empty:
+				break
+			self._Message(name,kind,detail)
+		return self.errors
+
+	def running(self,name):
+		process = self._processes.get(name)
+		return process is not None and process.is_alive() and bool(self.stats[name].running)
+
+	## read(name,n=None,timeout=0)
+	#	Returns up to n unread (frames, timestamps) of one device, see FrameRing.read
+	def read(self,name,n=None,timeout=0):
+		return self.rings[name].read(n,timeout)
+
+	## read_all() - {name: (frames, timestamps)} of the unread samples of every device
+	def read_all(self):
+		return collections.OrderedDict((name,ring.read()) for (name,ring) in self.rings.items())
+
+	def latest(self,name,seconds):
+		return self.rings[name].latest(int(round(seconds * self.devices[name].sampleRate)))
+
+	## clock_offset(name) - host ms minus device ms for the device, None before the first samples
+	def clock_offset(self,name):
+		offset = self.stats[name].clockOffset
+		if offset != offset:		# NaN
+			return None
+		return offset
+
+	## unwrap(name,timestamps)
+	#	Unwraps device timestamps (ms) of the device, e.g. the uint32 timestamps returned by read(),
+	#	to the int64 time axis of its clock offset: each one is taken as the value closest to
+	#	the newest timestamp of the worker (within 2**31 ms, about 24 days)
+	def unwrap(self,name,timestamps):
+		newest = self.stats[name].lastTimestamp
+		difference = (np.asarray(timestamps,dtype=np.int64) - newest + 2**31) % 2**32 - 2**31
+		return newest + difference
+
+	## host_time(name,timestamps)
+	#	Converts device timestamps (ms) to host time in seconds (as time.time()). The timestamps
+	#	returned by read() can be passed as they are: they are unwrapped first (see unwrap)
+	def host_time(self,name,timestamps):
+		offset = self.clock_offset(name)
+		if offset is None:
+			raise ValueError('No clock offset estimate for %s yet' % name)
+		return (self.unwrap(name,timestamps).astype(np.float64) + offset) / 1000.0
+
+	## counters() - {name: {polls, samples, overruns, cpuSeconds, clockOffset, jitter}}
+	def counters(self):
+		counters = collections.OrderedDict()
+		for (name,stats) in self.stats.items():
+			counters[name] = {'polls': stats.polls, 'samples': stats.samples,
+							  'overruns': self.rings[name].overruns, 'cpuSeconds': stats.cpuSeconds,
+							  'clockOffset': self.clock_offset(name), 'jitter': stats.jitter}
+		return counters
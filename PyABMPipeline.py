@@ -0,0 +1,50 @@
+#########################################################################
+#	PyABMPipeline.py
+#	Processing stages for the frames acquired with PyABM.py
+#
+#	A stage takes a batch of (n, nChannel+6) frames and their timestamps, as
+#	returned by GetRawDataArray/GetFilteredDataArray and
+#	GetTimeStampsStreamData, and returns the frames handed to the next stage
+#	(unchanged for stages that only analyze them). Results computed along the
+#	way (per epoch) are published to the callbacks subscribed to the stage.
+#
+#	Usage:
+#		psd = WelchPSD(nCh)
+#		psd.subscribe(lambda result: ...)
+#		pipeline = Pipeline([psd])
+#		loop:
+#			pipeline.process(frames,timestamps)
+#########################################################################
+
+## PipelineStage
+#	Base class of the stages. Subclasses implement process(frames,timestamps) and call
+#	publish(result) for each result they produce.
+class PipelineStage(object):
+	def __init__(self):
+		self._subscribers = []
+
+	## subscribe(callback) - callback(result) is called for every published result
+	def subscribe(self,callback):
+		self._subscribers.append(callback)
+
+	def unsubscribe(self,callback):
+		self._subscribers.remove(callback)
+
+	def publish(self,result):
+		for callback in self._subscribers:
+			callback(result)
+
+	## process(frames,timestamps) - returns the (frames, timestamps) for the next stage
+	def process(self,frames,timestamps):
+		raise NotImplementedError
+
+## Pipeline
+#	Runs batches through a list of stages in order
+class Pipeline(object):
+	def __init__(self,stages):
+		self.stages = list(stages)
+
+	def process(self,frames,timestamps):
+		for stage in self.stages:
+			(frames,timestamps) = stage.process(frames,timestamps)
+		return (frames,timestamps)
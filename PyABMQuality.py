@@ -0,0 +1,211 @@
+#########################################################################
+#	PyABMQuality.py
+#	Online signal quality monitoring of the EEG channels: flat, saturated,
+#	noisy or artifact-laden electrodes are reported while recording
+#
+#	Usage:
+#		quality = QualityMonitor(nCh)
+#		quality.subscribe(lambda result: ...)		# QualityEvent and QualityEpoch results
+#		pipeline = Pipeline([quality,...])
+#		loop:
+#			pipeline.process(frames,timestamps)
+#########################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from PyABM import NUM_HEADER_COLUMNS
+from PyABMPipeline import PipelineStage
+
+# quality flags of a channel (bit mask)
+QUALITY_OK = 0
+QUALITY_FLAT = 1			# (almost) no change between successive samples
+QUALITY_SATURATED = 2		# samples at the limit of the amplifier range
+QUALITY_LINE_NOISE = 4		# strong mains interference
+QUALITY_ARTIFACT = 8		# peak-to-peak amplitude too large
+QUALITY_NOISY = 16			# standard deviation too large
+QUALITY_NAMES = [(QUALITY_FLAT, 'flat'), (QUALITY_SATURATED, 'saturated'), (QUALITY_LINE_NOISE, 'line noise'),
+				 (QUALITY_ARTIFACT, 'artifact'), (QUALITY_NOISY, 'noisy')]
+
+## QualityNames(flags) - names of the flags set in a quality mask
+def QualityNames(flags):
+	return [name for (flag,name) in QUALITY_NAMES if flags & flag]
+
+## QualityEvent
+#	Published by QualityMonitor when the flags of a channel change
+#		timestamp: timestamp of the last sample of the block where the change was seen
+#		sample: number of samples processed at that point
+#		channel: channel index (0 = first channel after the header values)
+#		flags, previous: new and previous quality flags
+QualityEvent = namedtuple('QualityEvent', ['timestamp', 'sample', 'channel', 'flags', 'previous'])
+
+## QualityEpoch
+#	Published by QualityMonitor once per epoch
+#		epoch: epoch number (from 0)
+#		timestamp: timestamp of the last sample
+#		flags: (nChannel,) quality flags
+#		metrics: {name: (nChannel,) array} over the sliding window - mean, std, peakToPeak (uV),
+#			flatFraction, saturatedFraction (0-1), lineNoise (uV amplitude)
+QualityEpoch = namedtuple('QualityEpoch', ['epoch', 'timestamp', 'flags', 'metrics'])
+
+## QualityMonitor
+#	Description:
+#		Pipeline stage computing per-channel statistics over a sliding window of the last
+#		windowSeconds. The window is split in blocks of blockSize samples; each completed
+#		block is reduced once, for all channels together, to its sum, sum of squares, min,
+#		max, count of flat steps and saturated samples and its projection on the mains
+#		frequency (sin and cos). The window totals are updated by adding the new block and
+#		subtracting the one leaving the window, so the cost per sample does not depend on
+#		the window length. Channel flags are evaluated after each batch and at the end of each
+#		epoch; a QualityEvent is published for each channel whose flags changed and a
+#		QualityEpoch every epochSeconds.
+#	Input Arguments:
+#		nChannel: number of channels (the 6 header columns of the frames are skipped)
+#		sampleRate: sampling rate in Hz
+#		windowSeconds: length of the sliding window
+#		blockSize: samples per block (the window holds a whole number of blocks)
+#		epochSeconds: interval between published summaries
+#		lineFrequency: mains frequency in Hz (50 or 60)
+#		flatStep: steps smaller than this (uV) count as flat
+#		flatFraction: fraction of flat steps above which a channel is flat
+#		saturationLevel: absolute value (uV) at or above which a sample is saturated
+#		saturatedFraction: fraction of saturated samples above which a channel is saturated
+#		lineNoise: mains amplitude (uV) above which a channel has line noise
+#		peakToPeak: peak-to-peak amplitude (uV) above which a channel has an artifact
+#		maxStd: standard deviation (uV) above which a channel is noisy
+#		ignore: channel indices that are never flagged (e.g. DEVICE_INFO.nECGPos)
+class QualityMonitor(PipelineStage):
+	def __init__(self,nChannel,sampleRate=256,windowSeconds=2.0,blockSize=32,epochSeconds=1.0,
+				 lineFrequency=60.0,flatStep=0.1,flatFraction=0.9,saturationLevel=3000.0,
+				 saturatedFraction=0.01,lineNoise=20.0,peakToPeak=500.0,maxStd=100.0,ignore=()):
+		PipelineStage.__init__(self)
+		self.nChannel = nChannel
+		self.sampleRate = float(sampleRate)
+		self.blockSize = blockSize
+		self.nBlocks = max(1,int(round(windowSeconds * sampleRate / blockSize)))
+		self.epochBlocks = max(1,int(round(epochSeconds * sampleRate / blockSize)))
+		self.omega = 2 * np.pi * lineFrequency / self.sampleRate
+		self.flatStep = flatStep
+		self.flatFraction = flatFraction
+		self.saturationLevel = saturationLevel
+		self.saturatedFraction = saturatedFraction
+		self.lineNoise = lineNoise
+		self.peakToPeak = peakToPeak
+		self.maxStd = maxStd
+		self.monitored = np.ones(nChannel,dtype=bool)
+		self.monitored[list(ignore)] = False
+
+		# per-block statistics of the blocks in the window (rows: sum, sum of squares, flat
+		# steps, saturated samples, cos and sin projections) and their running totals
+		self._blocks = np.zeros((self.nBlocks,6,nChannel))
+		self._totals = np.zeros((6,nChannel))
+		self._min = np.zeros((self.nBlocks,nChannel))
+		self._max = np.zeros((self.nBlocks,nChannel))
+		# sums of the reference cos/sin over each block (to take the mean out of the projections)
+		self._ref = np.zeros((self.nBlocks,2))
+		self._refTotal = np.zeros(2)
+		self._pending = np.zeros((blockSize,nChannel))
+		self._pendingTs = np.zeros(blockSize,dtype=np.int64)
+		self._fill = 0
+		self._last = None				# last sample, for the step of the next one
+		self.blocks = 0					# blocks processed
+		self.samples = 0				# samples processed (in complete blocks)
+		self.epochs = 0					# summaries published
+		self.events = 0					# events published
+		self.flags = np.zeros(nChannel,dtype=np.int32)
+		self.metrics = None
+
+	def process(self,frames,timestamps):
+		data = frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel]
+		n = len(data)
+		i = 0
+		while i < n:
+			if self._fill == 0 and n - i >= self.blockSize:
+				# whole blocks straight from the batch
+				k = (n - i) // self.blockSize * self.blockSize
+				self._Blocks(data[i:i+k],timestamps[i+self.blockSize-1:i+k:self.blockSize])
+				i += k
+				continue
+			k = min(n - i,self.blockSize - self._fill)
+			self._pending[self._fill:self._fill+k] = data[i:i+k]
+			self._pendingTs[self._fill:self._fill+k] = timestamps[i:i+k]
+			self._fill += k
+			i += k
+			if self._fill == self.blockSize:
+				self._Blocks(self._pending,self._pendingTs[-1:])
+				self._fill = 0
+		return (frames,timestamps)
+
+	# reduce nb complete blocks (nb*blockSize, nChannel) and update the window with each of them
+	def _Blocks(self,x,blockTimestamps):
+		x = np.asarray(x,dtype=np.float64)
+		nb = len(x) // self.blockSize
+		bs = self.blockSize
+		if self._last is None:
+			self._last = x[0]
+		steps = np.empty_like(x)
+		steps[0] = x[0] - self._last
+		steps[1:] = x[1:] - x[:-1]
+		self._last = x[-1].copy()
+		idx = self.samples + np.arange(len(x))
+		ref = np.empty((nb,2,bs))
+		ref[:,0] = np.cos(self.omega * idx).reshape(nb,bs)
+		ref[:,1] = np.sin(self.omega * idx).reshape(nb,bs)
+		blocks = x.reshape(nb,bs,self.nChannel)
+		stats = np.empty((nb,6,self.nChannel))
+		stats[:,0] = blocks.sum(axis=1)
+		stats[:,1] = np.einsum('ijk,ijk->ik',blocks,blocks)
+		stats[:,2] = (np.abs(steps) < self.flatStep).reshape(nb,bs,self.nChannel).sum(axis=1)
+		stats[:,3] = (np.abs(blocks) >= self.saturationLevel).sum(axis=1)
+		stats[:,4:] = np.matmul(ref,blocks)
+		mins = blocks.min(axis=1)
+		maxs = blocks.max(axis=1)
+		refSums = ref.sum(axis=2)
+		for j in range(nb):
+			slot = self.blocks % self.nBlocks
+			self._totals += stats[j] - self._blocks[slot]
+			self._blocks[slot] = stats[j]
+			self._refTotal += refSums[j] - self._ref[slot]
+			self._ref[slot] = refSums[j]
+			self._min[slot] = mins[j]
+			self._max[slot] = maxs[j]
+			self.blocks += 1
+			self.samples += bs
+			if slot == self.nBlocks - 1 and self.blocks % (64 * self.nBlocks) == 0:
+				self._totals = self._blocks.sum(axis=0)		# drop the rounding drift
+				self._refTotal = self._ref.sum(axis=0)
+			# flags after the last block of the batch and at the end of each epoch
+			epoch = self.blocks % self.epochBlocks == 0
+			if epoch or j == nb - 1:
+				self._Evaluate(int(blockTimestamps[j]),epoch)
+
+	# metrics of the current window, flags, events and summaries
+	def _Evaluate(self,timestamp,epoch):
+		filled = min(self.blocks,self.nBlocks)
+		n = float(filled * self.blockSize)
+		(mean,meanSq,flat,saturated,c,s) = self._totals / n
+		std = np.sqrt(np.maximum(meanSq - mean * mean,0.0))
+		peakToPeak = self._max[:filled].max(axis=0) - self._min[:filled].min(axis=0)
+		# projection of (x - mean) on the mains frequency, as an amplitude
+		c = c - mean * self._refTotal[0] / n
+		s = s - mean * self._refTotal[1] / n
+		line = 2.0 * np.sqrt(c * c + s * s)
+		flags = np.zeros(self.nChannel,dtype=np.int32)
+		flags[flat >= self.flatFraction] |= QUALITY_FLAT
+		flags[saturated >= self.saturatedFraction] |= QUALITY_SATURATED
+		flags[line >= self.lineNoise] |= QUALITY_LINE_NOISE
+		flags[peakToPeak >= self.peakToPeak] |= QUALITY_ARTIFACT
+		flags[std >= self.maxStd] |= QUALITY_NOISY
+		flags[~self.monitored] = QUALITY_OK
+		self.metrics = {'mean': mean, 'std': std, 'peakToPeak': peakToPeak, 'flatFraction': flat,
+						'saturatedFraction': saturated, 'lineNoise': line}
+		changed = np.flatnonzero(flags != self.flags)
+		previous = self.flags
+		self.flags = flags
+		for ch in changed.tolist():
+			self.events += 1
+			self.publish(QualityEvent(timestamp,self.samples,ch,int(flags[ch]),int(previous[ch])))
+		if epoch:
+			self.publish(QualityEpoch(self.epochs,timestamp,flags,self.metrics))
+			self.epochs += 1
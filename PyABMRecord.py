@@ -0,0 +1,709 @@
+#########################################################################
+#	PyABMRecord.py
+#	Binary recording of the frames and timestamps acquired with PyABM.py
+#
+#	File layout (little-endian):
+#		Header (HEADER_SIZE bytes)
+#			magic 'PYABMREC', format version, flags, number of columns (nChannel+6),
+#			nNumberOfChannel, frames per chunk, sample rate, number of frames recorded,
+#			length of the JSON metadata that follows (channel names, device name, recording id)
+#		Chunks, each holding chunkFrames frames:
+#			timestamps	- uint32[chunkFrames]
+#			samples		- float32[nCol][chunkFrames] (one contiguous block per column)
+#	All chunks have the same size, so chunk k starts at HEADER_SIZE + k*chunkBytes and a
+#	single column can be read without touching the other ones.
+#
+#	Compressed recordings (version 2, FLAG_COMPRESSED in the header flags) store each chunk
+#	as a record instead:
+#		magic 'CHNK', frames in the chunk, length of the timestamps block, length of the
+#		samples block, first timestamp of the chunk (RECORD_FORMAT)
+#		timestamps block - uint32 deltas, byte-shuffled and compressed
+#		samples block	 - each column XOR'ed (or subtracted) with its previous value as
+#						   uint32, byte-shuffled and compressed
+#	The records follow each other, the last one can hold a partial chunk. Readers find them
+#	by walking the record headers, which also give the time index without decompressing.
+#
+#	Usage:
+#		rec = ABMRecorder('session.abr',nChannel=24)		# compression='zlib' to compress
+#		rec.write(frames,timestamps)		# e.g. from ABMStreamer.read()
+#		rec.close()
+#		data = ABMRecording('session.abr')
+#		fz = data.column('Fz')
+#		(t,eeg) = data.read_window(t0,t0+2000,channels=['Fz','Cz'])
+#########################################################################
+
+import binascii
+import collections
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+try:
+	from queue import Queue
+except ImportError:
+	from Queue import Queue
+
+import numpy as np
+
+try:
+	import lz4.frame as lz4frame		# optional, faster codec
+except ImportError:
+	lz4frame = None
+
+from PyABM import ChannelNames, NUM_HEADER_COLUMNS, TimeStampUnwrapper
+
+MAGIC = b'PYABMREC'
+VERSION = 2							# uncompressed recordings are still written as version 1
+HEADER_SIZE = 4096
+HEADER_FORMAT = '<8sHHIIIdQI'		# magic, version, flags, nCol, nChannel, chunkFrames, sampleRate, nFrames, metaLen
+NFRAMES_OFFSET = struct.calcsize('<8sHHIIId')
+FLAG_COMPRESSED = 1
+RECORD_MAGIC = b'CHNK'
+RECORD_FORMAT = '<4sIIII'			# magic, nFrames, timestamps length, samples length, first timestamp
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+#########################################################################
+### Header
+
+def _PackHeader(nCol,nChannel,chunkFrames,sampleRate,nFrames,meta,flags=0):
+	metaBytes = json.dumps(meta).encode('utf-8')
+	version = VERSION if flags & FLAG_COMPRESSED else 1
+	head = struct.pack(HEADER_FORMAT,MAGIC,version,flags,nCol,nChannel,chunkFrames,sampleRate,nFrames,len(metaBytes))
+	if len(head) + len(metaBytes) > HEADER_SIZE:
+		raise ValueError('Recording metadata does not fit in the header')
+	return head + metaBytes + b'\0' * (HEADER_SIZE - len(head) - len(metaBytes))
+
+def _ReadHeader(f):
+	f.seek(0)
+	raw = f.read(HEADER_SIZE)
+	if len(raw) < HEADER_SIZE or raw[:len(MAGIC)] != MAGIC:
+		raise IOError('Not a PyABM recording')
+	fields = struct.unpack(HEADER_FORMAT,raw[:struct.calcsize(HEADER_FORMAT)])
+	(magic,version,flags,nCol,nChannel,chunkFrames,sampleRate,nFrames,metaLen) = fields
+	if version > VERSION:
+		raise IOError('Unsupported recording version %d' % version)
+	start = struct.calcsize(HEADER_FORMAT)
+	meta = json.loads(raw[start:start+metaLen].decode('utf-8'))
+	return dict(version=version,flags=flags,nCol=nCol,nChannel=nChannel,chunkFrames=chunkFrames,
+				sampleRate=sampleRate,nFrames=nFrames,meta=meta)
+
+# random id written in the metadata of each new recording; the files derived from a
+# recording (SIDECARS) keep it, so those of an earlier recording at the same path are not reused
+def _NewRecordingId():
+	return binascii.hexlify(os.urandom(8)).decode('ascii')
+
+SIDECARS = ('.idx','.pyr')		# suffixes of the files derived from a recording, deleted when it is rewritten
+
+#########################################################################
+### Chunk compression
+
+# codec name: (compress(data,level), decompress(data)); zlib is always available
+CODECS = {'zlib': (zlib.compress,zlib.decompress)}
+if lz4frame is not None:
+	CODECS['lz4'] = (lambda data,level: lz4frame.compress(data,compression_level=level),lz4frame.decompress)
+
+# filters applied to the uint32 bit patterns of each column before shuffling
+FILTERS = ('xor','delta',None)
+
+# byte-shuffles (rows, n) uint32 words (each row's bytes grouped by significance) and compresses them
+def _Pack(words,codec,level):
+	(rows,n) = words.shape
+	shuffled = np.ascontiguousarray(words.view(np.uint8).reshape(rows,n,4).transpose(0,2,1))
+	return CODECS[codec][0](shuffled.tobytes(),level)
+
+def _Unpack(payload,rows,n,codec):
+	shuffled = np.frombuffer(CODECS[codec][1](payload),dtype=np.uint8).reshape(rows,4,n)
+	return np.ascontiguousarray(shuffled.transpose(0,2,1)).view(np.uint32).reshape(rows,n)
+
+## EncodeChunk(samples,timestamps,filter='xor',codec='zlib',level=1)
+#	Description:
+#		Compresses a chunk of a recording: the (nCol, n) float32 samples, each column XOR'ed
+#		('xor') or subtracted ('delta') with its previous value as uint32 (None: as they are),
+#		and the n uint32 timestamps as deltas, both byte-shuffled. Lossless for any value.
+#	Output Arguments:
+#		(timestamps block, samples block) as bytes
+def EncodeChunk(samples,timestamps,filter='xor',codec='zlib',level=1):
+	words = np.asarray(samples,dtype=np.float32).view(np.uint32)
+	encoded = np.empty(words.shape,dtype=np.uint32)
+	encoded[:,:1] = words[:,:1]
+	if filter == 'xor':
+		np.bitwise_xor(words[:,1:],words[:,:-1],out=encoded[:,1:])
+	elif filter == 'delta':
+		np.subtract(words[:,1:],words[:,:-1],out=encoded[:,1:])
+	else:
+		encoded[:,1:] = words[:,1:]
+	ts = np.asarray(timestamps,dtype=np.uint32)
+	deltas = np.empty((1,len(ts)),dtype=np.uint32)
+	deltas[0,:1] = ts[:1]
+	np.subtract(ts[1:],ts[:-1],out=deltas[0,1:])
+	return (_Pack(deltas,codec,level),_Pack(encoded,codec,level))
+
+## DecodeTimestamps(block,n,codec='zlib') - the n uint32 timestamps of a timestamps block
+def DecodeTimestamps(block,n,codec='zlib'):
+	deltas = _Unpack(block,1,n,codec)[0]
+	return np.cumsum(deltas,dtype=np.uint32)
+
+## DecodeSamples(block,nCol,n,filter='xor',codec='zlib') - the (nCol, n) float32 samples of a samples block
+def DecodeSamples(block,nCol,n,filter='xor',codec='zlib'):
+	words = _Unpack(block,nCol,n,codec)
+	if filter == 'xor':
+		np.bitwise_xor.accumulate(words,axis=1,out=words)
+	elif filter == 'delta':
+		np.cumsum(words,axis=1,dtype=np.uint32,out=words)
+	return words.view(np.float32)
+
+#########################################################################
+### Writer
+
+## ABMRecorder
+#	Description:
+#		Appends frames and timestamps to a binary recording. Frames are collected into
+#		fixed-size chunks that are written column by column as they fill up. The file is
+#		grown 'preallocChunks' chunks at a time, the frame count in the header is updated
+#		with every chunk and the file is fsync'ed at most every 'fsyncInterval' seconds.
+#
+#		With compression set, each chunk is compressed (EncodeChunk) and appended as a
+#		record; the file is not preallocated. With background=True the chunks are
+#		compressed and written by a worker thread, so write() only copies the frames and
+#		queues full chunks (at most queueChunks; write() waits when the worker falls that
+#		far behind). An error of the worker is raised by the next write(), flush() or close().
+#	Input Arguments:
+#		path: file to create (overwritten)
+#		nChannel: DEVICE_INFO.nNumberOfChannel
+#		sampleRate: sampling rate in Hz
+#		channelNames: names of the nChannel+6 columns (default: ChannelNames(nChannel))
+#		chunkFrames: frames per chunk
+#		fsyncInterval: seconds between fsyncs (None: only on close)
+#		preallocChunks: number of chunks the file is grown by when it is full
+#		deviceName: stored in the metadata
+#		compression: codec of CODECS ('zlib', 'lz4' when installed), None to store the samples as they are
+#		compressionFilter: filter of EncodeChunk ('xor', 'delta' or None)
+#		compressionLevel: level of the codec
+#		background: compress on a worker thread
+#		queueChunks: chunks queued for the worker at most
+class ABMRecorder(object):
+	def __init__(self,path,nChannel,sampleRate=256,channelNames=None,chunkFrames=1024,
+				 fsyncInterval=5.0,preallocChunks=64,deviceName='',compression=None,compressionFilter='xor',
+				 compressionLevel=1,background=True,queueChunks=64):
+		if channelNames is None:
+			channelNames = ChannelNames(nChannel)
+		self.nCol = nChannel + NUM_HEADER_COLUMNS
+		if len(channelNames) != self.nCol:
+			raise ValueError('Expected %d column names, got %d' % (self.nCol,len(channelNames)))
+		self.path = path
+		self.nChannel = nChannel
+		self.sampleRate = float(sampleRate)
+		self.chunkFrames = chunkFrames
+		self.chunkBytes = chunkFrames * 4 * (self.nCol + 1)
+		self.fsyncInterval = fsyncInterval
+		self.preallocChunks = max(1,preallocChunks)
+		if isinstance(deviceName,bytes):		# DEVICE_INFO.chDeviceName
+			deviceName = deviceName.decode('ascii','replace')
+		self.recordingId = _NewRecordingId()
+		self.meta = dict(channelNames=list(channelNames),deviceName=deviceName,recordingId=self.recordingId)
+		self.compression = compression
+		if compression is not None:
+			if compression not in CODECS:
+				raise ValueError('Unknown codec %s (available: %s)' % (compression,', '.join(sorted(CODECS))))
+			if compressionFilter not in FILTERS:
+				raise ValueError('Unknown filter %s' % compressionFilter)
+			self.meta['compression'] = dict(codec=compression,filter=compressionFilter)
+		self.compressionFilter = compressionFilter
+		self.compressionLevel = compressionLevel
+		self.error = None			# exception of the compression worker, if any
+		self.nFrames = 0			# frames written (including the pending partial chunk)
+		self.bytesWritten = 0
+		self._chunk = np.zeros((self.nCol,chunkFrames),dtype=np.float32)
+		self._chunkTS = np.zeros(chunkFrames,dtype=np.uint32)
+		self._fill = 0				# frames in the pending chunk
+		self._nChunks = 0			# complete chunks in the file
+		self._allocated = 0			# chunks the file has been sized for
+		self._lastSync = time.time()
+		self._offset = HEADER_SIZE	# compressed: where the record of the pending chunk goes
+		self._end = HEADER_SIZE		# compressed: end of the records written
+		for suffix in SIDECARS:
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+		self.f = open(path,'w+b')
+		self.f.write(self._Header())
+		self.closed = False
+		self._queue = None
+		self._worker = None
+		if compression is not None and background:
+			self._queue = Queue(max(1,queueChunks))
+			self._worker = threading.Thread(target=self._Run,name='ABMRecorder')
+			self._worker.daemon = True
+			self._worker.start()
+
+	def _Header(self):
+		flags = FLAG_COMPRESSED if self.compression is not None else 0
+		return _PackHeader(self.nCol,self.nChannel,self.chunkFrames,self.sampleRate,self.nFrames,self.meta,flags)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+	## write(frames,timestamps)
+	#	Appends (n, nChannel+6) frames and their n uint32 timestamps
+	def write(self,frames,timestamps):
+		self._CheckError()
+		frames = np.asarray(frames)
+		n = len(frames)
+		if len(timestamps) != n:
+			raise ValueError('Got %d frames but %d timestamps' % (n,len(timestamps)))
+		if frames.ndim != 2 or frames.shape[1] != self.nCol:
+			raise ValueError('Frames must have %d columns' % self.nCol)
+		i = 0
+		while i < n:
+			k = min(n - i,self.chunkFrames - self._fill)
+			self._chunk[:,self._fill:self._fill+k] = frames[i:i+k].T
+			self._chunkTS[self._fill:self._fill+k] = timestamps[i:i+k]
+			self._fill += k
+			self.nFrames += k
+			i += k
+			if self._fill == self.chunkFrames:
+				if self.compression is None:
+					self._WriteChunk()
+				else:
+					self._Compress(True,False)
+				self._nChunks += 1
+				self._fill = 0
+				if self.compression is None:
+					self._WriteFrameCount()
+		if self.fsyncInterval is not None and time.time() - self._lastSync >= self.fsyncInterval:
+			if self._worker is not None:
+				# the worker writes the partial chunk and syncs, write() does not wait for it
+				self._Compress(False,True)
+				self._lastSync = time.time()
+			else:
+				self.sync()
+
+	def _WriteChunk(self):
+		if self._nChunks >= self._allocated:
+			self._allocated = self._nChunks + self.preallocChunks
+			self.f.truncate(HEADER_SIZE + self._allocated * self.chunkBytes)
+		self.f.seek(HEADER_SIZE + self._nChunks * self.chunkBytes)
+		self._chunkTS.tofile(self.f)
+		self._chunk.tofile(self.f)
+		self.bytesWritten += self.chunkBytes
+
+	def _WriteFrameCount(self,nFrames=None):
+		self.f.seek(NFRAMES_OFFSET)
+		self.f.write(struct.pack('<Q',self.nFrames if nFrames is None else nFrames))
+
+	# compresses the pending chunk (complete or partial) on the worker, or here without one
+	def _Compress(self,complete,fsync):
+		n = self._fill
+		job = (self._chunk[:,:n],self._chunkTS[:n],complete,self.nFrames,fsync)
+		if self._worker is None:
+			self._WriteRecord(*job)
+		else:
+			self._queue.put((self._chunk[:,:n].copy(),self._chunkTS[:n].copy(),complete,self.nFrames,fsync))
+
+	# writes a chunk as a record at _offset, then the frame count; the record of a partial
+	# chunk is overwritten by the next one
+	def _WriteRecord(self,samples,timestamps,complete,nFrames,fsync):
+		n = len(timestamps)
+		if n:
+			(tsBlock,samplesBlock) = EncodeChunk(samples,timestamps,self.compressionFilter,self.compression,
+												 self.compressionLevel)
+			head = struct.pack(RECORD_FORMAT,RECORD_MAGIC,n,len(tsBlock),len(samplesBlock),int(timestamps[0]))
+			self.f.seek(self._offset)
+			self.f.write(head)
+			self.f.write(tsBlock)
+			self.f.write(samplesBlock)
+			end = self._offset + RECORD_SIZE + len(tsBlock) + len(samplesBlock)
+			self.bytesWritten += end - self._offset
+			self._end = end
+			if complete:
+				self._offset = end
+		self._WriteFrameCount(nFrames)
+		if fsync:
+			self.f.flush()
+			os.fsync(self.f.fileno())
+
+	def _Run(self):
+		while True:
+			job = self._queue.get()
+			try:
+				if job is None:
+					return
+				if self.error is None:
+					self._WriteRecord(*job)
+			except Exception as e:
+				self.error = e
+			finally:
+				self._queue.task_done()
+
+	def _CheckError(self):
+		if self.error is not None:
+			raise self.error
+
+	## flush()
+	#	Writes the pending partial chunk and the frame count (without fsync); with a
+	#	compression worker, waits until it has written everything queued
+	def flush(self):
+		if self.compression is None:
+			if self._fill:
+				self._WriteChunk()
+			self._WriteFrameCount()
+		else:
+			if self._fill:
+				self._Compress(False,False)
+			if self._worker is not None:
+				self._queue.join()
+			self._CheckError()
+		self.f.flush()
+
+	## sync()
+	#	flush() and fsync the file
+	def sync(self):
+		self.flush()
+		os.fsync(self.f.fileno())
+		self._lastSync = time.time()
+
+	def close(self):
+		if self.closed:
+			return
+		try:
+			self.sync()
+		finally:
+			if self._worker is not None:
+				self._queue.put(None)
+				self._worker.join()
+			if self.compression is None:
+				# drop the preallocated chunks that were never used
+				self.f.truncate(HEADER_SIZE + (self._nChunks + (self._fill > 0)) * self.chunkBytes)
+			else:
+				self.f.truncate(self._end)
+			self.f.close()
+			self.closed = True
+
+#########################################################################
+### Reader
+
+# offset following a record (offset, nFrames, timestamps length, samples length, first timestamp)
+def _RecordEnd(record):
+	return record[0] + RECORD_SIZE + record[2] + record[3]
+
+## ABMRecording
+#	Description:
+#		Memory-maps a recording written by ABMRecorder. Columns and timestamps are read
+#		straight from the mapped chunks; nothing is loaded until it is asked for.
+#		Time windows are located through a sparse index holding the unwrapped timestamp of the
+#		first frame of every chunk. The index is built from one timestamp per chunk on first use,
+#		saved next to the recording (path + '.idx') and extended when the recording grows.
+#
+#		The records of a compressed recording are located from their headers when the file is
+#		opened or refreshed; a chunk is decompressed when its frames are read (the timestamps
+#		and the samples separately) and the last cacheChunks decoded blocks are kept.
+#	Input Arguments:
+#		path: recording file
+#		persistIndex: save the time index next to the recording
+#		cacheChunks: decoded blocks kept for compressed recordings
+class ABMRecording(object):
+	def __init__(self,path,persistIndex=True,cacheChunks=16):
+		self.path = path
+		self.indexPath = path + '.idx'
+		self.persistIndex = persistIndex
+		self.cacheChunks = max(1,cacheChunks)
+		self._map = None
+		self._index = None
+		self._records = []			# compressed: (offset, nFrames, timestamps length, samples length, first timestamp)
+		self._cache = collections.OrderedDict()
+		self.refresh()
+
+	## refresh()
+	#	Re-reads the header and remaps the file, to follow a recording that is still being written
+	def refresh(self):
+		with open(self.path,'rb') as f:
+			header = _ReadHeader(f)
+			size = os.fstat(f.fileno()).st_size
+		self.nCol = header['nCol']
+		self.nChannel = header['nChannel']
+		self.chunkFrames = header['chunkFrames']
+		self.sampleRate = header['sampleRate']
+		self.nFrames = header['nFrames']
+		self.meta = header['meta']
+		self.channelNames = self.meta['channelNames']
+		self.deviceName = self.meta.get('deviceName','')
+		recordingId = self.meta.get('recordingId')
+		if recordingId != getattr(self,'recordingId',recordingId):
+			# another recording was written to the path since the last refresh
+			self._index = None
+			self._records = []
+			self._cache.clear()
+		self.recordingId = recordingId		# None for recordings written before the ids
+		self.compression = self.meta.get('compression') if header['flags'] & FLAG_COMPRESSED else None
+		if self.compression is not None:
+			if self.compression['codec'] not in CODECS:
+				raise IOError('Recording compressed with %s, which is not installed' % self.compression['codec'])
+			self._map = np.memmap(self.path,dtype=np.uint8,mode='r')
+			nChunks = self._Records(size)
+		else:
+			self.chunkDtype = np.dtype([('timestamps','<u4',(self.chunkFrames,)),
+										('samples','<f4',(self.nCol,self.chunkFrames))])
+			nChunks = -(-self.nFrames // self.chunkFrames)
+			nChunks = min(nChunks,(size - HEADER_SIZE) // self.chunkDtype.itemsize)
+			self.nFrames = min(self.nFrames,nChunks * self.chunkFrames)
+			if nChunks > 0:
+				self._map = np.memmap(self.path,dtype=self.chunkDtype,mode='r',offset=HEADER_SIZE,shape=(nChunks,))
+			else:
+				self._map = np.zeros(0,dtype=self.chunkDtype)
+		self.nChunks = nChunks
+		if self._index is not None and len(self._index[0]) > nChunks:
+			self._index = None		# the file was rewritten
+
+	# Finds the records of a compressed recording holding its first nFrames frames, starting after
+	# the complete chunks found by the previous call; sets nFrames to the frames found, returns
+	# the number of records
+	def _Records(self,size):
+		records = self._records
+		while records and records[-1][1] < self.chunkFrames:
+			records.pop()			# a partial chunk is rewritten when it fills up
+		found = len(records) * self.chunkFrames
+		offset = _RecordEnd(records[-1]) if records else HEADER_SIZE
+		if found > self.nFrames or offset > size:
+			(records,found,offset) = ([],0,HEADER_SIZE)		# the file was rewritten
+		self._records = records
+		for key in [key for key in self._cache if key[1] >= len(records)]:
+			del self._cache[key]
+		while found < self.nFrames and offset + RECORD_SIZE <= size:
+			(magic,n,tsLength,samplesLength,first) = struct.unpack_from(RECORD_FORMAT,self._map,offset)
+			if magic != RECORD_MAGIC or offset + RECORD_SIZE + tsLength + samplesLength > size:
+				break
+			records.append((offset,n,tsLength,samplesLength,first))
+			found += n
+			offset = _RecordEnd(records[-1])
+		self._first = np.array([record[4] for record in records],dtype=np.uint32)
+		self.nFrames = min(self.nFrames,found)
+		return len(records)
+
+	# decoded block of a compressed chunk c ('timestamps' or 'samples'), through the cache
+	def _Decoded(self,block,c):
+		key = (block,c)
+		value = self._cache.pop(key,None)
+		if value is None:
+			(offset,n,tsLength,samplesLength,first) = self._records[c]
+			start = offset + RECORD_SIZE
+			if block == 'timestamps':
+				value = DecodeTimestamps(self._map[start:start+tsLength].tobytes(),n,self.compression['codec'])
+			else:
+				start += tsLength
+				value = DecodeSamples(self._map[start:start+samplesLength].tobytes(),self.nCol,n,
+									  self.compression['filter'],self.compression['codec'])
+			value.setflags(write=False)
+			if len(self._cache) >= self.cacheChunks:
+				self._cache.popitem(last=False)
+		self._cache[key] = value
+		return value
+
+	# timestamps (columns None) or (len(columns), n) samples of frames [start, stop) of a compressed recording
+	def _Decompress(self,start,stop,columns=None):
+		(c0,c1,offset) = self._Chunks(start,stop)
+		parts = []
+		for c in range(c0,c1):
+			(lo,hi) = (offset if c == c0 else 0,min(self.chunkFrames,stop - c * self.chunkFrames))
+			if columns is None:
+				parts.append(self._Decoded('timestamps',c)[lo:hi])
+			else:
+				parts.append(self._Decoded('samples',c)[columns,lo:hi])
+		if columns is None:
+			return np.concatenate(parts) if parts else np.zeros(0,dtype=np.uint32)
+		return np.concatenate(parts,axis=1) if parts else np.zeros((len(columns),0),dtype=np.float32)
+
+	# first timestamp of the chunks 'chunks' (index array or slice)
+	def _FirstTimestamps(self,chunks):
+		if self.compression is not None:
+			return self._first[chunks]
+		return self._map['timestamps'][chunks,0]
+
+	def __len__(self):
+		return self.nFrames
+
+	def close(self):
+		self._map = None
+		self._index = None
+		self._records = []
+		self._cache.clear()
+
+	## ColumnIndex(column) - index of a column given by name or index
+	def ColumnIndex(self,column):
+		if isinstance(column,int) or isinstance(column,np.integer):
+			if not -self.nCol <= column < self.nCol:
+				raise IndexError('Column %d out of range' % column)
+			return int(column) % self.nCol
+		return self.channelNames.index(column)
+
+	# Returns (first chunk, last chunk + 1, start within the first chunk) covering frames [start, stop)
+	def _Chunks(self,start,stop):
+		return (start // self.chunkFrames,-(-stop // self.chunkFrames),start % self.chunkFrames)
+
+	def _Range(self,start,stop):
+		if stop is None or stop > self.nFrames:
+			stop = self.nFrames
+		start = max(0,start)
+		return (start,max(start,stop))
+
+	## timestamps(start=0,stop=None) - uint32 timestamps of frames [start, stop)
+	def timestamps(self,start=0,stop=None):
+		(start,stop) = self._Range(start,stop)
+		if self.compression is not None:
+			return self._Decompress(start,stop)
+		(c0,c1,offset) = self._Chunks(start,stop)
+		return self._map['timestamps'][c0:c1].reshape(-1)[offset:offset+stop-start]
+
+	## column(column,start=0,stop=None) - float32 values of one column for frames [start, stop)
+	def column(self,column,start=0,stop=None):
+		(start,stop) = self._Range(start,stop)
+		col = self.ColumnIndex(column)
+		if self.compression is not None:
+			return self._Decompress(start,stop,[col])[0]
+		(c0,c1,offset) = self._Chunks(start,stop)
+		return self._map['samples'][c0:c1,col,:].reshape(-1)[offset:offset+stop-start]
+
+	## frames(start=0,stop=None,columns=None)
+	#	Returns frames [start, stop) as a (n, len(columns)) float32 array, all columns by default
+	def frames(self,start=0,stop=None,columns=None):
+		(start,stop) = self._Range(start,stop)
+		if columns is None:
+			cols = list(range(self.nCol))
+		else:
+			cols = [self.ColumnIndex(c) for c in columns]
+		if self.compression is not None:
+			return np.ascontiguousarray(self._Decompress(start,stop,cols).T)
+		out = np.empty((stop - start,len(cols)),dtype=np.float32)
+		for (j,col) in enumerate(cols):
+			out[:,j] = self.column(col,start,stop)
+		return out
+
+	## timeIndex()
+	#	Returns the sparse index as (times, frames): int64 unwrapped millisecond timestamp of the
+	#	first frame of each chunk and the position of that frame
+	def timeIndex(self):
+		if self._index is None:
+			self._index = self._LoadIndex()
+		(times,frames) = self._index
+		nChunks = self.nChunks
+		if len(times) < nChunks:		# the recording grew since the index was built
+			unwrapper = TimeStampUnwrapper()
+			if len(times):
+				unwrapper.last = int(times[-1]) & 0xffffffff
+				unwrapper.offset = int(times[-1]) - unwrapper.last
+			first = self._FirstTimestamps(slice(len(times),nChunks))
+			times = np.concatenate([times,unwrapper.unwrap(first)])
+			frames = np.arange(nChunks,dtype=np.int64) * self.chunkFrames
+			self._index = (times,frames)
+			if self.persistIndex:
+				self._SaveIndex()
+		return (times[:nChunks],frames[:nChunks])
+
+	def _LoadIndex(self):
+		empty = (np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64))
+		if not self.persistIndex or not os.path.exists(self.indexPath):
+			return empty
+		try:
+			with open(self.indexPath,'rb') as f:
+				saved = np.load(f)
+				(times,frames,chunkFrames) = (saved['times'],saved['frames'],int(saved['chunkFrames']))
+				recordingId = str(saved['recordingId']) if 'recordingId' in saved.files else ''
+		except (IOError,ValueError,KeyError):
+			return empty
+		# discard an index that does not belong to this recording
+		if recordingId != (self.recordingId or '') or chunkFrames != self.chunkFrames or len(times) > self.nChunks or \
+				(len(times) and (int(times[0]) & 0xffffffff) != int(self._FirstTimestamps(0))):
+			return empty
+		return (times,frames)
+
+	def _SaveIndex(self):
+		(times,frames) = self._index
+		try:
+			with open(self.indexPath,'wb') as f:
+				np.savez(f,times=times,frames=frames,chunkFrames=self.chunkFrames,recordingId=self.recordingId or '')
+		except IOError:
+			pass		# read-only location, the index is simply rebuilt next time
+
+	## unwrappedTimestamps(start=0,stop=None)
+	#	Returns the timestamps of frames [start, stop) as monotonic int64 milliseconds, unwrapped
+	#	from the index entry of the chunk holding 'start'
+	def unwrappedTimestamps(self,start=0,stop=None):
+		(start,stop) = self._Range(start,stop)
+		if start == stop:
+			return np.zeros(0,dtype=np.int64)
+		(times,frames) = self.timeIndex()
+		i = start // self.chunkFrames
+		chunkStart = int(frames[i])
+		ts = self.timestamps(chunkStart,stop)
+		unwrapper = TimeStampUnwrapper()
+		unwrapper.last = int(ts[0])
+		unwrapper.offset = int(times[i]) - int(ts[0])
+		return unwrapper.unwrap(ts)[start-chunkStart:]
+
+	## unwrappedTimestampsAt(positions)
+	#	Returns the unwrapped int64 timestamps of the frames at the given positions, each one
+	#	taken relative to the index entry of its chunk (reads one timestamp per position)
+	def unwrappedTimestampsAt(self,positions):
+		positions = np.asarray(positions,dtype=np.int64)
+		if len(positions) == 0:
+			return np.zeros(0,dtype=np.int64)
+		(times,frames) = self.timeIndex()
+		chunks = positions // self.chunkFrames
+		if self.compression is not None:
+			ts = np.empty(len(positions),dtype=np.int64)
+			for c in np.unique(chunks).tolist():
+				selected = chunks == c
+				ts[selected] = self._Decoded('timestamps',c)[positions[selected] % self.chunkFrames]
+		else:
+			ts = self._map['timestamps'][chunks,positions % self.chunkFrames].astype(np.int64)
+		first = self._FirstTimestamps(chunks).astype(np.int64)
+		return times[chunks] + (ts - first + 2**31) % 2**32 - 2**31
+
+	## findTime(t)
+	#	Returns the position of the first frame with an unwrapped timestamp >= t (milliseconds)
+	def findTime(self,t):
+		(times,frames) = self.timeIndex()
+		if len(times) == 0:
+			return 0
+		# only the chunk that can hold t is read
+		i = max(0,np.searchsorted(times,t,'right') - 1)
+		start = int(frames[i])
+		ts = self.unwrappedTimestamps(start,start + self.chunkFrames)
+		return start + int(np.searchsorted(ts,t,'left'))
+
+	## read_window(t0,t1,channels=None)
+	#	Description:
+	#		Returns the frames with unwrapped timestamps in [t0, t1) milliseconds. The window is
+	#		located with binary searches over the sparse index, and only the requested columns
+	#		(names or indices, all columns by default) are read from the file.
+	#	Output Arguments:
+	#		(timestamps, data): int64 unwrapped timestamps and a (n, len(channels)) float32 array
+	def read_window(self,t0,t1,channels=None):
+		start = self.findTime(t0)
+		stop = max(start,self.findTime(t1))
+		return (self.unwrappedTimestamps(start,stop),self.frames(start,stop,channels))
+
+#########################################################################
+### CSV export
+
+## ExportCSV(path,rawPath,tsPath=None,chunkFrames=65536)
+#	Description:
+#		Writes a recording in the text format of testPyX24.py: a comma separated line per
+#		frame with the column names as header, and optionally the timestamps file with
+#		'Hexidecimal, Milliseconds' lines.
+def ExportCSV(path,rawPath,tsPath=None,chunkFrames=65536):
+	rec = ABMRecording(path)
+	with open(rawPath,'w') as fpRAW:
+		fpRAW.write(', '.join(rec.channelNames) + '\n')
+		for start in range(0,len(rec),chunkFrames):
+			np.savetxt(fpRAW,rec.frames(start,start+chunkFrames),fmt='%.7g',delimiter=', ')
+	if tsPath is not None:
+		with open(tsPath,'w') as fpTS:
+			fpTS.write('Hexidecimal, Milliseconds\n')
+			for start in range(0,len(rec),chunkFrames):
+				ts = rec.timestamps(start,start+chunkFrames)
+				fpTS.writelines('%02x.%02x.%02x.%02x., %d\n' % (t >> 24,(t >> 16) & 0xff,(t >> 8) & 0xff,t & 0xff,t) for t in ts.tolist())
+	rec.close()
@@ -0,0 +1,372 @@
+#########################################################################
+#	PyABMServer.py
+#	Streaming of the acquired frames to other processes or machines over
+#	TCP or Unix domain sockets, and optionally as a Lab Streaming Layer
+#	(LSL) outlet
+#
+#	Wire format (little-endian), a sequence of messages:
+#		Message header
+#			magic 'ABMS'	- 4 bytes
+#			version			- 1 byte
+#			message type	- 1 byte (MSG_METADATA, MSG_FRAMES)
+#			reserved		- 2 bytes
+#			payload length	- 4 bytes
+#		MSG_METADATA payload: JSON (see StreamMetadata), sent once on connection
+#		MSG_FRAMES payload:
+#			first sample	- 8 bytes, number of the first frame counted from the first batch sent
+#			send time		- 8 bytes, double, time.time() of the publisher when the batch was queued
+#			nFrames, nCol	- 4 bytes each
+#			timestamps		- uint32[nFrames]
+#			frames			- float32[nFrames][nCol] (6 header values then the channels, as GetRawData)
+#
+#	Usage:
+#		info = ABMengine.GetDeviceInfo()
+#		publisher = FramePublisher(('0.0.0.0',5555),StreamMetadata(info))
+#		loop:
+#			(frames,timestamps) = streamer.read(timeout=0.1)
+#			publisher.send(frames,timestamps)
+#
+#		subscriber = FrameSubscriber(('acquisition-host',5555))
+#		for batch in subscriber:
+#			print batch.frames.shape
+#########################################################################
+
+from collections import deque, namedtuple
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+try:
+	import pylsl		# only needed for LSLPublisher
+except ImportError:
+	pylsl = None
+
+from PyABM import ChannelNames, NUM_HEADER_COLUMNS, TimeStampUnwrapper
+from PyABMMulti import ClockOffsetEstimator
+from PyABMPipeline import PipelineStage
+
+MSG_MAGIC = b'ABMS'
+PROTOCOL_VERSION = 1
+MSG_METADATA = 1
+MSG_FRAMES = 2
+MSG_HEADER = struct.Struct('<4sBBHI')		# magic, version, type, reserved, payload length
+BATCH_HEADER = struct.Struct('<QdII')		# first sample, send time, nFrames, nCol
+
+#########################################################################
+### Messages
+
+## StreamMetadata(info,sampleRate=256,stream='raw')
+#	Returns the metadata sent to the subscribers, from the DEVICE_INFO of GetDeviceInfo
+#	stream: which getter the frames come from ('raw', 'filtered', 'decon')
+def StreamMetadata(info,sampleRate=256,stream='raw'):
+	deviceName = info.chDeviceName
+	if isinstance(deviceName,bytes):
+		deviceName = deviceName.decode('ascii','replace')
+	nChannel = info.nNumberOfChannel
+	return {'deviceName': deviceName,
+			'nChannel': nChannel,
+			'nCol': nChannel + NUM_HEADER_COLUMNS,
+			'channelNames': ChannelNames(nChannel),
+			'sampleRate': sampleRate,
+			'stream': stream,
+			'commPort': info.nCommPort,
+			'ecgPos': info.nECGPos,
+			'esuType': info.nESUType,
+			'timestampType': info.nTymestampType}
+
+def EncodeMetadata(metadata):
+	payload = json.dumps(metadata).encode('utf-8')
+	return MSG_HEADER.pack(MSG_MAGIC,PROTOCOL_VERSION,MSG_METADATA,0,len(payload)) + payload
+
+## EncodeBatch(firstSample,frames,timestamps,sendTime=None)
+#	Returns the MSG_FRAMES message of a batch of frames
+def EncodeBatch(firstSample,frames,timestamps,sendTime=None):
+	frames = np.ascontiguousarray(frames,dtype='<f4')
+	timestamps = np.ascontiguousarray(timestamps).astype('<u4')
+	(nFrames,nCol) = frames.shape
+	if sendTime is None:
+		sendTime = time.time()
+	length = BATCH_HEADER.size + timestamps.nbytes + frames.nbytes
+	return b''.join([MSG_HEADER.pack(MSG_MAGIC,PROTOCOL_VERSION,MSG_FRAMES,0,length),
+					 BATCH_HEADER.pack(firstSample,sendTime,nFrames,nCol),
+					 timestamps.tobytes(),frames.tobytes()])
+
+## FrameBatch
+#	Batch received by FrameSubscriber
+#		first: number of the first frame (gaps mean batches were dropped for this subscriber)
+#		sendTime: time.time() of the publisher when the batch was queued
+#		timestamps: uint32 timestamps
+#		frames: (nFrames, nCol) float32 frames
+FrameBatch = namedtuple('FrameBatch',['first','sendTime','timestamps','frames'])
+
+# addresses: (host, port) for TCP, a path for a Unix domain socket
+def _Socket(address):
+	if isinstance(address,tuple):
+		return socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+	return socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+
+def _NoDelay(sock):
+	if sock.family == socket.AF_INET:
+		sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+
+#########################################################################
+### Publisher
+
+# connection of one subscriber: bounded queue of encoded messages emptied by a sender thread
+class _Subscriber(object):
+	def __init__(self,conn,address,maxQueue):
+		self.conn = conn
+		self.address = address
+		self.maxQueue = maxQueue
+		self.queue = deque()
+		self.sent = 0				# batches sent
+		self.dropped = 0			# batches dropped because the subscriber fell behind
+		self.closed = False
+		self._cond = threading.Condition()
+		self._thread = threading.Thread(target=self._Run,name='FramePublisher-send')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def put(self,message):
+		with self._cond:
+			if len(self.queue) >= self.maxQueue:
+				self.queue.popleft()
+				self.dropped += 1
+			self.queue.append(message)
+			self._cond.notify()
+
+	def _Run(self):
+		try:
+			while True:
+				with self._cond:
+					while not self.queue and not self.closed:
+						self._cond.wait()
+					if self.closed:
+						break
+					message = self.queue.popleft()
+				self.conn.sendall(message)
+				self.sent += 1
+		except socket.error:
+			pass
+		self.close()
+
+	def close(self):
+		with self._cond:
+			self.closed = True
+			self._cond.notify()
+		try:
+			self.conn.close()
+		except socket.error:
+			pass
+
+## FramePublisher
+#	Description:
+#		Pipeline stage serving the frames it is given to every connected subscriber. Each batch
+#		is encoded once; every subscriber has its own queue of at most maxQueue batches and its
+#		own sender thread, so a slow or stalled client only loses its own oldest batches
+#		(counted in its 'dropped') and never delays the acquisition loop or the other clients.
+#		New subscribers get the metadata first, then the batches sent from then on.
+#	Input Arguments:
+#		address: (host, port) to listen on with TCP (port 0: any free port), or a path for a
+#			Unix domain socket
+#		metadata: dict sent to the subscribers on connection (see StreamMetadata)
+#		maxQueue: batches queued per subscriber
+class FramePublisher(PipelineStage):
+	def __init__(self,address,metadata,maxQueue=64):
+		PipelineStage.__init__(self)
+		self.metadata = metadata
+		self.maxQueue = maxQueue
+		self.subscribers = []
+		self.batches = 0			# batches sent
+		self.samples = 0			# frames sent
+		self._metaMessage = EncodeMetadata(metadata)
+		self._lock = threading.Lock()
+		self._listener = _Socket(address)
+		if isinstance(address,tuple):
+			self._listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		elif os.path.exists(address):
+			os.remove(address)		# socket left by a previous server
+		self._listener.bind(address)
+		self._listener.listen(16)
+		self.address = self._listener.getsockname()
+		self._closed = False
+		self._thread = threading.Thread(target=self._Accept,name='FramePublisher-accept')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _Accept(self):
+		while not self._closed:
+			try:
+				(conn,address) = self._listener.accept()
+				_NoDelay(conn)
+				conn.sendall(self._metaMessage)
+			except socket.error:
+				if self._closed:
+					break
+				continue
+			with self._lock:
+				self.subscribers.append(_Subscriber(conn,address,self.maxQueue))
+
+	## send(frames,timestamps) - queues a batch for every subscriber
+	def send(self,frames,timestamps):
+		n = len(frames)
+		if n == 0:
+			return
+		message = EncodeBatch(self.samples,frames,timestamps)
+		self.samples += n
+		self.batches += 1
+		with self._lock:
+			if any(s.closed for s in self.subscribers):
+				self.subscribers = [s for s in self.subscribers if not s.closed]
+			subscribers = list(self.subscribers)
+		for subscriber in subscribers:
+			subscriber.put(message)
+
+	def process(self,frames,timestamps):
+		self.send(frames,timestamps)
+		return (frames,timestamps)
+
+	@property
+	def dropped(self):
+		return sum(s.dropped for s in self.subscribers)
+
+	def close(self):
+		self._closed = True
+		try:
+			self._listener.close()
+		except socket.error:
+			pass
+		with self._lock:
+			for subscriber in self.subscribers:
+				subscriber.close()
+			self.subscribers = []
+		if not isinstance(self.address,tuple) and os.path.exists(self.address):
+			os.remove(self.address)
+
+#########################################################################
+### Subscriber
+
+## FrameSubscriber
+#	Description:
+#		Client of a FramePublisher. The metadata is read on connection; recv() returns the
+#		next FrameBatch (None once the publisher closed the connection) and iterating over
+#		the subscriber returns the batches until then. Batches dropped by the publisher for
+#		this client show up as frames missing between successive batches ('missed').
+#	Input Arguments:
+#		address: (host, port) or socket path of the publisher
+#		timeout: socket timeout in seconds (None: block)
+class FrameSubscriber(object):
+	def __init__(self,address,timeout=None):
+		self.sock = _Socket(address)
+		self.sock.settimeout(timeout)
+		self.sock.connect(address)
+		_NoDelay(self.sock)
+		self._header = bytearray(MSG_HEADER.size)
+		(kind,payload) = self._Message()
+		if kind != MSG_METADATA:
+			raise IOError('Expected the stream metadata first')
+		self.metadata = json.loads(bytes(payload).decode('utf-8'))
+		self.channelNames = self.metadata['channelNames']
+		self.nCol = self.metadata['nCol']
+		self.batches = 0			# batches received
+		self.missed = 0				# frames dropped by the publisher for this subscriber
+		self._next = None
+
+	def __iter__(self):
+		while True:
+			batch = self.recv()
+			if batch is None:
+				return
+			yield batch
+
+	# fills buf from the socket, returns False on end of stream
+	def _RecvInto(self,buf):
+		view = memoryview(buf)
+		while len(view):
+			n = self.sock.recv_into(view)
+			if n == 0:
+				return False
+			view = view[n:]
+		return True
+
+	# returns (message type, payload) or (None, None) on end of stream
+	def _Message(self):
+		if not self._RecvInto(self._header):
+			return (None,None)
+		(magic,version,kind,reserved,length) = MSG_HEADER.unpack(bytes(self._header))
+		if magic != MSG_MAGIC:
+			raise IOError('Not a PyABM frame stream')
+		if version > PROTOCOL_VERSION:
+			raise IOError('Unsupported stream version %d' % version)
+		payload = bytearray(length)
+		if not self._RecvInto(payload):
+			return (None,None)
+		return (kind,payload)
+
+	def recv(self):
+		while True:
+			(kind,payload) = self._Message()
+			if kind is None:
+				return None
+			if kind == MSG_FRAMES:
+				break
+		(first,sendTime,nFrames,nCol) = BATCH_HEADER.unpack_from(payload)
+		offset = BATCH_HEADER.size
+		timestamps = np.frombuffer(payload,dtype='<u4',count=nFrames,offset=offset)
+		frames = np.frombuffer(payload,dtype='<f4',count=nFrames*nCol,offset=offset+4*nFrames).reshape(nFrames,nCol)
+		if self._next is not None and first > self._next:
+			self.missed += first - self._next
+		self._next = first + nFrames
+		self.batches += 1
+		return FrameBatch(first,sendTime,timestamps,frames)
+
+	def close(self):
+		self.sock.close()
+
+#########################################################################
+### Lab Streaming Layer
+
+## LSLPublisher
+#	Description:
+#		Pipeline stage pushing the channel values of the frames (without the 6 header values)
+#		to an LSL outlet of type EEG, with the channel labels of the metadata. Needs pylsl.
+#		Each sample is stamped with its device timestamp mapped to pylsl.local_clock(), through
+#		the minimum offset between the two clocks over the last 'clockWindow' batches.
+#		Timestamps given as uint32 (as returned by the SDK) are unwrapped, int64 timestamps are
+#		taken as already unwrapped.
+#	Input Arguments:
+#		metadata: see StreamMetadata
+#		name: stream name (default: the device name)
+#		sourceId: LSL source id, lets LSL clients reconnect to the same stream
+#		clockWindow: number of batches the clock offset is estimated over
+class LSLPublisher(PipelineStage):
+	def __init__(self,metadata,name=None,sourceId='',clockWindow=256):
+		PipelineStage.__init__(self)
+		if pylsl is None:
+			raise ImportError('pylsl is required for LSLPublisher')
+		info = pylsl.StreamInfo(name or metadata['deviceName'],'EEG',metadata['nChannel'],
+								metadata['sampleRate'],'float32',sourceId)
+		channels = info.desc().append_child('channels')
+		for label in metadata['channelNames'][NUM_HEADER_COLUMNS:]:
+			channel = channels.append_child('channel')
+			channel.append_child_value('label',label)
+			channel.append_child_value('unit','microvolts')
+			channel.append_child_value('type','EEG')
+		self.outlet = pylsl.StreamOutlet(info)
+		self.clock = ClockOffsetEstimator(clockWindow)
+		self._unwrapper = TimeStampUnwrapper()
+
+	def process(self,frames,timestamps):
+		if len(frames):
+			deviceTime = np.asarray(timestamps)
+			if deviceTime.dtype != np.int64:
+				deviceTime = self._unwrapper.unwrap(deviceTime)
+			offset = self.clock.update(pylsl.local_clock(),deviceTime[-1])
+			stamps = (deviceTime + offset) / 1000.0
+			self.outlet.push_chunk(np.ascontiguousarray(frames[:,NUM_HEADER_COLUMNS:],dtype=np.float32),stamps)
+		return (frames,timestamps)
@@ -0,0 +1,703 @@
+#########################################################################
+#	PyABMSim.py
+#	Pure python stand-ins for the ABM SDK (ABM_Athena.dll) so that PyABM.py
+#	can be used on machines without the DLLs or a headset (e.g. Linux).
+#
+#	The stand-ins expose the same functions as windll.ABM_Athena, accept the
+#	restype/argtypes assignments done by ABMHandler and hand back ctypes
+#	pointers into buffers they own, just like the SDK does.
+#
+#	FakeABMDLL is the minimal stand-in (fixed number of samples per call);
+#	SimABMDLL simulates the SDK's session states and buffering with synthetic
+#	or replayed signals, for load tests and for reproducing field sessions.
+#
+#	Usage:
+#		from PyABM import *
+#		from PyABMSim import FakeABMDLL, SimLoader
+#		ABMengine = ABMHandler(FakeABMDLL(nChannel=24,nCountPerCall=128))
+#		ABMengine = ABMHandler(loader=SimLoader(speed=10,replay='session.abr'))
+#
+#	BuildStubLibrary() compiles a C stub exporting the same functions, to be
+#	loaded with ABMHandler(loader=CDLLLoader(path)) where real ctypes calls matter.
+#########################################################################
+
+from ctypes import *
+import os
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+from PyABM import (ABM_SESSION_BSTATE, ABM_SESSION_DECON, ABM_SESSION_WORKLOAD, ACQ_PAUSED_OK, ACQ_RESUMED_OK,
+				   ACQ_STARTED_OK, ACQ_STOPPED_OK, DEVICE_INFO, ID_WRONG_SEQUENCY_OF_COMMAND, INIT_SESSION_NO,
+				   INIT_SESSION_OK, NUM_HEADER_COLUMNS, PSD_BINS, SDK_NORMAL_MODE, SDK_WAITING_MODE, TIMESTAMP_CLASS,
+				   TIMESTAMP_DECON, TIMESTAMP_EKG, TIMESTAMP_PSD, TIMESTAMP_RAW, X24_CHANNELS, ClassColumns)
+from PyABMESU import EncodeESUPackets
+
+##########################################################################
+### Helpers
+
+# Callable standing in for a DLL function; restype/argtypes are accepted and ignored.
+# latency: seconds each call blocks (releasing the GIL like a ctypes call) before returning
+class FakeFunction(object):
+	def __init__(self,func,latency=0.0):
+		self.func = func
+		self.latency = latency
+		self.restype = c_int
+		self.argtypes = None
+
+	def __call__(self,*args):
+		if self.latency:
+			time.sleep(self.latency)
+		return self.func(*args)
+
+# Returns the ctypes object behind an output argument passed with byref() or pointer()
+def _OutArg(arg):
+	if hasattr(arg,'_obj'):		# byref(x)
+		return arg._obj
+	if hasattr(arg,'contents'):	# pointer(x)
+		return arg.contents
+	return arg
+
+# Fills the 6 header columns of frames for the absolute sample indices idx
+def _FillHeader(frames,idx,sampleRate):
+	msec = idx * 1000 // sampleRate
+	frames[:,0] = idx // sampleRate				# Epoch
+	frames[:,1] = idx % sampleRate				# Offset
+	frames[:,2] = (msec // 3600000) % 24		# Hour
+	frames[:,3] = (msec // 60000) % 60			# Min
+	frames[:,4] = (msec // 1000) % 60			# Sec
+	frames[:,5] = msec % 1000					# mSec
+
+# Brain State probabilities and workload indices of the epochs e: slow oscillations of the
+# class scores (softmax) and of the two workload indices, nValues columns of ClassColumns
+def _ClassValues(e,nValues):
+	t = np.asarray(e,dtype=np.float64)[:,None]
+	scores = 2.0 * np.sin(2 * np.pi * t / np.array([97.0,61.0,43.0,71.0]) + np.array([0.0,1.0,2.0,3.0]))
+	p = np.exp(scores)
+	values = np.empty((len(t),nValues))
+	values[:,:4] = p / p.sum(axis=1,keepdims=True)
+	if nValues > 4:
+		values[:,4:6] = 0.5 + 0.4 * np.sin(2 * np.pi * t / np.array([120.0,180.0]) + np.array([0.5,1.5]))
+		values[:,6] = values[:,4:6].mean(axis=1)
+	return values
+
+##########################################################################
+### Fake SDK
+
+## FakeABMDLL
+#	Description:
+#		Minimal SDK stand-in. Every call to GetRawData/GetFilteredData/GetDeconData returns
+#		nCountPerCall new samples of a synthetic signal (10 Hz sine + noise per channel) with
+#		the 6 header values filled in, and GetTimeStampsStreamData returns their 4-byte
+#		big-endian millisecond timestamps. GetBrainState and GetPSDData return one epoch per
+#		call (fixed values, the header of the next sample).
+#		With realTime=True the getters instead return the samples that became due at
+#		sampleRate since the previous call, at most maxCount (older samples are dropped).
+#	Input Arguments:
+#		nChannel: number of channels reported by GetDeviceInfo
+#		nCountPerCall: number of samples returned by each data getter call
+#		sampleRate: sampling rate used for the header values and timestamps
+#		realTime: emit samples at sampleRate according to the wall clock
+#		maxCount: largest number of samples kept pending in real time mode (default 10 s)
+#		static: generate the buffers once and hand back the same samples on every call
+#			(keeps the stand-in's own cost out of benchmarks)
+class FakeABMDLL(object):
+	FUNCTIONS = ['GetDeviceInfo', 'SetDestinationFile', 'InitSession', 'StartAcquisition',
+				 'PauseAcquisition', 'ResumeAcquisition', 'StopAcquisition', 'GetRawData',
+				 'GetFilteredData', 'GetDeconData', 'GetTimeStampsStreamData',
+				 'GetCurrentSDKMode', 'GetThirdPartyData', 'GetBrainState', 'GetPSDData']
+
+	def __init__(self,nChannel=24,nCountPerCall=128,sampleRate=256,realTime=False,maxCount=None,
+				 static=False,deviceName='X24 (simulated)'):
+		self.nChannel = nChannel
+		self.nCol = nChannel + NUM_HEADER_COLUMNS
+		self.nCountPerCall = nCountPerCall
+		self.sampleRate = sampleRate
+		self.static = static
+		self.realTime = realTime
+		self.nSample = 0				# samples handed out so far
+		self.nDropped = 0				# samples dropped because they were not fetched in time
+		self.tStart = time.time()
+		if realTime:
+			nCountPerCall = maxCount or 10 * sampleRate
+
+		self.info = DEVICE_INFO()
+		self.info.chDeviceName = deviceName.encode('ascii')
+		self.info.nNumberOfChannel = nChannel
+
+		self._data = (c_float * max(1,nCountPerCall * self.nCol))()
+		self._frames = np.frombuffer(self._data,dtype=np.float32).reshape(-1,self.nCol)
+		self._ts = (c_ubyte * max(1,4 * nCountPerCall))()
+		self._tsView = np.frombuffer(self._ts,dtype='>u4')
+		self._tp = (c_ubyte * 1)()
+		self._class = (c_float * (NUM_HEADER_COLUMNS + len(ClassColumns(ABM_SESSION_WORKLOAD))))()
+		self._classView = np.frombuffer(self._class,dtype=np.float32).reshape(1,-1)
+		self._classView[:,NUM_HEADER_COLUMNS:] = _ClassValues([0],self._classView.shape[1] - NUM_HEADER_COLUMNS)
+		self._psd = (c_float * (NUM_HEADER_COLUMNS + nChannel * PSD_BINS))()
+		self._psdView = np.frombuffer(self._psd,dtype=np.float32).reshape(1,-1)
+		self._psdView[:,NUM_HEADER_COLUMNS:] = 100.0 / np.tile(np.arange(1,PSD_BINS + 1),nChannel)
+		self._rng = np.random.RandomState(0)
+		self._phase = np.linspace(0,np.pi,nChannel,endpoint=False).astype(np.float32)
+
+		for name in self.FUNCTIONS:
+			setattr(self,name,FakeFunction(getattr(self,'_' + name)))
+		if static:
+			self._Generate(nCountPerCall)
+
+	def _GetDeviceInfo(self,*args):
+		return pointer(self.info)
+
+	def _SetDestinationFile(self,path):
+		return 1
+
+	def _InitSession(self,nDeviceType,nSessionType,nSelectedDeviceHandle,bPlayEBS):
+		return 1
+
+	def _PauseAcquisition(self):
+		return 1
+
+	def _ResumeAcquisition(self):
+		return 1
+
+	def _StopAcquisition(self):
+		return 1
+
+	def _GetCurrentSDKMode(self):
+		return 0
+
+	# fill the shared buffers with the next nCountPerCall samples
+	def _Generate(self,nCount):
+		idx = self.nSample + self.nDropped + np.arange(nCount)
+		msec = idx * 1000 // self.sampleRate
+		frames = self._frames[:nCount]
+		_FillHeader(frames,idx,self.sampleRate)
+		t = (idx / float(self.sampleRate)).astype(np.float32)[:,None]
+		frames[:,NUM_HEADER_COLUMNS:] = 20 * np.sin(2 * np.pi * 10 * t + self._phase) \
+			+ self._rng.standard_normal((nCount,self.nChannel)).astype(np.float32)
+		self._tsView[:nCount] = msec
+		self.nSample += nCount
+
+	def _StartAcquisition(self):
+		self.tStart = time.time()
+		self.nSample = 0
+		self.nDropped = 0
+		return 1
+
+	def _GetData(self,nCountRef):
+		nCount = self.nCountPerCall
+		if self.realTime:
+			nCount = int((time.time() - self.tStart) * self.sampleRate) - self.nSample - self.nDropped
+			if nCount > len(self._frames):
+				self.nDropped += nCount - len(self._frames)
+				nCount = len(self._frames)
+		if not self.static:
+			self._Generate(nCount)
+		_OutArg(nCountRef).value = nCount
+		return cast(self._data,POINTER(c_float))
+
+	def _GetRawData(self,nCountRef):
+		return self._GetData(nCountRef)
+
+	def _GetFilteredData(self,nCountRef):
+		return self._GetData(nCountRef)
+
+	def _GetDeconData(self,nCountRef):
+		return self._GetData(nCountRef)
+
+	def _GetTimeStampsStreamData(self,nType):
+		return cast(self._ts,POINTER(c_ubyte))
+
+	def _GetThirdPartyData(self,nBytesRef):
+		_OutArg(nBytesRef).value = 0
+		return cast(self._tp,POINTER(c_ubyte))
+
+	def _GetEpoch(self,data,view,nCountRef):
+		_FillHeader(view,np.array([self.nSample + self.nDropped]),self.sampleRate)
+		_OutArg(nCountRef).value = 1
+		return cast(data,POINTER(c_float))
+
+	def _GetBrainState(self,nCountRef):
+		return self._GetEpoch(self._class,self._classView,nCountRef)
+
+	def _GetPSDData(self,nCountRef):
+		return self._GetEpoch(self._psd,self._psdView,nCountRef)
+
+##########################################################################
+### Simulated SDK
+
+## SyntheticSource
+#	Description:
+#		Multi-channel synthetic EEG for SimABMDLL: per channel, a background of sinusoids with
+#		1/f amplitudes and random phases, an alpha rhythm, line noise and white noise; the EKG
+#		channel gets a pulse train instead. Apart from the white noise the samples are a
+#		function of their index, so any range of samples can be generated in one call.
+#	Input Arguments:
+#		nChannel: number of channels
+#		sampleRate: sampling rate in Hz
+#		ecgPos: index of the EKG channel (None: no EKG channel)
+#		alpha: (frequency in Hz, amplitude in uV) of the alpha rhythm
+#		lineNoise: (frequency in Hz, amplitude in uV) of the mains interference
+#		noise: standard deviation of the white noise in uV
+#		heartRate: beats per minute on the EKG channel
+#		timestampOffset: timestamp of the first sample in ms (e.g. close to 2**32 to test rollovers)
+#		seed: seed of the random phases and noise
+class SyntheticSource(object):
+	def __init__(self,nChannel,sampleRate=256,ecgPos=None,alpha=(10.0,10.0),lineNoise=(60.0,1.0),
+				 noise=2.0,heartRate=66.0,timestampOffset=0,seed=0):
+		self.nChannel = nChannel
+		self.nCol = nChannel + NUM_HEADER_COLUMNS
+		self.sampleRate = sampleRate
+		self.length = None				# endless
+		self.ecgPos = ecgPos
+		self.noise = noise
+		self.heartRate = heartRate
+		self.timestampOffset = timestampOffset
+		self._rng = np.random.RandomState(seed)
+		# one row per component: frequencies (Hz) and per-channel amplitudes and phases
+		background = np.array([1.5,2.5,4.0,6.0,9.0,14.0,20.0,28.0])
+		self._freqs = np.concatenate([background,[alpha[0],lineNoise[0]]])
+		amplitude = np.empty((len(self._freqs),nChannel))
+		amplitude[:len(background)] = (30.0 / background)[:,None] * self._rng.uniform(0.5,1.5,(len(background),nChannel))
+		amplitude[len(background)] = alpha[1] * self._rng.uniform(0.5,1.5,nChannel)
+		amplitude[len(background)+1] = lineNoise[1]
+		self._amplitude = amplitude
+		self._phase = self._rng.uniform(0,2 * np.pi,(len(self._freqs),nChannel))
+
+	## TimeStamp(idx) - timestamps (ms) of the samples at the absolute indices idx
+	def TimeStamp(self,idx):
+		return (self.timestampOffset + np.asarray(idx,dtype=np.int64) * 1000 // self.sampleRate) % 2**32
+
+	## read(start,frames,timestamps)
+	#	Fills frames (n, nCol) and timestamps (n) with the samples from index start
+	def read(self,start,frames,timestamps):
+		n = len(frames)
+		idx = start + np.arange(n,dtype=np.int64)
+		_FillHeader(frames,idx,self.sampleRate)
+		t = idx / float(self.sampleRate)
+		# sin(2 pi f t + phase) for every component and channel as one matrix product
+		arg = 2 * np.pi * np.outer(t,self._freqs)
+		data = np.sin(arg).dot(self._amplitude * np.cos(self._phase)) + np.cos(arg).dot(self._amplitude * np.sin(self._phase))
+		data += self._rng.standard_normal((n,self.nChannel)) * self.noise
+		if self.ecgPos is not None and 0 <= self.ecgPos < self.nChannel:
+			beat = (t * self.heartRate / 60.0) % 1.0
+			data[:,self.ecgPos] = 800.0 * np.exp(-((beat - 0.5) / 0.012) ** 2) + self.noise * self._rng.standard_normal(n)
+		frames[:,NUM_HEADER_COLUMNS:] = data
+		timestamps[:] = self.TimeStamp(idx)
+
+## RecordingSource
+#	Description:
+#		Samples of a recording made with PyABMRecord.ABMRecorder, for replaying a session
+#		through SimABMDLL. With loop=True the recording is repeated endlessly, the timestamps
+#		of each repetition continuing from the end of the previous one.
+#	Input Arguments:
+#		recording: path of the recording or a PyABMRecord.ABMRecording
+#		loop: repeat the recording
+class RecordingSource(object):
+	def __init__(self,recording,loop=False):
+		if not hasattr(recording,'frames'):
+			from PyABMRecord import ABMRecording
+			recording = ABMRecording(recording)
+		if len(recording) == 0:
+			raise ValueError('Cannot replay an empty recording')
+		self.recording = recording
+		self.nChannel = recording.nChannel
+		self.nCol = recording.nCol
+		self.sampleRate = recording.sampleRate
+		self.loop = loop
+		self.size = len(recording)
+		self.length = None if loop else self.size
+		# duration of one repetition in ms, one sample period after the last timestamp
+		ts = recording.unwrappedTimestamps()
+		self.period = int(ts[-1] - ts[0]) + int(round(1000.0 / self.sampleRate))
+
+	def TimeStamp(self,idx):
+		idx = np.asarray(idx,dtype=np.int64)
+		ts = self.recording.timestamps(0,self.size)[idx % self.size].astype(np.int64)
+		return (ts + (idx // self.size) * self.period) % 2**32
+
+	def read(self,start,frames,timestamps):
+		n = len(frames)
+		done = 0
+		while done < n:
+			i = (start + done) % self.size
+			k = min(n - done,self.size - i)
+			frames[done:done+k] = self.recording.frames(i,i+k)
+			ts = self.recording.timestamps(i,i+k).astype(np.int64)
+			timestamps[done:done+k] = (ts + ((start + done) // self.size) * self.period) % 2**32
+			done += k
+
+# Output buffers of one data getter; the pointer returned stays valid until the next call
+class _SimStream(object):
+	def __init__(self,capacity,nCol):
+		self.capacity = capacity
+		self.data = (c_float * (capacity * nCol))()
+		self.pointer = cast(self.data,POINTER(c_float))
+		self.frames = np.frombuffer(self.data,dtype=np.float32).reshape(capacity,nCol)
+		self.ts = (c_ubyte * (4 * capacity))()
+		self.tsPointer = cast(self.ts,POINTER(c_ubyte))
+		self.tsView = np.frombuffer(self.ts,dtype='>u4')
+		self.reset()
+
+	def reset(self):
+		self.pos = 0					# index of the next sample to hand out
+		self.count = 0					# samples returned by the last call
+		self.dropped = 0				# samples lost because the backlog overflowed
+
+## SimABMDLL
+#	Description:
+#		Simulated SDK with the behaviour of the real one, for running the acquisition code,
+#		load tests and replays on machines without the DLLs or a headset.
+#		- Session state: InitSession, Start/Pause/Resume/StopAcquisition must come in the
+#		  order the SDK expects, other calls return ID_WRONG_SEQUENCY_OF_COMMAND; after
+#		  StopAcquisition a new session has to be initialized. GetCurrentSDKMode reports
+#		  SDK_NORMAL_MODE while acquiring and SDK_WAITING_MODE otherwise.
+#		- Buffering: samples become available at sampleRate*speed from StartAcquisition on
+#		  (the clock stops while paused) and are queued separately for GetRawData,
+#		  GetFilteredData and GetDeconData (the latter only in ABM_SESSION_DECON sessions or
+#		  above). Each call returns everything queued since the previous call to the same
+#		  getter, at most backlogSeconds; older samples are dropped and counted. The returned
+#		  pointer and the timestamps of GetTimeStampsStreamData stay valid until the next call
+#		  to the same getter (TIMESTAMP_RAW and TIMESTAMP_EKG follow GetRawData,
+#		  TIMESTAMP_DECON follows GetDeconData).
+#		- Burstiness: the receiver hands samples over in blocks of burstSize, each one late by
+#		  a random delay of up to burstJitter seconds.
+#		- Epochs: GetBrainState (ABM_SESSION_BSTATE sessions or above) and GetPSDData return
+#		  one epoch per second of samples delivered, with the header of its first sample and
+#		  that sample's timestamp on TIMESTAMP_CLASS/TIMESTAMP_PSD. The classification values
+#		  are slow synthetic oscillations, the PSD is the periodogram (Hann window) of the
+#		  epoch's samples of the source. At most backlogSeconds epochs are kept.
+#		- Markers: with eventRate > 0, GetThirdPartyData returns MC-ESU packets (see
+#		  PyABMESU.py) timestamped on the sample clock, types cycling through eventTypes.
+#		- Source: synthetic signals (SyntheticSource) or a replayed recording (replay=path).
+#		  A replay without loop ends after its last sample.
+#		With speed=None the clock is ignored and every data getter call returns the next
+#		nCountPerCall samples, to push samples through as fast as the caller takes them.
+#	Input Arguments:
+#		nChannel: number of channels (taken from the recording when replaying)
+#		sampleRate: sampling rate in Hz (taken from the recording when replaying)
+#		speed: multiple of real time, or None for no pacing
+#		burstSize: samples delivered together
+#		burstJitter: largest delivery delay of a burst, in seconds
+#		backlogSeconds: samples kept for each getter between calls
+#		nCountPerCall: samples per call when speed is None (default sampleRate)
+#		replay: recording (path or PyABMRecord.ABMRecording) to replay instead of synthetic signals
+#		loop: repeat the replayed recording
+#		source: any object with the SyntheticSource interface, overrides replay
+#		eventRate: markers per second on GetThirdPartyData
+#		eventTypes: packet types of the markers
+#		connected: False simulates a missing headset (nNumberOfChannel = -1, InitSession fails)
+#		callLatency: seconds every SDK call blocks, as the DLL does while it talks to the receiver
+#		clock: function returning the time in seconds
+#		deviceName: reported by GetDeviceInfo
+#		Further keyword arguments go to SyntheticSource.
+#	Usage:
+#		sim = SimABMDLL(nChannel=24,speed=10,burstSize=16,eventRate=2)
+#		ABMengine = ABMHandler(sim)		# or ABMHandler(loader=SimLoader(speed=10,...))
+class SimABMDLL(object):
+	FUNCTIONS = FakeABMDLL.FUNCTIONS
+	STATE_IDLE = 'idle'
+	STATE_INITIALIZED = 'initialized'
+	STATE_ACQUIRING = 'acquiring'
+	STATE_PAUSED = 'paused'
+
+	def __init__(self,nChannel=24,sampleRate=256,speed=1.0,burstSize=1,burstJitter=0.0,backlogSeconds=10.0,
+				 nCountPerCall=None,replay=None,loop=False,source=None,eventRate=0.0,eventTypes=(1,),
+				 connected=True,callLatency=0.0,clock=time.time,deviceName='X24 (simulated)',**signal):
+		if source is None:
+			if replay is not None:
+				source = RecordingSource(replay,loop)
+			else:
+				ecgPos = X24_CHANNELS.index('EKG') if nChannel == len(X24_CHANNELS) else None
+				signal.setdefault('ecgPos',ecgPos)
+				source = SyntheticSource(nChannel,sampleRate,**signal)
+		self.source = source
+		self.nChannel = source.nChannel
+		self.nCol = source.nCol
+		self.sampleRate = source.sampleRate
+		self.speed = speed
+		self.burstSize = max(1,int(burstSize))
+		self.burstJitter = burstJitter
+		self.nCountPerCall = nCountPerCall or int(self.sampleRate)
+		self.eventRate = eventRate
+		self.eventTypes = list(eventTypes)
+		self.connected = connected
+		self.clock = clock
+		self.state = self.STATE_IDLE
+		self.sessionType = None
+		self.destinationFile = None
+
+		self.info = DEVICE_INFO()
+		self.info.chDeviceName = deviceName.encode('ascii')
+		self.info.nNumberOfChannel = self.nChannel if connected else -1
+		self.info.nECGPos = getattr(source,'ecgPos',None) or 0
+
+		capacity = max(1,int(backlogSeconds * self.sampleRate))
+		if speed is None:
+			capacity = max(capacity,self.nCountPerCall)
+		self.streams = dict((name,_SimStream(capacity,self.nCol)) for name in ('raw','filtered','decon'))
+		self._epochCapacity = max(1,int(backlogSeconds),self.nCountPerCall // int(self.sampleRate) + 1)
+		self.streams['class'] = _SimStream(self._epochCapacity,NUM_HEADER_COLUMNS + len(ClassColumns(None)))
+		self.streams['psd'] = _SimStream(self._epochCapacity,NUM_HEADER_COLUMNS + self.nChannel * PSD_BINS)
+		self._tsStreams = {TIMESTAMP_RAW: 'raw', TIMESTAMP_EKG: 'raw', TIMESTAMP_DECON: 'decon',
+						   TIMESTAMP_CLASS: 'class', TIMESTAMP_PSD: 'psd'}
+		self._window = np.hanning(int(self.sampleRate) + 1)[:-1]
+		self._noTimeStamps = (c_ubyte * 4)()
+		self._tp = (c_ubyte * 1)()
+		self._jitterRng = np.random.RandomState(1)
+
+		for name in self.FUNCTIONS:
+			setattr(self,name,FakeFunction(getattr(self,'_' + name),callLatency))
+		self._Reset()
+
+	def _Reset(self):
+		for stream in self.streams.values():
+			stream.reset()
+		self._tStart = self.clock()
+		self._tStopped = self._tStart		# time at which the clock stopped (pause)
+		self._tPaused = 0.0					# total time spent paused
+		self._bursts = 0					# bursts delivered
+		self._jitter = self._jitterRng.uniform(0,self.burstJitter)
+		self._events = 0					# markers delivered
+
+	@property
+	def dropped(self):
+		return self.streams['raw'].dropped
+
+	## finished - True once a replay without loop has handed out its last raw sample
+	@property
+	def finished(self):
+		return self.source.length is not None and self.streams['raw'].pos >= self.source.length
+
+	# seconds of simulated acquisition so far
+	def _Elapsed(self):
+		now = self.clock() if self.state == self.STATE_ACQUIRING else self._tStopped
+		return (now - self._tStart - self._tPaused) * self.speed
+
+	# number of samples delivered by the receiver so far
+	def _Due(self):
+		t = self._Elapsed()
+		if self.burstJitter > 0:
+			while (self._bursts + 1) * self.burstSize / float(self.sampleRate) + self._jitter <= t:
+				self._bursts += 1
+				self._jitter = self._jitterRng.uniform(0,self.burstJitter)
+			due = self._bursts * self.burstSize
+		else:
+			due = int(t * self.sampleRate) // self.burstSize * self.burstSize
+		if self.source.length is not None:
+			due = min(due,self.source.length)
+		return due
+
+	def _Fill(self,stream,nCountRef,enabled=True):
+		n = 0
+		if enabled and self.state in (self.STATE_ACQUIRING,self.STATE_PAUSED):
+			if self.speed is None:
+				n = self.nCountPerCall
+				if self.source.length is not None:
+					n = max(0,min(n,self.source.length - stream.pos))
+			else:
+				n = self._Due() - stream.pos
+				if n > stream.capacity:
+					stream.dropped += n - stream.capacity
+					stream.pos += n - stream.capacity
+					n = stream.capacity
+			if n > 0:
+				self.source.read(stream.pos,stream.frames[:n],stream.tsView[:n])
+				stream.pos += n
+		stream.count = n
+		_OutArg(nCountRef).value = n
+		return stream.pointer
+
+	def _GetDeviceInfo(self,*args):
+		return pointer(self.info)
+
+	def _SetDestinationFile(self,path):
+		self.destinationFile = path
+		return 1 if path else 0
+
+	def _InitSession(self,nDeviceType,nSessionType,nSelectedDeviceHandle,bPlayEBS):
+		if self.state in (self.STATE_ACQUIRING,self.STATE_PAUSED):
+			return ID_WRONG_SEQUENCY_OF_COMMAND
+		if not self.connected:
+			return INIT_SESSION_NO
+		self.sessionType = getattr(nSessionType,'value',nSessionType)
+		nCol = NUM_HEADER_COLUMNS + len(ClassColumns(self.sessionType))
+		if self.streams['class'].frames.shape[1] != nCol:
+			self.streams['class'] = _SimStream(self._epochCapacity,nCol)
+		self.state = self.STATE_INITIALIZED
+		return INIT_SESSION_OK
+
+	def _StartAcquisition(self):
+		if self.state != self.STATE_INITIALIZED:
+			return ID_WRONG_SEQUENCY_OF_COMMAND
+		self.state = self.STATE_ACQUIRING
+		self._Reset()
+		return ACQ_STARTED_OK
+
+	def _PauseAcquisition(self):
+		if self.state != self.STATE_ACQUIRING:
+			return ID_WRONG_SEQUENCY_OF_COMMAND
+		self._tStopped = self.clock()
+		self.state = self.STATE_PAUSED
+		return ACQ_PAUSED_OK
+
+	def _ResumeAcquisition(self):
+		if self.state != self.STATE_PAUSED:
+			return ID_WRONG_SEQUENCY_OF_COMMAND
+		self._tPaused += self.clock() - self._tStopped
+		self.state = self.STATE_ACQUIRING
+		return ACQ_RESUMED_OK
+
+	def _StopAcquisition(self):
+		if self.state not in (self.STATE_ACQUIRING,self.STATE_PAUSED):
+			return ID_WRONG_SEQUENCY_OF_COMMAND
+		self.state = self.STATE_IDLE
+		self.sessionType = None
+		return ACQ_STOPPED_OK
+
+	def _GetCurrentSDKMode(self):
+		if self.state in (self.STATE_ACQUIRING,self.STATE_PAUSED):
+			return SDK_NORMAL_MODE
+		return SDK_WAITING_MODE
+
+	def _GetRawData(self,nCountRef):
+		return self._Fill(self.streams['raw'],nCountRef)
+
+	def _GetFilteredData(self,nCountRef):
+		return self._Fill(self.streams['filtered'],nCountRef)
+
+	def _GetDeconData(self,nCountRef):
+		enabled = self.sessionType is not None and self.sessionType >= ABM_SESSION_DECON
+		return self._Fill(self.streams['decon'],nCountRef,enabled)
+
+	# epochs of one second of samples due since the previous call, computed by values(e,frames)
+	def _FillEpochs(self,stream,nCountRef,values,enabled=True):
+		n = 0
+		if enabled and self.state in (self.STATE_ACQUIRING,self.STATE_PAUSED):
+			due = self.streams['raw'].pos if self.speed is None else self._Due()
+			n = due // int(self.sampleRate) - stream.pos
+			if n > stream.capacity:
+				stream.dropped += n - stream.capacity
+				stream.pos += n - stream.capacity
+				n = stream.capacity
+			if n > 0:
+				e = stream.pos + np.arange(n,dtype=np.int64)
+				idx = e * int(self.sampleRate)
+				frames = stream.frames[:n]
+				_FillHeader(frames,idx,self.sampleRate)
+				frames[:,NUM_HEADER_COLUMNS:] = values(e)
+				stream.tsView[:n] = self.source.TimeStamp(idx)
+				stream.pos += n
+		stream.count = n
+		_OutArg(nCountRef).value = n
+		return stream.pointer
+
+	def _GetBrainState(self,nCountRef):
+		enabled = self.sessionType is not None and self.sessionType >= ABM_SESSION_BSTATE
+		nValues = len(ClassColumns(self.sessionType))
+		return self._FillEpochs(self.streams['class'],nCountRef,lambda e: _ClassValues(e,nValues),enabled)
+
+	# periodogram (uV^2/Hz, 1 Hz bins from 1 Hz) of every channel over the epochs e, channel after channel
+	def _EpochPSD(self,e):
+		fs = int(self.sampleRate)
+		frames = np.empty((len(e) * fs,self.nCol),dtype=np.float32)
+		self.source.read(int(e[0]) * fs,frames,np.empty(len(frames),dtype=np.uint32))
+		x = frames[:,NUM_HEADER_COLUMNS:].reshape(len(e),fs,self.nChannel).astype(np.float64)
+		x -= x.mean(axis=1,keepdims=True)
+		spectra = np.fft.rfft(x * self._window[:,None],axis=1)[:,1:PSD_BINS+1]
+		psd = np.zeros((len(e),self.nChannel,PSD_BINS))
+		psd[:,:,:spectra.shape[1]] = ((spectra.real ** 2 + spectra.imag ** 2) * 2.0 / (fs * (self._window ** 2).sum())).transpose(0,2,1)
+		return psd.reshape(len(e),-1)
+
+	def _GetPSDData(self,nCountRef):
+		return self._FillEpochs(self.streams['psd'],nCountRef,self._EpochPSD)
+
+	def _GetTimeStampsStreamData(self,nType):
+		name = self._tsStreams.get(getattr(nType,'value',nType))
+		if name is None:
+			return cast(self._noTimeStamps,POINTER(c_ubyte))
+		return self.streams[name].tsPointer
+
+	def _GetThirdPartyData(self,nBytesRef):
+		data = b''
+		if self.eventRate > 0 and self.state in (self.STATE_ACQUIRING,self.STATE_PAUSED):
+			# markers up to the newest sample delivered (unpaced) or due (paced)
+			if self.speed is None:
+				horizon = self.streams['raw'].pos
+			else:
+				horizon = self._Due()
+			nEvents = int(horizon / float(self.sampleRate) * self.eventRate)
+			if nEvents > self._events:
+				k = np.arange(self._events,nEvents)
+				idx = ((k + 1) * self.sampleRate / float(self.eventRate)).astype(np.int64)
+				types = [self.eventTypes[i % len(self.eventTypes)] for i in k.tolist()]
+				payloads = [bytearray([(i >> 8) & 0xff,i & 0xff]) for i in k.tolist()]
+				data = EncodeESUPackets(self.source.TimeStamp(idx).tolist(),types,payloads,counters=k.tolist())
+				self._events = nEvents
+		if len(data) > len(self._tp):
+			self._tp = (c_ubyte * (2 * len(data)))()
+		memmove(self._tp,data,len(data))
+		_OutArg(nBytesRef).value = len(data)
+		return cast(self._tp,POINTER(c_ubyte))
+
+## SimLoader(**options)
+#	Loader for ABMHandler(loader=SimLoader(...)) creating a SimABMDLL with the given options
+class SimLoader(object):
+	def __init__(self,**options):
+		self.options = options
+	def __call__(self):
+		return SimABMDLL(**self.options)
+
+##########################################################################
+### Shared library stub
+
+# C source of a library exporting the SDK functions used by ABMHandler. The data getters
+# return STUB_COUNT samples of STUB_CHANNELS channels (all zero) on every call, the epoch getters none.
+STUB_COUNT = 128
+STUB_CHANNELS = 24
+STUB_SOURCE = """
+typedef struct {
+	char chDeviceName[256];
+	int nCommPort, nECGPos, nNumberOfChannel, nESUType, nTymestampType, nDeviceHandle;
+	char chDeviceID[260];
+} DEVICE_INFO;
+
+static DEVICE_INFO info = {"X24 (stub)", 0, 0, %(nChannel)d, 0, 0, 0, ""};
+static float data[%(nCount)d * (%(nChannel)d + 6)];
+static unsigned char timeStamps[4 * %(nCount)d];
+static unsigned char thirdParty[1];
+
+DEVICE_INFO *GetDeviceInfo(void *p) { return &info; }
+int SetDestinationFile(char *path) { return 1; }
+int InitSession(int nDeviceType, int nSessionType, int nSelectedDeviceHandle, _Bool bPlayEBS) { return 1; }
+int StartAcquisition(void) { return 1; }
+int PauseAcquisition(void) { return 1; }
+int ResumeAcquisition(void) { return 1; }
+int StopAcquisition(void) { return 1; }
+int GetCurrentSDKMode(void) { return 0; }
+float *GetRawData(int *nCount) { *nCount = %(nCount)d; return data; }
+float *GetFilteredData(int *nCount) { *nCount = %(nCount)d; return data; }
+float *GetDeconData(int *nCount) { *nCount = %(nCount)d; return data; }
+unsigned char *GetTimeStampsStreamData(int nType) { return timeStamps; }
+unsigned char *GetThirdPartyData(int *nBytes) { *nBytes = 0; return thirdParty; }
+float *GetBrainState(int *nCount) { *nCount = 0; return data; }
+float *GetPSDData(int *nCount) { *nCount = 0; return data; }
+"""
+
+## BuildStubLibrary(directory=None,compiler='cc')
+#	Description:
+#		Compiles STUB_SOURCE into a shared library (Linux/macOS, needs a C compiler).
+#	Output Arguments:
+#		path of the library, or None if it could not be built
+def BuildStubLibrary(directory=None,compiler='cc'):
+	if directory is None:
+		directory = tempfile.mkdtemp()
+	source = os.path.join(directory,'ABM_Athena_stub.c')
+	library = os.path.join(directory,'libABM_Athena_stub.so')
+	with open(source,'w') as f:
+		f.write(STUB_SOURCE % dict(nCount=STUB_COUNT,nChannel=STUB_CHANNELS))
+	try:
+		subprocess.check_call([compiler,'-shared','-fPIC','-O2','-o',library,source])
+	except (OSError,subprocess.CalledProcessError):
+		return None
+	return library
@@ -0,0 +1,130 @@
+#########################################################################
+#	PyABMSpectral.py
+#	Streaming power spectral density (Welch) and band powers of the raw or
+#	filtered EEG, computed from the frames of GetRawData/GetFilteredData
+#
+#	Usage:
+#		psd = WelchPSD(nCh)
+#		psd.subscribe(lambda epoch: handle(epoch.bandPower))
+#		loop:
+#			psd.process(frames,timestamps)
+#########################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from PyABM import NUM_HEADER_COLUMNS
+from PyABMPipeline import PipelineStage
+
+# classic EEG bands, (low, high) in Hz, low included and high excluded
+BANDS = [('delta', (1.0, 4.0)),
+		 ('theta', (4.0, 8.0)),
+		 ('alpha', (8.0, 13.0)),
+		 ('beta', (13.0, 30.0)),
+		 ('gamma', (30.0, 45.0))]
+
+## PSDEpoch
+#	Result published by WelchPSD once per epoch
+#		epoch: epoch number (from 0)
+#		timestamp: timestamp of the last sample used
+#		psd: (nFreq, nChannel) power spectral density, averaged over the last segments
+#		bandPower: (nBand, nChannel) power in each band of WelchPSD.bands
+PSDEpoch = namedtuple('PSDEpoch', ['epoch', 'timestamp', 'psd', 'bandPower'])
+
+## WelchPSD
+#	Description:
+#		Pipeline stage keeping the last samples of every channel in a preallocated buffer and
+#		updating a Welch estimate as new segments complete. All the segments completed by a
+#		batch are transformed together, across all channels, with one rfft call; the average
+#		over the last 'averages' periodograms is kept as a running sum. Band powers are one
+#		matrix product of the PSD.
+#	Input Arguments:
+#		nChannel: number of channels (the 6 header columns of the frames are skipped)
+#		sampleRate: sampling rate in Hz
+#		segment: samples per segment (nperseg)
+#		overlap: samples shared by successive segments
+#		averages: number of periodograms averaged
+#		epochSeconds: interval between published results
+#		bands: [(name, (low, high))] band definitions
+#		window: taper applied to each segment (default Hann)
+class WelchPSD(PipelineStage):
+	def __init__(self,nChannel,sampleRate=256,segment=256,overlap=128,averages=8,epochSeconds=1.0,
+				 bands=BANDS,window=None):
+		PipelineStage.__init__(self)
+		if not 0 <= overlap < segment:
+			raise ValueError('overlap must be smaller than the segment')
+		self.nChannel = nChannel
+		self.sampleRate = float(sampleRate)
+		self.segment = segment
+		self.step = segment - overlap
+		self.averages = averages
+		self.epochSegments = max(1,int(round(epochSeconds * sampleRate / self.step)))
+		self.freqs = np.fft.rfftfreq(segment,1.0 / sampleRate)
+		if window is None:
+			window = np.hanning(segment + 1)[:-1]		# periodic Hann
+		self.window = np.asarray(window,dtype=np.float64)
+		# one-sided density scaling
+		self.scale = np.full(len(self.freqs),2.0 / (self.sampleRate * (self.window ** 2).sum()))
+		self.scale[0] /= 2
+		if segment % 2 == 0:
+			self.scale[-1] /= 2
+		self.bands = list(bands)
+		df = self.freqs[1] - self.freqs[0]
+		self.bandMatrix = np.array([((self.freqs >= lo) & (self.freqs < hi)) * df for (name,(lo,hi)) in self.bands])
+
+		# samples not yet consumed by a segment; room for the largest tail plus incoming data
+		self._capacity = 4 * segment
+		self._buf = np.zeros((self._capacity,nChannel),dtype=np.float64)
+		self._ts = np.zeros(self._capacity,dtype=np.int64)
+		self._fill = 0
+		self._periodograms = np.zeros((averages,len(self.freqs),nChannel),dtype=np.float64)
+		self._sum = np.zeros((len(self.freqs),nChannel),dtype=np.float64)
+		self.segments = 0			# segments transformed so far
+		self.epochs = 0				# results published so far
+		self.psd = None				# latest PSD estimate
+		self.bandPower = None		# latest band powers
+
+	def process(self,frames,timestamps):
+		data = frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel]
+		i = 0
+		while i < len(data):
+			k = min(len(data) - i,self._capacity - self._fill)
+			self._buf[self._fill:self._fill+k] = data[i:i+k]
+			self._ts[self._fill:self._fill+k] = timestamps[i:i+k]
+			self._fill += k
+			i += k
+			self._Segments()
+		return (frames,timestamps)
+
+	# transform every complete segment in the buffer and drop the samples no longer needed
+	def _Segments(self):
+		if self._fill < self.segment:
+			return
+		nSeg = (self._fill - self.segment) // self.step + 1
+		(sRow,sCol) = self._buf.strides
+		segs = np.lib.stride_tricks.as_strided(self._buf,shape=(nSeg,self.segment,self.nChannel),
+											   strides=(self.step * sRow,sRow,sCol))
+		segs = segs - segs.mean(axis=1,keepdims=True)
+		spectra = np.fft.rfft(segs * self.window[:,None],axis=1)
+		periodograms = (spectra.real ** 2 + spectra.imag ** 2) * self.scale[:,None]
+		for j in range(nSeg):
+			slot = self.segments % self.averages
+			self._sum += periodograms[j] - self._periodograms[slot]
+			self._periodograms[slot] = periodograms[j]
+			self.segments += 1
+			if slot == self.averages - 1 and self.segments % (64 * self.averages) == 0:
+				self._sum = self._periodograms.sum(axis=0)		# drop the rounding drift
+			if self.segments % self.epochSegments == 0:
+				end = j * self.step + self.segment
+				self._Publish(self._ts[end - 1])
+		used = nSeg * self.step
+		self._buf[:self._fill-used] = self._buf[used:self._fill]
+		self._ts[:self._fill-used] = self._ts[used:self._fill]
+		self._fill -= used
+
+	def _Publish(self,timestamp):
+		self.psd = self._sum / min(self.segments,self.averages)
+		self.bandPower = self.bandMatrix.dot(self.psd)
+		self.publish(PSDEpoch(self.epochs,int(timestamp),self.psd,self.bandPower))
+		self.epochs += 1
@@ -0,0 +1,269 @@
+#########################################################################
+#	PyABMStatus.py
+#	Status layer of the SDK: return codes as named int enumerations,
+#	typed exceptions, tracking of the session state and retries of
+#	InitSession/StartAcquisition
+#
+#	The codes are ints (they compare equal to the values the SDK returns) looked up
+#	in tables built at import. Only the session commands go through this layer; the
+#	data getters of ABMHandler are not touched.
+#
+#	Usage:
+#		session = ABMSession(ABMengine,retry=RetryPolicy(attempts=10))
+#		session.init(3,ABM_SESSION_RAW)		# raises CommandFailed after 10 failed attempts
+#		session.start()
+#		...										# ABMengine.GetRawDataArray() etc. as before
+#		session.stop()
+#		print(ErrorCode.get(101))				# ABM_ERROR_SDK_NO_DATA_ARRIVING
+#########################################################################
+
+import time
+
+from PyABM import (ABM_SESSION_BSTATE, ABM_SESSION_DECON, ABM_SESSION_RAW, ABM_SESSION_WORKLOAD, ERRCODE,
+				   ID_WRONG_SEQUENCY_OF_COMMAND, INIT_SESSION_NO, INIT_SESSION_OK, SDK_IMPEDANCE_MODE,
+				   SDK_NORMAL_MODE, SDK_TECHNICALMON_MODE, SDK_WAITING_MODE)
+
+#########################################################################
+### Codes
+
+## StatusCode
+#	Description:
+#		int with a name. The members of each subclass are created once at import; get(value)
+#		returns the member for a value the SDK returned (a dictionary lookup) or a new
+#		'UNKNOWN' code for a value not in the table.
+class StatusCode(int):
+	_members = {}
+
+	def __new__(cls,value,name):
+		code = int.__new__(cls,value)
+		code.name = name
+		return code
+
+	@classmethod
+	def get(cls,value):
+		member = cls._members.get(value)
+		if member is None:
+			member = cls(value,'UNKNOWN')
+		return member
+
+	@classmethod
+	def members(cls):
+		return sorted(cls._members.values())
+
+	def __repr__(self):
+		return '%s.%s(%d)' % (type(self).__name__,self.name,int(self))
+
+	def __str__(self):
+		return self.name
+
+	def __reduce__(self):
+		return (_Lookup,(type(self),int(self)))
+
+# unpickles a StatusCode as the member of its class
+def _Lookup(cls,value):
+	return cls.get(value)
+
+# creates the members of cls from (name, value) pairs, as class attributes and in cls._members
+def _Members(cls,items):
+	cls._members = {}
+	for (name,value) in items:
+		member = cls(value,name)
+		setattr(cls,name,member)
+		cls._members[value] = member
+
+## ErrorCode - the ABM_ERROR_SDK_* codes of ERRCODE
+class ErrorCode(StatusCode):
+	pass
+
+## CommandResult - return values of InitSession and Start/Pause/Resume/StopAcquisition
+class CommandResult(StatusCode):
+	pass
+
+## SDKMode - return values of GetCurrentSDKMode
+class SDKMode(StatusCode):
+	pass
+
+## SessionType - nSessionType of InitSession
+class SessionType(StatusCode):
+	pass
+
+_Members(ErrorCode,ERRCODE.items())
+_Members(CommandResult,[('OK',INIT_SESSION_OK),('FAILED',INIT_SESSION_NO),
+						('WRONG_SEQUENCE',ID_WRONG_SEQUENCY_OF_COMMAND)])
+_Members(SDKMode,[('WAITING',SDK_WAITING_MODE),('NORMAL',SDK_NORMAL_MODE),('IMPEDANCE',SDK_IMPEDANCE_MODE),
+				  ('TECHNICALMON',SDK_TECHNICALMON_MODE)])
+_Members(SessionType,[('RAW',ABM_SESSION_RAW),('DECON',ABM_SESSION_DECON),('BSTATE',ABM_SESSION_BSTATE),
+					  ('WORKLOAD',ABM_SESSION_WORKLOAD)])
+
+#########################################################################
+### Exceptions
+
+## ABMError
+#	Base class of the SDK errors
+#		code: StatusCode returned by the SDK, or None
+#		command: name of the SDK function
+class ABMError(Exception):
+	def __init__(self,message,code=None,command=None):
+		Exception.__init__(self,message)
+		self.code = code
+		self.command = command
+
+## CommandFailed - a session command returned its _NO value (after all retries)
+class CommandFailed(ABMError):
+	def __init__(self,message,code=None,command=None,attempts=1):
+		ABMError.__init__(self,message,code,command)
+		self.attempts = attempts
+
+## WrongSequence
+#	A session command was given in a state that does not allow it: rejected before
+#	calling the SDK (local=True) or ignored by the SDK (ID_WRONG_SEQUENCY_OF_COMMAND)
+class WrongSequence(ABMError):
+	def __init__(self,message,code=None,command=None,state=None,local=False):
+		ABMError.__init__(self,message,code,command)
+		self.state = state
+		self.local = local
+
+## CheckResult(command,result)
+#	Returns the CommandResult of a session command, raises CommandFailed or WrongSequence
+#	if it did not succeed
+def CheckResult(command,result):
+	if result == INIT_SESSION_OK:
+		return CommandResult.OK
+	code = CommandResult.get(result)
+	if code == ID_WRONG_SEQUENCY_OF_COMMAND:
+		raise WrongSequence('%s was ignored by the SDK (wrong sequence of commands)' % command,code,command)
+	raise CommandFailed('%s failed (%s)' % (command,code.name),code,command)
+
+#########################################################################
+### Session state
+
+SESSION_IDLE = 'idle'						# no session, or stopped
+SESSION_INITIALIZED = 'initialized'
+SESSION_ACQUIRING = 'acquiring'
+SESSION_PAUSED = 'paused'
+
+# command: (states it is accepted in, state after it succeeded)
+SESSION_TRANSITIONS = {'InitSession'		: ((SESSION_IDLE,SESSION_INITIALIZED),SESSION_INITIALIZED),
+					   'StartAcquisition'	: ((SESSION_INITIALIZED,),SESSION_ACQUIRING),
+					   'PauseAcquisition'	: ((SESSION_ACQUIRING,),SESSION_PAUSED),
+					   'ResumeAcquisition'	: ((SESSION_PAUSED,),SESSION_ACQUIRING),
+					   'StopAcquisition'	: ((SESSION_ACQUIRING,SESSION_PAUSED),SESSION_IDLE)}
+
+## SessionLifecycle
+#	Description:
+#		Session state as the SDK sees it (the order of commands of the B-Alert manual: after
+#		StopAcquisition a new session must be initialized). check(command) raises WrongSequence
+#		for a command the SDK would ignore, update(command) records a successful command.
+class SessionLifecycle(object):
+	def __init__(self,state=SESSION_IDLE):
+		self.state = state
+		self.sessionType = None
+
+	def allowed(self,command):
+		return self.state in SESSION_TRANSITIONS[command][0]
+
+	def check(self,command):
+		if self.state not in SESSION_TRANSITIONS[command][0]:
+			raise WrongSequence('%s not allowed while the session is %s' % (command,self.state),
+								CommandResult.WRONG_SEQUENCE,command,self.state,local=True)
+
+	def update(self,command):
+		self.state = SESSION_TRANSITIONS[command][1]
+		if self.state == SESSION_IDLE:
+			self.sessionType = None
+
+## RetryPolicy
+#	Description:
+#		Retries of a command returning _NO: up to 'attempts' calls, waiting delay, then
+#		delay*backoff... (at most maxDelay) seconds between them. WrongSequence is not retried.
+#	Input Arguments:
+#		attempts: calls in total (1 = no retry)
+#		delay: wait after the first failure, in seconds
+#		backoff: factor applied to the wait after each failure
+#		maxDelay: longest wait
+#		sleep: function used to wait
+class RetryPolicy(object):
+	def __init__(self,attempts=10,delay=0.1,backoff=2.0,maxDelay=2.0,sleep=time.sleep):
+		self.attempts = max(1,attempts)
+		self.delay = delay
+		self.backoff = backoff
+		self.maxDelay = maxDelay
+		self.sleep = sleep
+
+	## delays() - the waits between the attempts
+	def delays(self):
+		delay = self.delay
+		for i in range(self.attempts - 1):
+			yield min(delay,self.maxDelay)
+			delay *= self.backoff
+
+	## run(command,func,*args)
+	#	Calls func(*args) until CheckResult succeeds, returns CommandResult.OK; raises the last
+	#	CommandFailed (with the number of attempts) once they are used up
+	def run(self,command,func,*args):
+		delays = self.delays()
+		attempt = 0
+		while True:
+			attempt += 1
+			try:
+				return CheckResult(command,func(*args))
+			except CommandFailed as e:
+				e.attempts = attempt
+				delay = next(delays,None)
+				if delay is None:
+					raise
+				self.sleep(delay)
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+## ABMSession
+#	Description:
+#		Session commands of an ABMHandler with typed errors: a command the session state does
+#		not allow raises WrongSequence without calling the SDK, a failed command raises
+#		CommandFailed (init and start are retried with 'retry' first). The data getters are
+#		called on the ABMHandler directly, as before.
+#	Input Arguments:
+#		ABMengine: ABMHandler
+#		retry: RetryPolicy of init() and start()
+#	Usage:
+#		session = ABMSession(ABMengine)
+#		session.init(3,ABM_SESSION_RAW)
+#		session.start()
+#		session.stop()
+class ABMSession(object):
+	def __init__(self,ABMengine,retry=None):
+		self.engine = ABMengine
+		self.retry = retry if retry is not None else RetryPolicy()
+		self.lifecycle = SessionLifecycle()
+
+	@property
+	def state(self):
+		return self.lifecycle.state
+
+	def _Command(self,command,retry,*args):
+		self.lifecycle.check(command)
+		func = getattr(self.engine,command)
+		result = retry.run(command,func,*args)
+		self.lifecycle.update(command)
+		return result
+
+	def init(self,deviceType=3,sessionType=ABM_SESSION_RAW,deviceHandle=-1,playEBS=False):
+		result = self._Command('InitSession',self.retry,deviceType,sessionType,deviceHandle,playEBS)
+		self.lifecycle.sessionType = SessionType.get(sessionType)
+		return result
+
+	def start(self):
+		return self._Command('StartAcquisition',self.retry)
+
+	def pause(self):
+		return self._Command('PauseAcquisition',NO_RETRY)
+
+	def resume(self):
+		return self._Command('ResumeAcquisition',NO_RETRY)
+
+	def stop(self):
+		return self._Command('StopAcquisition',NO_RETRY)
+
+	## mode() - GetCurrentSDKMode as an SDKMode
+	def mode(self):
+		return SDKMode.get(self.engine.GetCurrentSDKMode())
@@ -0,0 +1,863 @@
+#########################################################################
+#	benchPyABM.py
+#	Benchmarks for the hot paths of the PyABM wrapper. Runs against the
+#	simulated SDK in PyABMSim.py, so no DLLs or headset are needed.
+#
+#	Run this code by typing 'python benchPyABM.py' at the command prompt
+#		python benchPyABM.py --list						# benchmark names
+#		python benchPyABM.py EndToEnd --json out.json	# selected benchmarks, results as JSON
+#########################################################################
+
+from __future__ import print_function
+
+from ctypes import *
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import numpy as np
+
+from PyABM import *
+from PyABMAlign import EventAligner
+from PyABMBatch import ReprocessDirectory
+from PyABMClassification import BrainStateStream, PSDStream
+from PyABMContinuity import ContinuityChecker, SampleIndex
+from PyABMDecimate import DecimationPyramid, RecordingPyramid
+from PyABMESU import EncodeESUPackets, ESUPacketParser
+from PyABMFilters import BandpassSOS, CommonAverageReference, FilterBank, NotchSOS, _SOSFilter
+from PyABMMetrics import InstrumentHandler, InstrumentRecorder, MetricsRegistry
+from PyABMMulti import AcquisitionManager, DeviceConfig
+from PyABMQuality import QualityMonitor
+from PyABMRecord import ABMRecorder, ABMRecording, CODECS, DecodeSamples, DecodeTimestamps, EncodeChunk, FILTERS
+from PyABMServer import FramePublisher, FrameSubscriber, StreamMetadata
+from PyABMSpectral import WelchPSD
+from PyABMStatus import ABMSession, CheckResult, CommandResult, WrongSequence
+from PyABMSim import BuildStubLibrary, FakeABMDLL, SimABMDLL, SimLoader
+from benchPyABMSuite import Benchmark, Record, RunBenchmarks
+
+#########################################################################
+### Per-call overhead of the SDK bindings
+
+# reference implementations: the getters before the SDK functions were bound once
+def UnboundGetRawData(abmDLL):
+	nCount = c_int()
+	getData = abmDLL.GetRawData
+	getData.restype = POINTER(c_float)
+	pData = getData(byref(nCount))
+	return (pData,nCount)
+
+def UnboundGetTimeStampsStreamData(abmDLL,nType):
+	getTime = abmDLL.GetTimeStampsStreamData
+	getTime.restype = POINTER(c_ubyte)
+	return getTime(nType)
+
+def UnboundGetThirdPartyData(abmDLL):
+	nBytes = c_int()
+	getTpy = abmDLL.GetThirdPartyData
+	getTpy.restype = POINTER(c_ubyte)
+	pChar = getTpy(byref(nBytes))
+	return (pChar,nBytes)
+
+def UnboundInitSession(abmDLL,nDeviceType,nSessionType,nSelectedDeviceHandle,PlayEBS):
+	bPlayEBS = c_bool(PlayEBS)
+	InitSess = abmDLL.InitSession
+	InitSess.argtypes = [c_int,c_int,c_int,c_bool]
+	return InitSess(nDeviceType,nSessionType,nSelectedDeviceHandle,bPlayEBS)
+
+@Benchmark
+def BenchCallOverhead(number=100000,repeat=5):
+	libraries = [('fake',lambda: FakeABMDLL(static=True))]
+	tmp = tempfile.mkdtemp()
+	stub = BuildStubLibrary(tmp)
+	if stub is not None:
+		libraries.append(('stub .so',CDLLLoader(stub)))
+	else:
+		print('(no C compiler found, the shared library stub is skipped)')
+	print('SDK call overhead (usec per call)')
+	print('%10s %26s %10s %10s %10s' % ('library','call','unbound','bound','speedup'))
+	for (libName,loader) in libraries:
+		ABMengine = ABMHandler(loader=loader)
+		abmDLL = ABMengine.abmDLL
+		calls = [('GetRawData',lambda: UnboundGetRawData(abmDLL),ABMengine.GetRawData),
+				 ('GetTimeStampsStreamData',lambda: UnboundGetTimeStampsStreamData(abmDLL,0),
+					lambda: ABMengine.GetTimeStampsStreamData(0)),
+				 ('GetThirdPartyData',lambda: UnboundGetThirdPartyData(abmDLL),ABMengine.GetThirdPartyData),
+				 ('InitSession',lambda: UnboundInitSession(abmDLL,3,0,-1,0),
+					lambda: ABMengine.InitSession(3,0,-1,0))]
+		for (name,unbound,bound) in calls:
+			tOld = min(timeit.repeat(unbound,number=number,repeat=repeat)) / number
+			tNew = min(timeit.repeat(bound,number=number,repeat=repeat)) / number
+			print('%10s %26s %10.2f %10.2f %9.1fx' % (libName,name,tOld*1e6,tNew*1e6,tOld/tNew))
+			Record(library=libName,call=name,unboundUsec=tOld*1e6,boundUsec=tNew*1e6)
+		# the unbound calls changed restype/argtypes; rebind before the library is reused
+		ABMBinding(abmDLL)
+	shutil.rmtree(tmp)
+
+#########################################################################
+### Instrumentation overhead
+
+@Benchmark
+def BenchInstrumentation(nCount=13,number=20000,repeat=5):
+	print('Instrumentation overhead, polls of %d samples (usec per poll)' % nCount)
+	print('%14s %12s %12s %12s' % ('instrumentation','getters','recorder','total'))
+	tmp = tempfile.mkdtemp()
+	timeStamps = np.arange(nCount,dtype=np.uint32)
+	for enabled in (False,True):
+		registry = MetricsRegistry(enabled=enabled)
+		ABMengine = ABMHandler(FakeABMDLL(nCountPerCall=nCount,static=True))
+		recorder = ABMRecorder(os.path.join(tmp,'bench.abm'),ABMengine._NumChannels())
+		InstrumentHandler(ABMengine,registry,sampleRate=256)
+		InstrumentRecorder(recorder,registry)
+		def Poll():
+			frames = ABMengine.GetRawDataArray()
+			ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+			return frames
+		frames = Poll()
+		tPoll = min(timeit.repeat(Poll,number=number,repeat=repeat)) / number
+		tWrite = min(timeit.repeat(lambda: recorder.write(frames,timeStamps),number=number,repeat=repeat)) / number
+		recorder.close()
+		print('%14s %12.2f %12.2f %12.2f' % ('on' if enabled else 'off',tPoll*1e6,tWrite*1e6,(tPoll+tWrite)*1e6))
+		Record(enabled=enabled,pollUsec=tPoll*1e6,writeUsec=tWrite*1e6)
+	tText = min(timeit.repeat(registry.prometheus,number=100,repeat=repeat)) / 100
+	print('Prometheus text of %d metrics: %.0f usec' % (len(registry.metrics),tText*1e6))
+	Record(metrics=len(registry.metrics),prometheusUsec=tText*1e6)
+	shutil.rmtree(tmp)
+
+#########################################################################
+### Status layer
+
+def _Rejected(session):
+	try:
+		session.pause()
+	except WrongSequence:
+		pass
+
+@Benchmark
+def BenchStatus(number=100000,repeat=5,callLatency=0.001):
+	print('Status layer (usec per call)')
+	print('%40s %10s' % ('operation','usec'))
+	sim = SimABMDLL(speed=None,callLatency=callLatency)
+	ABMengine = ABMHandler(sim)
+	session = ABMSession(ABMengine)
+	results = [('int comparison',lambda: INIT_SESSION_OK == 1,number),
+			   ('CommandResult.get',lambda: CommandResult.get(-2),number),
+			   ('CheckResult, success',lambda: CheckResult('StartAcquisition',1),number),
+			   ('Pause rejected locally (WrongSequence)',lambda: _Rejected(session),number),
+			   ('Pause ignored by the SDK (%g ms call)' % (callLatency*1e3),ABMengine.PauseAcquisition,100)]
+	for (name,func,n) in results:
+		t = min(timeit.repeat(func,number=n,repeat=repeat)) / n
+		print('%40s %10.2f' % (name,t*1e6))
+		Record(operation=name,usec=t*1e6)
+
+#########################################################################
+### Buffer conversion for GetRawData
+
+# reference implementation: the per-element loop from testPyX24.py
+def PerElementLoop(ABMengine,nCh):
+	RAW = []
+	(rData,nCount) = ABMengine.GetRawData()
+	l = 0
+	for j in range(nCount.value):
+		RAW.append([])
+		for k in range(nCh+6):
+			RAW[j].append(rData[l])
+			l+=1
+	return RAW
+
+@Benchmark
+def BenchRawConversion(nCounts=(16,128,512,2048),nChannel=24,repeat=5):
+	print('GetRawData conversion, %d channels (usec per call)' % nChannel)
+	print('%8s %14s %14s %14s %10s' % ('nCount','loop','array copy','array view','speedup'))
+	for nCount in nCounts:
+		ABMengine = ABMHandler(FakeABMDLL(nChannel=nChannel,nCountPerCall=nCount,static=True))
+		ABMengine.GetDeviceInfo()
+		out = np.empty((nCount,nChannel+NUM_HEADER_COLUMNS),dtype=np.float32)
+		number = max(1,20000 // nCount)
+
+		tLoop = min(timeit.repeat(lambda: PerElementLoop(ABMengine,nChannel),number=max(1,number//20),repeat=repeat)) / max(1,number//20)
+		tCopy = min(timeit.repeat(lambda: ABMengine.GetRawDataArray(out=out),number=number,repeat=repeat)) / number
+		tView = min(timeit.repeat(lambda: ABMengine.GetRawDataArray(copy=False),number=number,repeat=repeat)) / number
+		print('%8d %14.1f %14.1f %14.1f %9.0fx' % (nCount,tLoop*1e6,tCopy*1e6,tView*1e6,tLoop/tCopy))
+		Record(nCount=nCount,loopUsec=tLoop*1e6,copyUsec=tCopy*1e6,viewUsec=tView*1e6)
+
+#########################################################################
+### Epoch getters (Brain State classification, PSD)
+
+# reference implementation: the epoch read one float at a time, as in PerElementLoop
+def PerElementEpochs(getter,nValues):
+	out = []
+	(pData,nCount) = getter()
+	l = 0
+	for j in range(nCount.value):
+		out.append([])
+		for k in range(nValues+6):
+			out[j].append(pData[l])
+			l+=1
+	return out
+
+@Benchmark
+def BenchEpochGetters(nChannel=24,number=2000,repeat=5):
+	print('Epoch getters, one epoch per call, %d channels (usec per epoch)' % nChannel)
+	print('%12s %8s %14s %14s %14s %10s' % ('getter','values','loop','array','published','speedup'))
+	ABMengine = ABMHandler(FakeABMDLL(nChannel=nChannel,static=True))
+	ABMengine.GetDeviceInfo()
+	ABMengine.InitSession(3,ABM_SESSION_WORKLOAD,-1,False)
+	streams = [('BrainState',ABMengine.GetBrainState,len(ClassColumns(ABM_SESSION_WORKLOAD)),BrainStateStream(ABMengine)),
+			   ('PSDData',ABMengine.GetPSDData,nChannel * PSD_BINS,PSDStream(ABMengine))]
+	for (name,getter,nValues,stream) in streams:
+		nLoop = max(1,number * len(BSTATE_COLUMNS) // nValues)
+		tLoop = min(timeit.repeat(lambda: PerElementEpochs(getter,nValues),number=nLoop,repeat=repeat)) / nLoop
+		array = getattr(ABMengine,stream.getter)
+		tArray = min(timeit.repeat(array,number=number,repeat=repeat)) / number
+		tStream = min(timeit.repeat(stream.poll,number=number,repeat=repeat)) / number
+		print('%12s %8d %14.1f %14.1f %14.1f %9.0fx' % (name,nValues,tLoop*1e6,tArray*1e6,tStream*1e6,tLoop/tArray))
+		Record(getter=name,values=nValues,loopUsec=tLoop*1e6,arrayUsec=tArray*1e6,publishedUsec=tStream*1e6)
+
+#########################################################################
+### Timestamp decoding
+
+# reference implementation: the np.append loop from testPyX24.py
+def TimeStampLoop(ABMengine,nCount):
+	TSmult = np.array([pow(2,24),pow(2,16),pow(2,8),pow(2,0)])
+	pTimeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW)
+	out = []
+	l = 0
+	for j in range(nCount):
+		TS = np.array([])
+		for k in range(4):
+			TS = np.append(TS,pTimeStamps[l])
+			l+=1
+		out.append((TS*TSmult).sum())
+	return out
+
+@Benchmark
+def BenchTimeStamps(nCounts=(16,128,512,2048),repeat=5):
+	print('GetTimeStampsStreamData decoding (usec per call)')
+	print('%8s %14s %14s %14s %10s' % ('nCount','loop','decoded','unwrapped','speedup'))
+	for nCount in nCounts:
+		ABMengine = ABMHandler(FakeABMDLL(nCountPerCall=nCount,static=True))
+		number = max(1,20000 // nCount)
+		nLoop = max(1,number // 50)
+		tLoop = min(timeit.repeat(lambda: TimeStampLoop(ABMengine,nCount),number=nLoop,repeat=repeat)) / nLoop
+		tDec = min(timeit.repeat(lambda: ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,nCount),number=number,repeat=repeat)) / number
+		tUnw = min(timeit.repeat(lambda: ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,nCount,unwrap=True),number=number,repeat=repeat)) / number
+		print('%8d %14.1f %14.1f %14.1f %9.0fx' % (nCount,tLoop*1e6,tDec*1e6,tUnw*1e6,tLoop/tDec))
+		Record(nCount=nCount,loopUsec=tLoop*1e6,decodedUsec=tDec*1e6,unwrappedUsec=tUnw*1e6)
+
+#########################################################################
+### Continuity checks
+
+# reference implementation: the samples checked one by one
+class LoopChecker(object):
+	def __init__(self,sampleRate):
+		self.sampleRate = sampleRate
+		self.last = None
+		self.dropped = 0
+		self.late = 0
+
+	def process(self,frames,timestamps):
+		for (epoch,offset) in frames[:,:2].tolist():
+			idx = int(epoch) * self.sampleRate + int(offset)
+			if self.last is not None:
+				if idx <= self.last:
+					self.late += 1
+					continue
+				self.dropped += idx - self.last - 1
+			self.last = idx
+		return (frames,timestamps)
+
+@Benchmark
+def BenchContinuity(seconds=600,sampleRate=256,nChannel=24,pollSizes=(13,128,2048),dropRate=0.001):
+	print('Continuity checks, %d channels at %d Hz, %.1f%% of the samples dropped' % (nChannel,sampleRate,100*dropRate))
+	sim = SimABMDLL(nChannel=nChannel,sampleRate=sampleRate,speed=None,nCountPerCall=int(seconds * sampleRate))
+	ABMengine = ABMHandler(sim)
+	ABMengine.InitSession(3,ABM_SESSION_RAW,-1,False)
+	ABMengine.StartAcquisition()
+	frames = ABMengine.GetRawDataArray()
+	timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+	keep = np.random.RandomState(0).uniform(size=len(frames)) >= dropRate
+	(frames,timeStamps) = (frames[keep],timeStamps[keep])
+	print('%8s %12s %12s %12s %12s %10s' % ('poll','loop ns','check ns','fill ns','x real time','speedup'))
+	for nPoll in pollSizes:
+		times = []
+		for stage in [LoopChecker(sampleRate),ContinuityChecker(sampleRate),ContinuityChecker(sampleRate,fill=True)]:
+			t0 = timeit.default_timer()
+			for i in range(0,len(frames),nPoll):
+				stage.process(frames[i:i+nPoll],timeStamps[i:i+nPoll])
+			times.append((timeit.default_timer() - t0) / len(frames))
+			assert stage.dropped == len(keep) - keep.sum() - np.argmax(keep)
+		print('%8d %12.0f %12.0f %12.0f %12.0f %9.1fx' % (nPoll,times[0]*1e9,times[1]*1e9,times[2]*1e9,
+			1.0/(times[2]*sampleRate),times[0]/times[1]))
+		Record(poll=nPoll,loopNsec=times[0]*1e9,checkNsec=times[1]*1e9,fillNsec=times[2]*1e9)
+	# samples lost by the simulated SDK when the polls come too late for its backlog
+	clock = [0.0]
+	sim = SimABMDLL(nChannel=nChannel,sampleRate=sampleRate,backlogSeconds=1.0,clock=lambda: clock[0])
+	ABMengine = ABMHandler(sim)
+	ABMengine.InitSession(3,ABM_SESSION_RAW,-1,False)
+	ABMengine.StartAcquisition()
+	checker = ContinuityChecker(sampleRate,fill=True)
+	received = 0
+	for delay in np.random.RandomState(1).exponential(0.2,2000).tolist():
+		clock[0] += delay
+		frames = ABMengine.GetRawDataArray()
+		(frames,timeStamps) = checker.process(frames,ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames)))
+		received += len(frames)
+	print('SimABMDLL with a 1 s backlog, polls every 0.2 s on average: %d samples dropped by the SDK, %d detected '
+		  'in %d gaps, %d frames passed on for %d samples' % (sim.dropped,checker.dropped,len(checker.gaps),received,
+		  int(SampleIndex(frames[-1:],sampleRate)[0]) + 1))
+	Record(sdkDropped=sim.dropped,detected=checker.dropped,gaps=len(checker.gaps))
+
+#########################################################################
+### Sample/event alignment
+
+@Benchmark
+def BenchAligner(seconds=600,sampleRate=256,nChannel=24,pollSeconds=0.05,eventRate=4.0):
+	nCol = nChannel + NUM_HEADER_COLUMNS
+	nPoll = int(pollSeconds * sampleRate)
+	nFrames = int(seconds * sampleRate)
+	frames = np.random.RandomState(0).standard_normal((nPoll,nCol)).astype(np.float32)
+	timeStamps = (np.arange(nFrames) * 1000 // sampleRate).astype(np.uint32)
+	eventTimes = (np.arange(int(seconds * eventRate)) * (1000 / eventRate) + 17).astype(np.uint32)
+	aligner = EventAligner(nCol,sampleRate,bufferSeconds=10)
+	nEpochs = 0
+	e = 0
+	t0 = timeit.default_timer()
+	for start in range(0,nFrames - nPoll + 1,nPoll):
+		aligner.push_samples(frames,timeStamps[start:start+nPoll])
+		stop = np.searchsorted(eventTimes,timeStamps[start+nPoll-1],'right')
+		if stop > e:
+			aligner.push_events(eventTimes[e:stop],np.ones(stop - e,dtype=np.int32))
+			e = stop
+		if start % sampleRate < nPoll:
+			nEpochs += len(aligner.epochs(1,-0.2,0.8)[1])
+	t = timeit.default_timer() - t0
+	memory = aligner.frames.nbytes + aligner.times.nbytes + aligner.events.nbytes
+	print('Sample/event alignment, %d s of %d channels at %d Hz, %.0f events/s' % (seconds,nChannel,sampleRate,eventRate))
+	print('  %.3f s (%.0fx real time), %.1f usec per poll, %d epochs, %.1f MB of buffers' %
+		  (t,seconds/t,t/(nFrames/nPoll)*1e6,nEpochs,memory/1e6))
+	Record(seconds=t,realTime=seconds/t,pollUsec=t/(nFrames/nPoll)*1e6,epochs=nEpochs,bufferBytes=memory)
+
+#########################################################################
+### Streaming Welch PSD
+
+@Benchmark
+def BenchWelchPSD(seconds=120,sampleRate=256,channels=(1,8,24,64),pollSeconds=0.05):
+	nPoll = int(pollSeconds * sampleRate)
+	print('Streaming Welch PSD, %d s at %d Hz in polls of %d samples' % (seconds,sampleRate,nPoll))
+	print('%10s %16s %18s %22s' % ('channels','usec per poll','usec per result','CPU usec per ch per s'))
+	for nChannel in channels:
+		frames = np.random.RandomState(0).standard_normal((nPoll,nChannel+NUM_HEADER_COLUMNS)).astype(np.float32)
+		timeStamps = np.arange(nPoll,dtype=np.uint32)
+		psd = WelchPSD(nChannel,sampleRate)
+		nPolls = int(seconds * sampleRate / nPoll)
+		t0 = timeit.default_timer()
+		for i in range(nPolls):
+			psd.process(frames,timeStamps)
+		t = timeit.default_timer() - t0
+		print('%10d %16.1f %18.1f %22.1f' % (nChannel,t/nPolls*1e6,t/max(1,psd.epochs)*1e6,t/seconds/nChannel*1e6))
+		Record(channels=nChannel,pollUsec=t/nPolls*1e6,resultUsec=t/max(1,psd.epochs)*1e6)
+
+#########################################################################
+### Streaming filters
+
+# reference implementation: every poll filtered on its own, from rest
+def ChunkFilter(sos,frames,nChannel):
+	x = np.asarray(frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+nChannel],dtype=np.float64)
+	return _SOSFilter(sos,x,np.zeros((len(sos),2,nChannel)))
+
+@Benchmark
+def BenchFilterBank(seconds=60,sampleRate=256,nChannel=24,pollSizes=(13,128,2048)):
+	sos = np.vstack([NotchSOS(60.0,sampleRate),BandpassSOS(1.0,40.0,sampleRate)])
+	print('Filter bank, notch + 1-40 Hz band-pass (%d sections), %d channels at %d Hz' % (len(sos),nChannel,sampleRate))
+	rng = np.random.RandomState(0)
+	frames = (rng.standard_normal((int(seconds * sampleRate),nChannel + NUM_HEADER_COLUMNS)) * 20 + 100).astype(np.float32)
+	timeStamps = np.arange(len(frames),dtype=np.uint32)
+	backends = [('numpy',False)]
+	try:
+		import scipy
+		backends.insert(0,('scipy',True))
+	except ImportError:
+		pass
+	print('%8s %8s %20s %14s' % ('backend','poll','Mch-samples/s','x real time'))
+	for (name,useScipy) in backends:
+		for nPoll in pollSizes:
+			n = len(frames) if useScipy else min(len(frames),10 * sampleRate)
+			stage = FilterBank(nChannel,sos,useScipy=useScipy)
+			t0 = timeit.default_timer()
+			for i in range(0,n,nPoll):
+				stage.process(frames[i:i+nPoll],timeStamps[i:i+nPoll])
+			t = timeit.default_timer() - t0
+			print('%8s %8d %20.2f %14.0f' % (name,nPoll,n*nChannel/t/1e6,n/(t*sampleRate)))
+			Record(stage='FilterBank',backend=name,poll=nPoll,channelSamplesPerSec=n*nChannel/t)
+	stage = CommonAverageReference(nChannel)
+	t0 = timeit.default_timer()
+	for i in range(0,len(frames),13):
+		stage.process(frames[i:i+13],timeStamps[i:i+13])
+	t = timeit.default_timer() - t0
+	print('%8s %8d %20.2f %14.0f' % ('CAR',13,len(frames)*nChannel/t/1e6,len(frames)/(t*sampleRate)))
+	Record(stage='CommonAverageReference',poll=13,channelSamplesPerSec=len(frames)*nChannel/t)
+	# edge artifacts: 0.5 s polls (as in testPyX24.py) against the same signal filtered in one piece
+	n = 10 * sampleRate
+	nPoll = sampleRate // 2
+	whole = FilterBank(nChannel,sos,initial='zero').process(frames[:n],timeStamps[:n])[0][:,NUM_HEADER_COLUMNS:]
+	stage = FilterBank(nChannel,sos,initial='zero')
+	stateful = np.concatenate([stage.process(frames[i:i+nPoll],timeStamps[i:i+nPoll])[0] for i in range(0,n,nPoll)])[:,NUM_HEADER_COLUMNS:]
+	chunked = np.concatenate([ChunkFilter(sos,frames[i:i+nPoll],nChannel) for i in range(0,n,nPoll)])
+	print('Polls of %d samples, max deviation from filtering in one piece after the first poll (uV):' % nPoll)
+	print('  per-poll filtering %12.3f' % np.abs(chunked - whole)[nPoll:].max())
+	print('  FilterBank state   %12.3g' % np.abs(stateful - whole)[nPoll:].max())
+	Record(poll=nPoll,perPollDeviation=float(np.abs(chunked - whole)[nPoll:].max()),
+		   statefulDeviation=float(np.abs(stateful - whole)[nPoll:].max()))
+
+#########################################################################
+### Channel quality monitoring
+
+# reference implementation: statistics recomputed over the whole window at every poll
+class WindowRecompute(object):
+	def __init__(self,nChannel,window):
+		self.nChannel = nChannel
+		self.buffer = np.zeros((window,nChannel))
+		self.window = window
+
+	def process(self,frames,timestamps):
+		data = frames[:,NUM_HEADER_COLUMNS:NUM_HEADER_COLUMNS+self.nChannel]
+		self.buffer = np.concatenate([self.buffer,data])[-self.window:]
+		x = self.buffer
+		t = np.arange(len(x)) * 2 * np.pi * 60 / 256.0
+		z = x - x.mean(axis=0)
+		return (x.std(axis=0),np.ptp(x,axis=0),(np.abs(np.diff(x,axis=0)) < 0.1).mean(axis=0),
+				(np.abs(x) >= 3000).mean(axis=0),np.hypot(np.cos(t).dot(z),np.sin(t).dot(z)))
+
+@Benchmark
+def BenchQualityMonitor(seconds=120,sampleRate=256,nChannel=24,pollSizes=(1,13,128),windowSeconds=(2,10)):
+	print('Channel quality monitor, %d channels at %d Hz' % (nChannel,sampleRate))
+	print('%8s %8s %14s %14s %14s %10s' % ('window s','poll','recompute ns','monitor ns','x real time','speedup'))
+	frames = np.random.RandomState(0).standard_normal((int(seconds * sampleRate),nChannel + NUM_HEADER_COLUMNS)).astype(np.float32) * 20
+	timeStamps = np.arange(len(frames),dtype=np.uint32)
+	for window in windowSeconds:
+		for nPoll in pollSizes:
+			n = len(frames) // nPoll * nPoll
+			if nPoll == 1:
+				n = min(n,20 * sampleRate)
+			times = []
+			for stage in [WindowRecompute(nChannel,int(window * sampleRate)),QualityMonitor(nChannel,sampleRate,window)]:
+				t0 = timeit.default_timer()
+				for i in range(0,n,nPoll):
+					stage.process(frames[i:i+nPoll],timeStamps[i:i+nPoll])
+				times.append((timeit.default_timer() - t0) / n)
+			print('%8d %8d %14.0f %14.0f %14.0f %9.1fx' % (window,nPoll,times[0]*1e9,times[1]*1e9,
+				1.0/(times[1]*sampleRate),times[0]/times[1]))
+			Record(window=window,poll=nPoll,recomputeNsec=times[0]*1e9,monitorNsec=times[1]*1e9)
+
+#########################################################################
+### Recording
+
+# reference implementation: the text writers from testPyX24.py
+def TextWriter(fpRAW,fpTS,frames,timeStamps):
+	RAW = frames.tolist()
+	for TSmsec in timeStamps.tolist():
+		fpTS.write('%02x.%02x.%02x.%02x., %d\n' % (TSmsec >> 24,(TSmsec >> 16) & 0xff,(TSmsec >> 8) & 0xff,TSmsec & 0xff,TSmsec))
+	for j in range(len(RAW)):
+		fpRAW.write(str(RAW.pop(0)).strip('[]') + '\n')
+
+@Benchmark
+def BenchRecording(nCount=128,nPolls=400,nChannel=24):
+	ABMengine = ABMHandler(FakeABMDLL(nChannel=nChannel,nCountPerCall=nCount*nPolls))
+	frames = ABMengine.GetRawDataArray()
+	timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+	batches = [(frames[i:i+nCount],timeStamps[i:i+nCount]) for i in range(0,len(frames),nCount)]
+	tmp = tempfile.mkdtemp()
+	print('Recording %d frames of %d channels in batches of %d' % (len(frames),nChannel,nCount))
+	print('%10s %12s %12s %14s' % ('writer','seconds','MB on disk','frames/s'))
+
+	rawPath = os.path.join(tmp,'RAWsamps.txt')
+	tsPath = os.path.join(tmp,'timeStamps.txt')
+	t0 = timeit.default_timer()
+	with open(rawPath,'w') as fpRAW:
+		with open(tsPath,'w') as fpTS:
+			for (f,ts) in batches:
+				TextWriter(fpRAW,fpTS,f,ts)
+	t = timeit.default_timer() - t0
+	size = os.path.getsize(rawPath) + os.path.getsize(tsPath)
+	print('%10s %12.3f %12.2f %14.0f' % ('text',t,size/1e6,len(frames)/t))
+	Record(writer='text',seconds=t,bytes=size,framesPerSec=len(frames)/t)
+
+	binPath = os.path.join(tmp,'RAWsamps.abr')
+	t0 = timeit.default_timer()
+	rec = ABMRecorder(binPath,nChannel)
+	for (f,ts) in batches:
+		rec.write(f,ts)
+	rec.close()
+	t = timeit.default_timer() - t0
+	print('%10s %12.3f %12.2f %14.0f' % ('binary',t,os.path.getsize(binPath)/1e6,len(frames)/t))
+	Record(writer='binary',seconds=t,bytes=os.path.getsize(binPath),framesPerSec=len(frames)/t)
+
+	zPath = os.path.join(tmp,'RAWsamps.z.abr')
+	t0 = timeit.default_timer()
+	rec = ABMRecorder(zPath,nChannel,compression='zlib')
+	for (f,ts) in batches:
+		rec.write(f,ts)
+	rec.close()
+	t = timeit.default_timer() - t0
+	print('%10s %12.3f %12.2f %14.0f' % ('zlib',t,os.path.getsize(zPath)/1e6,len(frames)/t))
+	Record(writer='zlib',seconds=t,bytes=os.path.getsize(zPath),framesPerSec=len(frames)/t)
+	for name in os.listdir(tmp):
+		os.remove(os.path.join(tmp,name))
+	os.rmdir(tmp)
+
+#########################################################################
+### Compressed recordings
+
+# chunks of (nCol, chunkFrames) samples and their timestamps
+def _Chunks(frames,timeStamps,chunkFrames):
+	return [(np.ascontiguousarray(frames[i:i+chunkFrames].T),timeStamps[i:i+chunkFrames])
+			for i in range(0,len(frames) - chunkFrames + 1,chunkFrames)]
+
+# mean and largest time of write() for polls of pollSize frames
+def _WriteLatency(path,frames,timeStamps,pollSize,**options):
+	rec = ABMRecorder(path,frames.shape[1] - NUM_HEADER_COLUMNS,fsyncInterval=None,**options)
+	times = []
+	for i in range(0,len(frames),pollSize):
+		t0 = timeit.default_timer()
+		rec.write(frames[i:i+pollSize],timeStamps[i:i+pollSize])
+		times.append(timeit.default_timer() - t0)
+	rec.close()
+	return (np.mean(times),np.max(times))
+
+@Benchmark
+def BenchCompression(seconds=600,nChannel=24,sampleRate=256,chunkFrames=1024,pollSize=13,quantum=0.1):
+	sim = SimABMDLL(nChannel=nChannel,sampleRate=sampleRate,speed=None,nCountPerCall=int(seconds * sampleRate))
+	ABMengine = ABMHandler(sim)
+	ABMengine.InitSession(3,ABM_SESSION_RAW,-1,False)
+	ABMengine.StartAcquisition()
+	frames = ABMengine.GetRawDataArray()
+	timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+	# the same signals on a grid of 'quantum' uV, as an ADC with a fixed gain would give
+	quantized = frames.copy()
+	quantized[:,NUM_HEADER_COLUMNS:] = np.round(quantized[:,NUM_HEADER_COLUMNS:] / quantum) * quantum
+	print('Chunk compression, %d s of synthetic EEG, %d channels, %d frames per chunk' % (seconds,nChannel,chunkFrames))
+	print('%12s %8s %6s %8s %12s %12s' % ('data','filter','codec','ratio','encode MB/s','decode MB/s'))
+	for (dataName,data) in (('float',frames),('%g uV' % quantum,quantized)):
+		chunks = _Chunks(data,timeStamps,chunkFrames)
+		size = sum(samples.nbytes + ts.nbytes for (samples,ts) in chunks)
+		for codec in sorted(CODECS):
+			for chunkFilter in FILTERS:
+				t0 = timeit.default_timer()
+				blocks = [EncodeChunk(samples,ts,chunkFilter,codec) for (samples,ts) in chunks]
+				tEncode = timeit.default_timer() - t0
+				t0 = timeit.default_timer()
+				for (tsBlock,samplesBlock) in blocks:
+					DecodeTimestamps(tsBlock,chunkFrames,codec)
+					DecodeSamples(samplesBlock,nChannel + NUM_HEADER_COLUMNS,chunkFrames,chunkFilter,codec)
+				tDecode = timeit.default_timer() - t0
+				ratio = float(size) / sum(len(a) + len(b) for (a,b) in blocks)
+				print('%12s %8s %6s %8.2f %12.0f %12.0f' % (dataName,chunkFilter,codec,ratio,size/tEncode/1e6,size/tDecode/1e6))
+				Record(data=dataName,filter=chunkFilter,codec=codec,ratio=ratio,encodeMBps=size/tEncode/1e6,
+					   decodeMBps=size/tDecode/1e6)
+
+	tmp = tempfile.mkdtemp()
+	print('write() of %d frames per poll (usec)' % pollSize)
+	print('%24s %10s %10s' % ('recorder','mean','max'))
+	for (name,options) in (('uncompressed',{}),('zlib, in write()',dict(compression='zlib',background=False)),
+						   ('zlib, worker thread',dict(compression='zlib'))):
+		(mean,largest) = _WriteLatency(os.path.join(tmp,'poll.abr'),frames,timeStamps,pollSize,**options)
+		print('%24s %10.1f %10.1f' % (name,mean*1e6,largest*1e6))
+		Record(recorder=name,meanUsec=mean*1e6,maxUsec=largest*1e6)
+	shutil.rmtree(tmp)
+
+#########################################################################
+### Decimation pyramids
+
+# reference implementation: min/max of every sample of the range, pixel by pixel
+def FullScan(recording,start,stop,width,columns):
+	data = recording.frames(start,stop,columns)
+	edges = np.arange(width) * (stop - start) // width
+	return (np.minimum.reduceat(data,edges,axis=0),np.maximum.reduceat(data,edges,axis=0))
+
+@Benchmark
+def BenchDecimation(hours=1.0,nChannel=24,sampleRate=256,width=1920,spans=(10,600,3600),pollSize=13,repeat=3):
+	nFrames = int(hours * 3600 * sampleRate)
+	tmp = tempfile.mkdtemp()
+	path = os.path.join(tmp,'long.abr')
+	sim = SimABMDLL(nChannel=nChannel,sampleRate=sampleRate,speed=None,nCountPerCall=65536)
+	ABMengine = ABMHandler(sim)
+	ABMengine.InitSession(3,ABM_SESSION_RAW,-1,False)
+	ABMengine.StartAcquisition()
+	with ABMRecorder(path,nChannel,sampleRate) as rec:
+		while rec.nFrames < nFrames:
+			frames = ABMengine.GetRawDataArray()
+			rec.write(frames,ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames)))
+	recording = ABMRecording(path)
+	print('Decimation pyramid of %g h of %d channels (%d frames), %d pixels wide' % (hours,nChannel,len(recording),width))
+
+	live = DecimationPyramid(nChannel)
+	batch = recording.frames(0,pollSize)
+	tsBatch = recording.timestamps(0,pollSize)
+	number = 20000
+	tLive = min(timeit.repeat(lambda: live.process(batch,tsBatch),number=number,repeat=repeat)) / number
+	print('live update, %d frames per poll: %.1f usec' % (pollSize,tLive*1e6))
+	Record(operation='liveUpdate',pollSize=pollSize,usec=tLive*1e6)
+	t0 = timeit.default_timer()
+	RecordingPyramid(recording)
+	tBuild = timeit.default_timer() - t0
+	t0 = timeit.default_timer()
+	pyramid = RecordingPyramid(recording)
+	tLoad = timeit.default_timer() - t0
+	size = os.path.getsize(path + '.pyr')
+	print('built in %.2f s (%.1f MB, %.1f%% of the recording), loaded in %.1f ms' % (tBuild,size/1e6,
+		100.0*size/os.path.getsize(path),tLoad*1e3))
+	Record(operation='build',seconds=tBuild,bytes=size,loadSeconds=tLoad)
+
+	print('%10s %10s %14s %14s %10s' % ('span (s)','channels','full scan ms','pyramid ms','speedup'))
+	for span in spans:
+		stop = min(len(recording),span * sampleRate)
+		start = len(recording) - stop + 7		# unaligned
+		for channels in (['Fz'],None):
+			columns = [NUM_HEADER_COLUMNS + i for i in range(nChannel)] if channels is None else channels
+			tScan = min(timeit.repeat(lambda: FullScan(recording,start,len(recording),width,columns),number=1,repeat=repeat))
+			tPyr = min(timeit.repeat(lambda: pyramid.query(start,len(recording),width,channels),number=10,repeat=repeat)) / 10
+			nCh = len(columns)
+			print('%10d %10d %14.2f %14.2f %9.1fx' % (span,nCh,tScan*1e3,tPyr*1e3,tScan/tPyr))
+			Record(span=span,channels=nCh,fullScanMs=tScan*1e3,pyramidMs=tPyr*1e3)
+	recording.close()
+	pyramid.recording = None
+	shutil.rmtree(tmp)
+
+#########################################################################
+### Third party (MC-ESU) packet parsing
+
+@Benchmark
+def BenchESUParser(nPackets=100000,chunkSizes=(256,4096,65536),corruption=0.01):
+	rng = np.random.RandomState(0)
+	payloads = [rng.randint(0,256,rng.randint(0,17)).astype(np.uint8).tobytes() for i in range(nPackets)]
+	clean = EncodeESUPackets(np.arange(nPackets) * 4,rng.randint(0,4,nPackets),payloads)
+	# flip one byte in a fraction of the packets
+	corrupt = np.frombuffer(clean,dtype=np.uint8).copy()
+	hits = rng.randint(0,len(corrupt),int(nPackets * corruption))
+	corrupt[hits] ^= 0xa5
+	print('MC-ESU packet parsing, %d packets, %.2f MB' % (nPackets,len(clean)/1e6))
+	print('%10s %10s %12s %12s %12s' % ('stream','chunk','MB/s','packets/s','parsed'))
+	for (name,stream) in [('clean',clean),('corrupt',corrupt.tobytes())]:
+		for chunk in chunkSizes:
+			parser = ESUPacketParser()
+			t0 = timeit.default_timer()
+			for i in range(0,len(stream),chunk):
+				parser.feed(stream[i:i+chunk])
+			t = timeit.default_timer() - t0
+			print('%10s %10d %12.1f %12.0f %12d' % (name,chunk,len(stream)/t/1e6,parser.packets/t,parser.packets))
+			Record(stream=name,chunk=chunk,bytesPerSec=len(stream)/t,packetsPerSec=parser.packets/t,packets=parser.packets)
+
+#########################################################################
+### Multi-device acquisition
+
+@Benchmark
+def BenchMultiDevice(counts=(1,2,4,8),seconds=3.0,speed=20.0,nChannel=24,readInterval=0.05):
+	print('Multi-device acquisition, %d channels at %gx real time per device, %d CPUs' %
+		  (nChannel,speed,multiprocessing.cpu_count()))
+	print('%8s %14s %16s %14s %14s' % ('devices','samples/s','per device','worker CPU %','parent CPU %'))
+	for nDevice in counts:
+		devices = [DeviceConfig('sim%d' % i,loader=SimLoader(nChannel=nChannel,speed=speed),nChannel=nChannel)
+				   for i in range(nDevice)]
+		manager = AcquisitionManager(devices,pollInterval=0.01)
+		manager.start()
+		for name in manager.names:		# drop what arrived during the start-up
+			manager.read(name)
+		worker0 = sum(c['cpuSeconds'] for c in manager.counters().values())
+		cpu0 = os.times()
+		t0 = timeit.default_timer()
+		nSamples = 0
+		while timeit.default_timer() - t0 < seconds:
+			time.sleep(readInterval)
+			for (frames,timestamps) in manager.read_all().values():
+				nSamples += len(frames)
+		t = timeit.default_timer() - t0
+		cpu1 = os.times()
+		manager.stop()
+		workerCPU = sum(c['cpuSeconds'] for c in manager.counters().values()) - worker0
+		parentCPU = (cpu1[0] - cpu0[0]) + (cpu1[1] - cpu0[1])
+		print('%8d %14.0f %16.0f %14.1f %14.1f' % (nDevice,nSamples/t,nSamples/t/nDevice,
+			100*workerCPU/t/nDevice,100*parentCPU/t))
+		Record(devices=nDevice,samplesPerSec=nSamples/t,workerCPU=workerCPU/t/nDevice,parentCPU=parentCPU/t)
+
+#########################################################################
+### Batch reprocessing
+
+def _WriteSession(path,seconds,nChannel,sampleRate):
+	sim = SimABMDLL(nChannel=nChannel,sampleRate=sampleRate,speed=None,nCountPerCall=65536)
+	ABMengine = ABMHandler(sim)
+	ABMengine.InitSession(3,ABM_SESSION_RAW,-1,False)
+	ABMengine.StartAcquisition()
+	nFrames = int(seconds * sampleRate)
+	with ABMRecorder(path,nChannel,sampleRate) as rec:
+		while rec.nFrames < nFrames:
+			frames = ABMengine.GetRawDataArray()[:nFrames - rec.nFrames]
+			rec.write(frames,ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames)))
+
+@Benchmark
+def BenchBatch(sessions=8,seconds=600,nChannel=24,sampleRate=256,counts=(1,2,4,8)):
+	tmp = tempfile.mkdtemp()
+	try:
+		directory = os.path.join(tmp,'sessions')
+		os.makedirs(directory)
+		for i in range(sessions):
+			_WriteSession(os.path.join(directory,'session%d.abr' % i),seconds,nChannel,sampleRate)
+		print('Batch reprocessing of %d sessions of %d s, %d channels (DefaultStages), %d CPUs' %
+			  (sessions,seconds,nChannel,multiprocessing.cpu_count()))
+		print('%10s %10s %12s %14s %10s' % ('processes','seconds','sessions/s','x real time','speedup'))
+		single = None
+		for processes in (0,) + tuple(counts):
+			report = ReprocessDirectory(directory,os.path.join(tmp,'results%d' % processes),processes=processes,
+										progress=None)
+			if report['failed']:
+				raise RuntimeError([s['error'] for s in report['sessions'] if s['error']][0])
+			t = report['seconds']
+			if processes == 1:
+				single = t
+			speedup = single / t if single else float('nan')
+			print('%10s %10.2f %12.2f %14.0f %10.2f' % (processes or 'in-process',t,sessions/t,
+				sessions*seconds/t,speedup))
+			Record(processes=processes,seconds=t,sessionsPerSec=sessions/t,realTime=sessions*seconds/t,speedup=speedup)
+	finally:
+		shutil.rmtree(tmp)
+
+#########################################################################
+### Network streaming
+
+def _Addresses(tmp):
+	addresses = [('tcp',('127.0.0.1',0))]
+	if hasattr(socket,'AF_UNIX'):
+		addresses.append(('uds',os.path.join(tmp,'frames.sock')))
+	return addresses
+
+# receives batches until the publisher closes, recording the latency of each batch
+def _Receive(subscriber,latencies,counts):
+	for batch in subscriber:
+		latencies.append(time.time() - batch.sendTime)
+		counts[0] += len(batch.frames)
+
+@Benchmark
+def BenchNetworkStreaming(nChannel=24,nBatches=400,batchFrames=13,fanOut=(1,4,16),fanOutBatches=2000,fanOutFrames=128):
+	ABMengine = ABMHandler(FakeABMDLL(nChannel=nChannel,nCountPerCall=max(batchFrames,fanOutFrames),static=True))
+	metadata = StreamMetadata(ABMengine.GetDeviceInfo())
+	frames = ABMengine.GetRawDataArray()
+	timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+	tmp = tempfile.mkdtemp()
+
+	print('Streaming latency, batches of %d frames of %d channels every 5 ms' % (batchFrames,nChannel))
+	print('%6s %12s %12s %12s' % ('socket','p50 usec','p99 usec','max usec'))
+	for (name,address) in _Addresses(tmp):
+		publisher = FramePublisher(address,metadata)
+		subscriber = FrameSubscriber(publisher.address)
+		latencies = []
+		thread = threading.Thread(target=_Receive,args=(subscriber,latencies,[0]))
+		thread.start()
+		while not publisher.subscribers:
+			time.sleep(0.001)
+		for i in range(nBatches):
+			publisher.send(frames[:batchFrames],timeStamps[:batchFrames])
+			time.sleep(0.005)
+		time.sleep(0.1)
+		publisher.close()
+		thread.join()
+		subscriber.close()
+		lat = np.array(latencies) * 1e6
+		print('%6s %12.0f %12.0f %12.0f' % (name,np.percentile(lat,50),np.percentile(lat,99),lat.max()))
+		Record(socket=name,p50Usec=np.percentile(lat,50),p99Usec=np.percentile(lat,99),maxUsec=lat.max())
+
+	nBytes = fanOutFrames * (nChannel + NUM_HEADER_COLUMNS + 1) * 4
+	print('Fan-out, %d batches of %d frames (%.1f kB) sent as fast as possible' % (fanOutBatches,fanOutFrames,nBytes/1e3))
+	print('%6s %12s %14s %14s %12s' % ('socket','subscribers','batches/s','MB/s total','dropped %'))
+	for (name,address) in _Addresses(tmp):
+		for nSubscriber in fanOut:
+			publisher = FramePublisher(address,metadata)
+			subscribers = [FrameSubscriber(publisher.address) for i in range(nSubscriber)]
+			counts = [[0] for i in range(nSubscriber)]
+			threads = [threading.Thread(target=_Receive,args=(sub,[],count)) for (sub,count) in zip(subscribers,counts)]
+			for thread in threads:
+				thread.start()
+			while len(publisher.subscribers) < nSubscriber:
+				time.sleep(0.001)
+			t0 = timeit.default_timer()
+			for i in range(fanOutBatches):
+				publisher.send(frames[:fanOutFrames],timeStamps[:fanOutFrames])
+			# wait until every queue is empty
+			while any(sub.queue for sub in publisher.subscribers):
+				time.sleep(0.001)
+			t = timeit.default_timer() - t0
+			dropped = publisher.dropped
+			publisher.close()
+			for thread in threads:
+				thread.join()
+			for sub in subscribers:
+				sub.close()
+			received = sum(c[0] for c in counts) / float(fanOutFrames)
+			print('%6s %12d %14.0f %14.1f %12.1f' % (name,nSubscriber,fanOutBatches/t,received*nBytes/t/1e6,
+				100.0*dropped/(fanOutBatches*nSubscriber)))
+			Record(socket=name,subscribers=nSubscriber,batchesPerSec=fanOutBatches/t,
+				   bytesPerSec=received*nBytes/t,dropped=dropped)
+	shutil.rmtree(tmp)
+
+#########################################################################
+### End-to-end throughput
+
+# consumer of the streamer: continuity checks and recording of everything read
+def _Consume(streamer,recorder,checker,stop,counts):
+	while not stop.is_set() or len(streamer.ring):
+		(frames,timestamps) = streamer.read()
+		if len(frames) == 0:
+			time.sleep(0.005)
+			continue
+		checker.process(frames,timestamps)
+		recorder.write(frames,timestamps)
+		counts[0] += len(frames)
+
+@Benchmark
+def BenchEndToEnd(speeds=(1,10,100),seconds=5.0,nChannel=24,sampleRate=256,burstSize=4,backlogSeconds=10.0):
+	print('End-to-end acquisition of %d channels at multiples of %d Hz for %g s: SimABMDLL -> ABMStreamer ->'
+		  ' ContinuityChecker + ABMRecorder' % (nChannel,sampleRate,seconds))
+	print('%6s %14s %14s %10s %10s %12s %8s' % ('speed','target /s','recorded /s','sustained','lost','max batch','CPU %'))
+	tmp = tempfile.mkdtemp()
+	for speed in speeds:
+		# the SDK keeps backlogSeconds of samples, in wall-clock time at any speed
+		sim = SimABMDLL(nChannel=nChannel,sampleRate=sampleRate,speed=speed,burstSize=burstSize,
+						backlogSeconds=backlogSeconds*speed)
+		ABMengine = ABMHandler(sim)
+		ABMengine.GetDeviceInfo()
+		ABMengine.InitSession(3,ABM_SESSION_RAW,-1,False)
+		streamer = ABMStreamer(ABMengine,sampleRate * speed,bufferSeconds=2)
+		recorder = ABMRecorder(os.path.join(tmp,'speed%d.abm' % speed),nChannel,sampleRate)
+		checker = ContinuityChecker(sampleRate)
+		(stop,counts) = (threading.Event(),[0])
+		consumer = threading.Thread(target=_Consume,args=(streamer,recorder,checker,stop,counts))
+		cpu0 = os.times()
+		ABMengine.StartAcquisition()
+		streamer.start()
+		consumer.start()
+		time.sleep(seconds)
+		streamer.stop()
+		stop.set()
+		consumer.join()
+		cpu1 = os.times()
+		ABMengine.StopAcquisition()
+		recorder.close()
+		t = seconds
+		cpu = (cpu1[0] - cpu0[0]) + (cpu1[1] - cpu0[1])
+		target = sampleRate * speed
+		lost = checker.dropped			# SDK backlog overflows and ring overruns
+		print('%6d %14.0f %14.0f %9.1f%% %10d %12d %8.1f' % (speed,target,counts[0]/t,100.0*counts[0]/(target*t),
+			lost,streamer.maxBatch,100*cpu/t))
+		Record(speed=speed,targetPerSec=target,recordedPerSec=counts[0]/t,lost=lost,sdkDropped=sim.dropped,
+			   overruns=streamer.overruns,maxBatch=streamer.maxBatch,cpu=cpu/t,bytesWritten=recorder.bytesWritten)
+	shutil.rmtree(tmp)
+
+if sys.version_info >= (3,5):
+	from benchPyABMAsync import BenchEventLoopLatency
+
+if __name__ == '__main__':
+	sys.exit(RunBenchmarks())
@@ -0,0 +1,72 @@
+#########################################################################
+#	benchPyABMAsync.py
+#	Event loop latency while streaming from the simulated SDK, with the SDK
+#	calls made on the loop (blocking) and through AsyncABMHandler (Python 3.5+)
+#
+#	Run this code by typing 'python benchPyABMAsync.py' at the command prompt
+#	(also run by benchPyABM.py under Python 3, same options, see benchPyABMSuite.py)
+#########################################################################
+
+import asyncio
+import sys
+
+from PyABM import *
+from PyABMAsync import AsyncABMHandler, LoopLagMonitor
+from PyABMSim import SimABMDLL
+from benchPyABMSuite import Benchmark, Record, RunBenchmarks
+
+# reference: polling loop calling the SDK directly from a coroutine
+async def _PollBlocking(ABMengine,seconds,interval):
+	loop = asyncio.get_event_loop()
+	tEnd = loop.time() + seconds
+	nSamples = 0
+	while loop.time() < tEnd:
+		frames = ABMengine.GetRawDataArray()
+		ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+		nSamples += len(frames)
+		await asyncio.sleep(interval)
+	return nSamples
+
+async def _PollAsync(ABMengine,seconds,interval):
+	loop = asyncio.get_event_loop()
+	tEnd = loop.time() + seconds
+	nSamples = 0
+	sdk = AsyncABMHandler(ABMengine)
+	stream = sdk.stream(interval=interval)
+	async for (frames,timestamps) in stream.raw():
+		nSamples += len(frames)
+		if loop.time() >= tEnd:
+			stream.close()
+	await sdk.aclose()
+	return nSamples
+
+async def _Measure(poll,ABMengine,seconds,interval):
+	monitor = LoopLagMonitor()
+	monitor.start()
+	nSamples = await poll(ABMengine,seconds,interval)
+	monitor.stop()
+	return (nSamples,monitor)
+
+@Benchmark
+def BenchEventLoopLatency(seconds=3.0,nChannel=24,speed=20.0,callLatency=0.005,interval=0.02):
+	print('Event loop lag while streaming %d channels at %gx real time, SDK calls blocking %.1f ms' %
+		  (nChannel,speed,callLatency*1e3))
+	print('%10s %12s %10s %10s %10s' % ('calls','samples/s','p50 ms','p99 ms','max ms'))
+	for (name,poll) in [('blocking',_PollBlocking),('async',_PollAsync)]:
+		sim = SimABMDLL(nChannel=nChannel,speed=speed,callLatency=callLatency)
+		ABMengine = ABMHandler(sim)
+		ABMengine.GetDeviceInfo()
+		ABMengine.InitSession(3,ABM_SESSION_RAW,-1,0)
+		ABMengine.StartAcquisition()
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		(nSamples,monitor) = loop.run_until_complete(_Measure(poll,ABMengine,seconds,interval))
+		loop.close()
+		ABMengine.StopAcquisition()
+		print('%10s %12.0f %10.2f %10.2f %10.2f' % (name,nSamples/seconds,monitor.percentile(50)*1e3,
+			monitor.percentile(99)*1e3,max(monitor.lags)*1e3))
+		Record(calls=name,samplesPerSec=nSamples/seconds,p50Msec=monitor.percentile(50)*1e3,
+			   p99Msec=monitor.percentile(99)*1e3,maxMsec=max(monitor.lags)*1e3)
+
+if __name__ == '__main__':
+	sys.exit(RunBenchmarks())
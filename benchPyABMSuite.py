@@ -0,0 +1,130 @@
+#########################################################################
+#	benchPyABMSuite.py
+#	Registry and runner of the benchmarks in benchPyABM.py and
+#	benchPyABMAsync.py: selection from the command line and results written
+#	as JSON, to compare runs over time
+#
+#	Usage:
+#		python benchPyABM.py --list
+#		python benchPyABM.py RawConversion TimeStamps --json results.json
+#
+#	Each benchmark prints its table and passes every row to Record(), which
+#	keeps it under the name of the running benchmark for the JSON output:
+#		{"machine": {...}, "started": "...", "benchmarks": {name: {"seconds": s,
+#		 "rows": [{column: value}], "error": null}}}
+#########################################################################
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import traceback
+
+import numpy as np
+
+BENCHMARKS = OrderedDict()			# {name: function}, in the order they are run
+RESULTS = OrderedDict()				# {name: {'seconds','rows','error'}} of the benchmarks run
+_current = [None]					# name of the running benchmark
+
+## Benchmark(func)
+#	Decorator registering a benchmark function BenchName under 'Name'
+def Benchmark(func):
+	name = func.__name__
+	if name.startswith('Bench'):
+		name = name[len('Bench'):]
+	BENCHMARKS[name] = func
+	return func
+
+## Record(**values)
+#	Adds a result row (column=value) to the running benchmark; does nothing outside RunBenchmarks
+def Record(**values):
+	name = _current[0]
+	if name is None:
+		return
+	row = {}
+	for (key,value) in values.items():
+		if isinstance(value,np.generic):
+			value = value.item()
+		row[key] = value
+	RESULTS[name]['rows'].append(row)
+
+## MachineInfo() - description of the machine and software the results were measured on
+def MachineInfo():
+	info = {'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+			'cpus': multiprocessing.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__}
+	try:
+		import scipy
+		info['scipy'] = scipy.__version__
+	except ImportError:
+		info['scipy'] = None
+	try:
+		with open(os.devnull,'w') as devnull:
+			commit = subprocess.check_output(['git','rev-parse','HEAD'],stderr=devnull,
+											 cwd=os.path.dirname(os.path.abspath(__file__)))
+		info['commit'] = commit.decode('ascii').strip()
+	except (OSError,subprocess.CalledProcessError):
+		info['commit'] = None
+	return info
+
+## Select(names)
+#	Registered benchmark names matching names (case-insensitive prefixes), all for an empty list
+def Select(names):
+	if not names:
+		return list(BENCHMARKS)
+	selected = []
+	for pattern in names:
+		matches = [name for name in BENCHMARKS if name.lower().startswith(pattern.lower())]
+		if not matches:
+			raise ValueError('No benchmark named %s (see --list)' % pattern)
+		selected.extend(name for name in matches if name not in selected)
+	return selected
+
+## RunBenchmarks(argv=None)
+#	Description:
+#		Command line entry point: runs the selected benchmarks in registry order, carrying on
+#		after a benchmark fails (its traceback is printed and kept in 'error'), and writes the
+#		results to --json. Returns the exit status (1 if a benchmark failed).
+def RunBenchmarks(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmarks of the PyABM wrapper against the simulated SDK')
+	parser.add_argument('names',nargs='*',help='benchmarks to run (prefixes of the names listed by --list), default all')
+	parser.add_argument('--list',action='store_true',help='list the benchmarks and exit')
+	parser.add_argument('--json',metavar='PATH',help='write the results to PATH as JSON')
+	args = parser.parse_args(argv)
+	if args.list:
+		for name in BENCHMARKS:
+			print(name)
+		return 0
+	try:
+		names = Select(args.names)
+	except ValueError as e:
+		parser.error(str(e))
+	started = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+	failed = False
+	for name in names:
+		RESULTS[name] = {'seconds': None, 'rows': [], 'error': None}
+		_current[0] = name
+		t0 = timeit.default_timer()
+		try:
+			BENCHMARKS[name]()
+		except Exception:
+			RESULTS[name]['error'] = traceback.format_exc()
+			traceback.print_exc()
+			failed = True
+		finally:
+			_current[0] = None
+		RESULTS[name]['seconds'] = timeit.default_timer() - t0
+		print()
+		sys.stdout.flush()
+	if args.json:
+		with open(args.json,'w') as f:
+			json.dump({'machine': MachineInfo(),'started': started,'benchmarks': RESULTS},f,indent=1,sort_keys=True)
+		print('Results written to %s' % args.json)
+	return 1 if failed else 0
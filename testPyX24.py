@@ -3,7 +3,7 @@
 #	This file tests the communication with the ABM X24 headset using the python
 #	wrapper PyABM.py to interact with the SDK supplied by Advanced Brain Monitoring Inc
 #
-#	Acquisition is initiated and Raw values and timestamps are saved in text files
+#	Acquisition is initiated and Raw values and timestamps are recorded, then saved in text files
 #
 #	Run this code by typing 'python testPyX24.py' at the command prompt in 
 #		the appropriate directory
@@ -15,6 +15,8 @@
 #########################################################################
 
 from PyABM import *	# import all classes and functions from PyABM
+from PyABMRecord import *	# binary recording of the acquired samples
+from PyABMStatus import *	# session commands with typed errors and retries
 import time			# for pausing and such
 import numpy as np  # for math operations
 
@@ -131,86 +133,73 @@ sessionType = 0		# Values: ABM_SESSION_RAW [0] //For RAW & RAW-PSD data
 deviceHandle = -1	# Value: -1 //Reserved
 playEBS = 0			# bPlayEBS True or False
 
-init = -1
-tries = 1
-print "Initializing Session"
-while init != 1 & tries < 11:
-	init = ABMengine.InitSession(deviceType,sessionType,deviceHandle,playEBS)
-	if init != 1:
-		if tries == 10:
-			print 'Could not initialize Device, quitting program'
-			exit()
-		print 'Initialization Unsuccessful, Try #: ' + str(tries)
-		tries += 1
+# session commands with typed errors; InitSession and StartAcquisition are tried up to 10 times
+session = ABMSession(ABMengine,RetryPolicy(attempts=10,delay=0.5))
 
+print "Initializing Session"
+try:
+	session.init(deviceType,sessionType,deviceHandle,playEBS)
+except CommandFailed as e:
+	print 'Could not initialize Device after ' + str(e.attempts) + ' tries, quitting program'
+	exit()
 
 print "Starting Acquisition"
-stat = ABMengine.StartAcquisition()
-print 'Acquisition started?: ' + str(stat)
-if stat == -1:
+try:
+	session.start()
+except CommandFailed as e:
 	print 'Could not start acquisition, quitting program'
 	quit()
 
-mode = ABMengine.GetCurrentSDKMode()
+mode = session.mode()
 print 'SDK mode: ' + str(mode)
 
 ####################################################################################
 ### Test getting RAW data and saving to files
 
-# Open files for writing
-fpTS = open('timeStamps.txt','wb')
-fpRAW = open('RAWsamps.txt','wb')
-
-# write file headers
-fpRAW.write('Epoch, Offset, Hour, Min, Sec, mSec, F3, F1, Fz, F2, F4, C3, C1, Cz, C2, C4, CPz, P3, P1, Pz, P2, P4, POz, O1, Oz, O2, EKG, AUX1, AUX2, AUX3\n')
-fpTS.write('Hexidecimal, Milliseconds\n')
-
-RAW = []	# list for carrying raw signal
-TSmult = np.array([pow(2,24),pow(2,16),pow(2,8),pow(2,0)])	# For converting timestamp to milliseconds
-
-for i in range(10):
-	time.sleep(0.5)
-	
-	### Get Raw Data and store in 2-D list
-	(rData,nCount) = ABMengine.GetRawData()
-	print str(nCount.value) + ' samples drawn'
-	l = 0
-	for j in range(nCount.value):		# loop through each sample
-		RAW.append([])					# add new list entry for this time sample
-		for k in range(nCh+6):			# loop through each channel and 6 header values for each sample
-			RAW[j].append(rData[l])		# append each channel value to the sub-list corresponding to current time sample
-			l+=1
-
-	### Get Time stamps and store
-	pTimeStamps = ABMengine.GetTimeStampsStreamData(0)
-	l = 0
-	for j in range(nCount.value):
-		TS = np.array([])
-		for k in range(4):							# loop through 4-byte time stamp information
-			fpTS.write('%02x.' % pTimeStamps[l])	# write hexidecimal value to file
-			TS = np.append(TS,pTimeStamps[l])
-			l+=1
-		TSmsec = (TS*TSmult).sum()					# convert timestamp to milliseconds
-		fpTS.write(', ' + str(TSmsec) + '\n')
-			
-	## Write the raw samples to a file
-	for j in range(nCount.value):
-		fpRAW.write(str(RAW.pop(0)).strip('[]') + '\n')
-
-######################################################################################
-### Test Pausing, Resuming and Stopping Acquisition
-
-print "Pausing Acquisition"
-stat = ABMengine.PauseAcquisition()
-
-print "Resuming Acquisition"
-stat = ABMengine.ResumeAcquisition()
-
-fpTS.close()
-fpRAW.close()
-
-print "Stopping Acquisition"
-stat = ABMengine.StopAcquisition()
-print 'Acquisition Stopped?: ' + str(stat)
+# Open the binary recording (converted to text files once acquisition is stopped)
+recording = ABMRecorder('RAWsamps.abr',nCh,channelNames=ChannelNames(nCh),deviceName=dinfo.chDeviceName)
+
+# the recording is closed, the session stopped and the text files written whatever happens
+try:
+	for i in range(10):
+		time.sleep(0.5)
+		
+		### Get Raw Data as a (nCount, nCh+6) array: 6 header values then each channel
+		rData = ABMengine.GetRawDataArray()
+		nCount = len(rData)
+		print str(nCount) + ' samples drawn'
+
+		### Get Time stamps, decoded to milliseconds
+		timeStamps = ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,nCount)
+
+		## Append the raw samples and time stamps to the recording
+		recording.write(rData,timeStamps)
+
+	######################################################################################
+	### Test Pausing, Resuming and Stopping Acquisition
+
+	print "Pausing Acquisition"
+	try:
+		session.pause()
+	except ABMError as e:
+		print 'Pause failed: ' + str(e)
+
+	print "Resuming Acquisition"
+	try:
+		session.resume()
+	except ABMError as e:
+		print 'Resume failed: ' + str(e)
+finally:
+	recording.close()
+
+	print "Stopping Acquisition"
+	try:
+		stat = session.stop()
+		print 'Acquisition Stopped?: ' + str(stat)
+	except ABMError as e:
+		print 'Stop failed: ' + str(e)
+
+	# Write the recording in text format
+	ExportCSV('RAWsamps.abr','RAWsamps.txt','timeStamps.txt')
 
 exit()
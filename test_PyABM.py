@@ -0,0 +1,238 @@
+#########################################################################
+#	test_PyABM.py
+#	Tests of the array getters, FrameRing, ABMStreamer and TimeStampUnwrapper
+#	of PyABM.py, against the SDK stand-ins of PyABMSim.py (no DLL needed)
+#
+#	Run this code by typing 'python -m pytest test_PyABM.py' or
+#	'python -m unittest test_PyABM' at the command prompt
+#########################################################################
+
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from PyABM import *
+from PyABMSim import FakeABMDLL, SimABMDLL
+
+# float* buffer of nCount frames of nCol values, frame i holding i*100 + column
+def _Buffer(nCount,nCol):
+	data = (c_float * (nCount * nCol))()
+	values = np.frombuffer(data,dtype=np.float32).reshape(nCount,nCol)
+	values[:] = np.arange(nCount)[:,None] * 100 + np.arange(nCol)
+	return (data,cast(data,POINTER(c_float)),values)
+
+# frames and uint32 timestamps numbered from start
+def _Frames(start,n,nCol=3):
+	frames = np.repeat(np.arange(start,start + n,dtype=np.float32)[:,None],nCol,axis=1)
+	return (frames,np.arange(start,start + n).astype(np.uint32))
+
+class FrameArrayTest(unittest.TestCase):
+	def test_copy_is_independent_of_the_buffer(self):
+		(data,pData,values) = _Buffer(4,2 + NUM_HEADER_COLUMNS)
+		frames = FrameArray(pData,4,2,copy=True)
+		self.assertEqual(frames.shape,(4,8))
+		self.assertEqual(frames.dtype,np.float32)
+		np.testing.assert_array_equal(frames,values)
+		values[:] = -1
+		self.assertEqual(frames[3,7],307)
+
+	def test_view_follows_the_buffer(self):
+		(data,pData,values) = _Buffer(4,2 + NUM_HEADER_COLUMNS)
+		frames = FrameArray(pData,4,2,copy=False)
+		self.assertEqual(frames.shape,(4,8))
+		self.assertTrue(np.shares_memory(frames,values))
+		values[1,0] = -1
+		self.assertEqual(frames[1,0],-1)
+
+	def test_copy_into_out(self):
+		(data,pData,values) = _Buffer(3,1 + NUM_HEADER_COLUMNS)
+		out = np.zeros((10,7),dtype=np.float32)
+		frames = FrameArray(pData,3,1,out=out)
+		self.assertEqual(frames.shape,(3,7))
+		self.assertTrue(np.shares_memory(frames,out))
+		np.testing.assert_array_equal(out[:3],values)
+		self.assertTrue((out[3:] == 0).all())
+
+	def test_out_is_checked(self):
+		(data,pData,values) = _Buffer(3,1 + NUM_HEADER_COLUMNS)
+		self.assertRaises(ValueError,FrameArray,pData,3,1,True,np.zeros((2,7),dtype=np.float32))
+		self.assertRaises(ValueError,FrameArray,pData,3,1,True,np.zeros((3,8),dtype=np.float32))
+		self.assertRaises(ValueError,FrameArray,pData,3,1,True,np.zeros((3,7),dtype=np.float64))
+		self.assertRaises(ValueError,FrameArray,pData,3,1,True,np.zeros((7,3),dtype=np.float32).T)
+
+	def test_no_samples(self):
+		(data,pData,values) = _Buffer(1,2 + NUM_HEADER_COLUMNS)
+		self.assertEqual(FrameArray(pData,0,2).shape,(0,8))
+		self.assertEqual(FrameArray(POINTER(c_float)(),5,2,copy=False).shape,(0,8))
+
+class ArrayGetterTest(unittest.TestCase):
+	def setUp(self):
+		self.ABMengine = ABMHandler(FakeABMDLL(nChannel=4,nCountPerCall=16))
+
+	def test_layout_from_device_info(self):
+		frames = self.ABMengine.GetRawDataArray()
+		self.assertEqual(self.ABMengine.nChannel,4)
+		self.assertEqual(frames.shape,(16,4 + NUM_HEADER_COLUMNS))
+		# Epoch and Offset of consecutive samples
+		index = frames[:,0].astype(np.int64) * 256 + frames[:,1].astype(np.int64)
+		np.testing.assert_array_equal(index,np.arange(16))
+
+	def test_view_is_overwritten_by_the_next_call(self):
+		view = self.ABMengine.GetRawDataArray(copy=False)
+		copy = self.ABMengine.GetRawDataArray(copy=True)
+		np.testing.assert_array_equal(view,copy)
+		self.assertEqual(copy[0,1],16)
+
+	def test_decoded_timestamps(self):
+		frames = self.ABMengine.GetRawDataArray()
+		timestamps = self.ABMengine.GetTimeStampsStreamData(TIMESTAMP_RAW,len(frames))
+		self.assertEqual(timestamps.dtype,np.uint32)
+		np.testing.assert_array_equal(timestamps,np.arange(16) * 1000 // 256)
+
+	def test_unknown_stream_type_does_not_call_the_sdk(self):
+		sdk = self.ABMengine.sdk
+		sdk.GetTimeStampsStreamData = None
+		self.assertRaises(ValueError,self.ABMengine.GetTimeStampsStreamData,99,1)
+
+class FrameRingTest(unittest.TestCase):
+	def test_read_in_order(self):
+		ring = FrameRing(8,3)
+		ring.write(*_Frames(0,3))
+		ring.write(*_Frames(3,2))
+		self.assertEqual(len(ring),5)
+		(frames,timestamps) = ring.read(4)
+		np.testing.assert_array_equal(timestamps,[0,1,2,3])
+		np.testing.assert_array_equal(frames[:,2],[0,1,2,3])
+		(frames,timestamps) = ring.read()
+		np.testing.assert_array_equal(timestamps,[4])
+		self.assertEqual(len(ring.read()[0]),0)
+		self.assertEqual(ring.overruns,0)
+
+	def test_wrap_around(self):
+		ring = FrameRing(8,3)
+		ring.write(*_Frames(0,6))
+		ring.read()
+		ring.write(*_Frames(6,5))		# slots 6, 7, 0, 1, 2
+		(frames,timestamps) = ring.read()
+		np.testing.assert_array_equal(timestamps,[6,7,8,9,10])
+		np.testing.assert_array_equal(frames[:,0],[6,7,8,9,10])
+
+	def test_overrun_keeps_the_newest_frames(self):
+		ring = FrameRing(8,3)
+		ring.write(*_Frames(0,6))
+		ring.read(2)
+		ring.write(*_Frames(6,7))		# 11 unread frames, 8 kept
+		self.assertEqual(len(ring),8)
+		(frames,timestamps) = ring.read()
+		np.testing.assert_array_equal(timestamps,np.arange(5,13))
+		self.assertEqual(ring.overruns,3)
+
+	def test_write_larger_than_capacity(self):
+		ring = FrameRing(4,3)
+		ring.write(*_Frames(0,10))
+		(frames,timestamps) = ring.read()
+		np.testing.assert_array_equal(timestamps,[6,7,8,9])
+		self.assertEqual(ring.overruns,6)
+
+	def test_latest_does_not_consume(self):
+		ring = FrameRing(8,3)
+		self.assertEqual(len(ring.latest(4)[0]),0)
+		ring.write(*_Frames(0,10))
+		(frames,timestamps) = ring.latest(3)
+		np.testing.assert_array_equal(timestamps,[7,8,9])
+		self.assertEqual(len(ring.latest(20)[0]),8)
+		self.assertEqual(len(ring.read()[0]),8)
+		np.testing.assert_array_equal(ring.latest(2)[1],[8,9])
+
+	def test_read_waits_for_the_producer(self):
+		ring = FrameRing(64,3)
+		def Produce():
+			for start in range(0,32,8):
+				time.sleep(0.01)
+				ring.write(*_Frames(start,8))
+		producer = threading.Thread(target=Produce)
+		producer.start()
+		(frames,timestamps) = ring.read(32,timeout=5)
+		producer.join()
+		np.testing.assert_array_equal(timestamps,np.arange(32))
+
+	def test_read_timeout(self):
+		ring = FrameRing(64,3)
+		ring.write(*_Frames(0,4))
+		t = time.time()
+		(frames,timestamps) = ring.read(8,timeout=0.05)
+		self.assertGreaterEqual(time.time() - t,0.04)
+		self.assertEqual(len(frames),4)
+
+class ABMStreamerTest(unittest.TestCase):
+	def _Start(self,**options):
+		ABMengine = ABMHandler(SimABMDLL(nChannel=4,speed=20.0))
+		ABMengine.GetDeviceInfo()
+		self.assertEqual(ABMengine.InitSession(3,ABM_SESSION_RAW,-1,0),INIT_SESSION_OK)
+		ABMengine.StartAcquisition()
+		streamer = ABMStreamer(ABMengine,**options)
+		streamer.start()
+		return (ABMengine,streamer)
+
+	def test_samples_arrive_without_gaps(self):
+		(ABMengine,streamer) = self._Start()
+		chunks = [streamer.read(256,timeout=2) for i in range(4)]
+		streamer.stop()
+		ABMengine.StopAcquisition()
+		self.assertIsNone(streamer.error)
+		frames = np.concatenate([c[0] for c in chunks])
+		timestamps = np.concatenate([c[1] for c in chunks])
+		self.assertEqual(len(frames),1024)
+		index = frames[:,0].astype(np.int64) * 256 + frames[:,1].astype(np.int64)
+		np.testing.assert_array_equal(np.diff(index),1)
+		self.assertTrue((np.diff(timestamps.astype(np.int64)) >= 0).all())
+		self.assertEqual(streamer.overruns,0)
+
+	def test_overruns_are_counted(self):
+		(ABMengine,streamer) = self._Start(bufferSeconds=1)
+		time.sleep(0.5)				# 10 s of samples at 20x, the ring holds 1 s
+		streamer.stop()
+		ABMengine.StopAcquisition()
+		(frames,timestamps) = streamer.read()
+		self.assertEqual(len(frames),256)
+		self.assertGreater(streamer.overruns,0)
+		self.assertEqual(streamer.overruns + len(frames),streamer.samples)
+
+class TimeStampUnwrapperTest(unittest.TestCase):
+	def test_rollover_in_a_batch(self):
+		unwrapper = TimeStampUnwrapper()
+		out = unwrapper.unwrap(np.array([2**32 - 2,2**32 - 1,0,1],dtype=np.uint32))
+		self.assertEqual(out.dtype,np.int64)
+		np.testing.assert_array_equal(out,2**32 + np.arange(-2,2))
+
+	def test_rollover_between_batches(self):
+		unwrapper = TimeStampUnwrapper()
+		unwrapper.unwrap(np.array([2**32 - 20,2**32 - 10],dtype=np.uint32))
+		np.testing.assert_array_equal(unwrapper.unwrap(np.array([5,15],dtype=np.uint32)),2**32 + np.array([5,15]))
+		np.testing.assert_array_equal(unwrapper.unwrap(np.array([25],dtype=np.uint32)),[2**32 + 25])
+
+	def test_late_sample_from_before_the_rollover(self):
+		unwrapper = TimeStampUnwrapper()
+		out = unwrapper.unwrap(np.array([2**32 - 10,5,2**32 - 5,10],dtype=np.uint32))
+		np.testing.assert_array_equal(out,2**32 + np.array([-10,5,-5,10]))
+		# a late sample at the start of the next batch
+		out = unwrapper.unwrap(np.array([2**32 - 1,20],dtype=np.uint32))
+		np.testing.assert_array_equal(out,2**32 + np.array([-1,20]))
+
+	def test_several_rollovers(self):
+		unwrapper = TimeStampUnwrapper()
+		expected = np.arange(16,dtype=np.int64) * 2**30		# a rollover every 4 timestamps
+		raw = (expected % 2**32).astype(np.uint32)
+		out = np.concatenate([unwrapper.unwrap(raw[i:i+3]) for i in range(0,16,3)])
+		np.testing.assert_array_equal(out,expected)
+
+	def test_streams_unwrap_separately(self):
+		ABMengine = ABMHandler(FakeABMDLL(nChannel=1))
+		ABMengine.tsUnwrappers[TIMESTAMP_RAW].unwrap([2**32 - 1,0])
+		self.assertEqual(ABMengine.tsUnwrappers[TIMESTAMP_RAW].offset,2**32)
+		self.assertEqual(ABMengine.tsUnwrappers[TIMESTAMP_PSD].offset,0)
+
+if __name__ == '__main__':
+	unittest.main()
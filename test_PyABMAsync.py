@@ -0,0 +1,122 @@
+#########################################################################
+#	test_PyABMAsync.py
+#	Tests of PyABMAsync.py against the simulated SDK (Python 3.5+)
+#
+#	Run this code by typing 'python -m pytest test_PyABMAsync.py' or
+#	'python -m unittest test_PyABMAsync' at the command prompt
+#########################################################################
+
+import asyncio
+import threading
+import unittest
+
+from PyABM import *
+from PyABMAsync import AsyncABMHandler, LoopLagMonitor
+from PyABMSim import SimABMDLL
+
+# seconds every simulated SDK call blocks
+CALL_LATENCY = 0.01
+# the loop has to stay well below the duration of one SDK call
+MAX_P99_LAG = 0.5 * CALL_LATENCY
+MAX_LAG = 2 * CALL_LATENCY
+
+## ReentryCheck
+#	Wraps the functions of a stand-in SDK: counts the calls made while another call is still
+#	running, on any thread, and raises AssertionError in the overlapping call
+class ReentryCheck(object):
+	def __init__(self,abmDLL):
+		self.lock = threading.Lock()
+		self.calls = 0
+		self.overlaps = 0
+		for name in abmDLL.FUNCTIONS:
+			setattr(abmDLL,name,_CheckedFunction(getattr(abmDLL,name),self))
+
+class _CheckedFunction(object):
+	def __init__(self,func,check):
+		self.func = func
+		self.check = check
+
+	# ABMBinding sets restype/argtypes on the function it is given
+	def __setattr__(self,name,value):
+		if name in ('restype','argtypes'):
+			setattr(self.func,name,value)
+		else:
+			object.__setattr__(self,name,value)
+
+	def __call__(self,*args):
+		if not self.check.lock.acquire(False):
+			self.check.overlaps += 1
+			raise AssertionError('SDK call made while another one is running')
+		try:
+			self.check.calls += 1
+			return self.func(*args)
+		finally:
+			self.check.lock.release()
+
+def _Run(coroutine):
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete(coroutine)
+	finally:
+		loop.close()
+
+class AsyncStreamingTest(unittest.TestCase):
+	def setUp(self):
+		self.sim = SimABMDLL(nChannel=24,speed=20.0,callLatency=CALL_LATENCY,eventRate=50.0)
+		self.check = ReentryCheck(self.sim)
+		self.ABMengine = ABMHandler(self.sim)
+
+	async def _Stream(self,seconds):
+		loop = asyncio.get_event_loop()
+		monitor = LoopLagMonitor()
+		async with AsyncABMHandler(self.ABMengine) as sdk:
+			await sdk.GetDeviceInfo()
+			self.assertEqual(await sdk.InitSession(3,ABM_SESSION_RAW,-1,0),INIT_SESSION_OK)
+			await sdk.StartAcquisition()
+			monitor.start()
+			stream = sdk.stream(interval=0.005)
+			tEnd = loop.time() + seconds
+			nSamples = [0]
+			async def Consume(iterator,count):
+				async for batch in iterator:
+					nSamples[0] += count(batch)
+					if loop.time() >= tEnd:
+						break
+			async def Query():
+				while loop.time() < tEnd:
+					await asyncio.gather(sdk.GetCurrentSDKMode(),sdk.GetCurrentSDKMode())
+			await asyncio.gather(Consume(stream.raw(),lambda batch: len(batch[0])),
+								 Consume(stream.third_party(),lambda batch: 0),Query())
+			stream.close()
+			await sdk.StopAcquisition()
+			monitor.stop()
+		return (nSamples[0],monitor)
+
+	def test_loop_lag_stays_flat(self):
+		(nSamples,monitor) = _Run(self._Stream(2.0))
+		self.assertGreater(nSamples,0)
+		self.assertGreater(len(monitor.lags),100)
+		self.assertLess(monitor.percentile(99),MAX_P99_LAG)
+		self.assertLess(max(monitor.lags),MAX_LAG)
+
+	def test_sdk_calls_never_overlap(self):
+		_Run(self._Stream(1.0))
+		self.assertGreater(self.check.calls,50)
+		self.assertEqual(self.check.overlaps,0)
+
+	def test_aclose_does_not_block_the_loop(self):
+		async def Close():
+			sdk = AsyncABMHandler(self.ABMengine)
+			pending = asyncio.ensure_future(sdk.GetCurrentSDKMode())
+			await asyncio.sleep(0)
+			monitor = LoopLagMonitor()
+			monitor.start()
+			await sdk.aclose()
+			monitor.stop()
+			await pending
+			return monitor
+		monitor = _Run(Close())
+		self.assertLess(max(monitor.lags),CALL_LATENCY)
+
+if __name__ == '__main__':
+	unittest.main()